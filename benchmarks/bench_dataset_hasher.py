@@ -0,0 +1,85 @@
+"""Measures the throughput of the dataset hashing on large synthetic IATI files
+
+Compares hashing a downloaded dataset as a string (encoding it and running a regex over the whole
+document, as the service used to), with the streaming DatasetHasher fed 1 MiB chunks.
+
+Run from the repository root with:
+
+    PYTHONPATH=src python benchmarks/bench_dataset_hasher.py
+"""
+
+import hashlib
+import re
+import time
+
+from utilities.misc import DatasetHasher
+
+CHUNK_SIZE = 1024 * 1024
+
+ACTIVITY = """<iati-activity last-updated-datetime="2024-05-01T00:00:00Z" xml:lang="en" default-currency="USD">
+ <iati-identifier>XM-EXAMPLE-{number}</iati-identifier>
+ <reporting-org ref="XM-EXAMPLE" type="21"><narrative>Example Organisation</narrative></reporting-org>
+ <title><narrative>Example activity number {number} with a reasonably long title</narrative></title>
+ <description type="1"><narrative>{description}</narrative></description>
+ <activity-status code="2"/>
+ <activity-date iso-date="2023-01-01" type="1"/>
+ <transaction><transaction-type code="3"/><transaction-date iso-date="2023-06-30"/>
+  <value currency="USD" value-date="2023-06-30">{number}00.00</value></transaction>
+</iati-activity>
+"""
+
+
+def make_synthetic_dataset(size_mb: int) -> bytes:
+    header = '<?xml version="1.0"?>\n<iati-activities version="2.03" generated-datetime="2024-05-03T08:47:49+00:00">\n'
+    description = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 10
+
+    activities = []
+    total_size = len(header)
+    number = 0
+    while total_size < size_mb * 1024 * 1024:
+        activity = ACTIVITY.format(number=number, description=description)
+        activities.append(activity)
+        total_size += len(activity)
+        number += 1
+
+    return (header + "".join(activities) + "</iati-activities>\n").encode("utf-8")
+
+
+def hash_as_string(data: bytes) -> tuple[str, str]:
+    content = data.decode("utf-8")
+    return (
+        hashlib.sha1(content.encode("utf-8")).hexdigest(),
+        hashlib.sha1(re.sub(r'generated-datetime="[^"]+"', "", content).encode("utf-8")).hexdigest(),
+    )
+
+
+def hash_streaming(data: bytes) -> tuple[str, str]:
+    hasher = DatasetHasher()
+    view = memoryview(data)
+    for i in range(0, len(data), CHUNK_SIZE):
+        hasher.update(view[i : i + CHUNK_SIZE].tobytes())
+    return hasher.hexdigest(), hasher.hexdigest_excluding_generated_timestamp()
+
+
+def time_hashing(hash_function, data: bytes, repeats: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        hash_function(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    for size_mb in [10, 100]:
+        data = make_synthetic_dataset(size_mb)
+
+        assert hash_as_string(data) == hash_streaming(data)
+
+        for name, hash_function in [("string + regex", hash_as_string), ("DatasetHasher", hash_streaming)]:
+            seconds = time_hashing(hash_function, data)
+            print("{:>4} MB  {:<16} {:8.1f} MB/s".format(size_mb, name, len(data) / (1024 * 1024) / seconds))
+
+
+if __name__ == "__main__":
+    main()
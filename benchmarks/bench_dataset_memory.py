@@ -0,0 +1,171 @@
+"""Measures the memory used by the in-memory dataset state of the checker and zipper
+
+Builds the maps which checker_service_loop holds for 30,000 synthetic datasets: on startup, just
+datasets_in_bds (loaded from the DB), and after a checker run, also registered_datasets (from the
+Registry, with the registration info copied into datasets_in_bds) and datasets_in_working_dir
+(the zipper's entries recording the hash of each dataset in its working dir). This is done with
+plain dicts, as the service used to, and with BDSDataset records, and the memory allocated for each
+is reported.
+
+Run from the repository root with:
+
+    PYTHONPATH=src python benchmarks/bench_dataset_memory.py
+"""
+
+import datetime
+import gc
+import json
+import random
+import tracemalloc
+import uuid
+from typing import Callable
+
+from utilities.bds_dataset import BDSDataset
+
+NUMBER_OF_DATASETS = 30000
+NUMBER_OF_PUBLISHERS = 1200
+
+REGISTRATION_FIELDS = [
+    "publisher_id",
+    "publisher_name",
+    "type",
+    "source_url",
+    "registration_service_dataset_metadata",
+    "registration_service_publisher_metadata",
+    "registration_service_name",
+]
+
+
+def make_publishers() -> list[dict]:
+    return [
+        {
+            "id": uuid.uuid4(),
+            "name": "publisher_{}".format(number),
+            "metadata": json.dumps(
+                {
+                    "name": "publisher_{}".format(number),
+                    "title": "Example Publisher Organisation {}".format(number),
+                    "publisher_contact": "Example Street {}\r\nExample City\r\nExample Country".format(number),
+                    "publisher_iati_id": "XM-EXAMPLE-{}".format(number),
+                    "publisher_description": "An example publisher. " * 30,
+                }
+            ),
+        }
+        for number in range(NUMBER_OF_PUBLISHERS)
+    ]
+
+
+def make_registered_fields(number: int, publisher: dict) -> dict:
+    dataset_id = uuid.UUID(int=number)
+    return {
+        "id": dataset_id,
+        "name": "{}-dataset-{}".format(publisher["name"], number),
+        "publisher_id": publisher["id"],
+        "publisher_name": publisher["name"],
+        "type": random.choice(["activity", "organisation"]),
+        "source_url": "https://example.org/{}/dataset-{}.xml".format(publisher["name"], number),
+        "registration_service_dataset_metadata": json.dumps(
+            {
+                "id": str(dataset_id),
+                "name": "{}-dataset-{}".format(publisher["name"], number),
+                "metadata_modified": "2024-05-07T15:38:58.740018",
+                "resources": [{"url": "https://example.org/{}/dataset-{}.xml".format(publisher["name"], number)}],
+                "extras": [{"key": "filetype", "value": "activity"}, {"key": "iati_version", "value": "2.03"}],
+                "notes": "An example dataset. " * 40,
+            }
+        ),
+        "registration_service_publisher_metadata": publisher["metadata"],
+        "registration_service_name": "ckan-registry",
+    }
+
+
+def make_db_row(registered_fields: dict) -> dict:
+    timestamp = datetime.datetime.now(datetime.UTC)
+
+    row = {
+        field: value.encode("utf-8").decode("utf-8") if isinstance(value, str) else value
+        for field, value in registered_fields.items()
+    }
+
+    return row | {
+        "hash": "{:040x}".format(random.getrandbits(160)),
+        "hash_excluding_generated_timestamp": "{:040x}".format(random.getrandbits(160)),
+        "last_update_check": timestamp,
+        "last_head_attempt": timestamp,
+        "last_head_http_status": 200,
+        "head_error_message": None,
+        "last_verified_on_server": timestamp,
+        "last_download_attempt": timestamp,
+        "last_download_http_status": 200,
+        "last_successful_download": timestamp,
+        "download_error_message": None,
+        "content_modified": timestamp,
+        "content_modified_excluding_generated_timestamp": timestamp,
+        "server_header_last_modified": timestamp,
+        "server_header_etag": '"{:016x}"'.format(random.getrandbits(64)),
+    }
+
+
+def build_state(make_record: Callable[[dict], dict], publishers: list[dict], checker_run: bool) -> tuple:
+    """Returns the maps as they are on startup, or after a checker run, with records made by make_record"""
+
+    random.seed(1)
+
+    registered_fields = [
+        make_registered_fields(number, publishers[number % NUMBER_OF_PUBLISHERS])
+        for number in range(NUMBER_OF_DATASETS)
+    ]
+
+    # each row fetched from the DB has its own copy of every value
+    datasets_in_bds = {fields["id"]: make_record(make_db_row(fields)) for fields in registered_fields}
+
+    if not checker_run:
+        return (datasets_in_bds,)
+
+    # while the Registry's publisher metadata comes from a single cache
+    registered_datasets = {fields["id"]: make_record(fields) for fields in registered_fields}
+
+    del registered_fields
+
+    for dataset_id, registered_dataset in registered_datasets.items():
+        for field in REGISTRATION_FIELDS:
+            datasets_in_bds[dataset_id][field] = registered_dataset[field]
+
+    datasets_in_working_dir = {
+        dataset_id: {field: dataset[field] for field in ["id", "name", "publisher_name", "hash"]}
+        for dataset_id, dataset in datasets_in_bds.items()
+    }
+
+    return datasets_in_bds, registered_datasets, datasets_in_working_dir
+
+
+def measure(make_record: Callable[[dict], dict], publishers: list[dict], checker_run: bool) -> int:
+    gc.collect()
+    tracemalloc.start()
+
+    state = build_state(make_record, publishers, checker_run)
+
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del state
+
+    return size
+
+
+def main():
+    publishers = make_publishers()
+
+    for state, checker_run in [("on startup", False), ("after checker run", True)]:
+        for name, make_record in [("dict", dict), ("BDSDataset", BDSDataset)]:
+            size = measure(make_record, publishers, checker_run)
+            print(
+                "{:<18} {:<12} {:8.1f} MB for {} datasets ({:6.0f} bytes per dataset)".format(
+                    state, name, size / (1024 * 1024), NUMBER_OF_DATASETS, size / NUMBER_OF_DATASETS
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Measures the throughput of compressing files into a ZIP archive with increasing numbers of processes
+
+Writes synthetic IATI XML files to a temporary directory, then builds a ZIP archive of them with
+ZipWriter, first compressing in a single process (as zipfile and shutil.make_archive do), then with
+a pool of 2, 4, ... processes, up to the number of CPUs. The throughput (MB of XML per second) and
+the speedup over a single process are reported.
+
+Run from the repository root with:
+
+    PYTHONPATH=src python benchmarks/bench_zip_compression.py
+"""
+
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utilities.zip_writer import ZipWriter
+
+NUMBER_OF_FILES = 200
+FILE_SIZE_MB = 1
+
+ACTIVITY = """<iati-activity last-updated-datetime="2024-05-01T00:00:00Z" xml:lang="en" default-currency="USD">
+ <iati-identifier>XM-EXAMPLE-{number}</iati-identifier>
+ <title><narrative>Example activity {number} ({words})</narrative></title>
+ <transaction><transaction-type code="3"/><transaction-date iso-date="2023-06-30"/>
+  <value currency="USD" value-date="2023-06-30">{value}.00</value></transaction>
+</iati-activity>
+"""
+
+WORDS = ["water", "health", "education", "sanitation", "training", "district", "programme", "support", "rural"]
+
+
+def make_synthetic_dataset(size_mb: int) -> bytes:
+    activities = ['<?xml version="1.0"?>\n<iati-activities version="2.03">\n']
+    total_size = len(activities[0])
+    number = 0
+    while total_size < size_mb * 1024 * 1024:
+        activity = ACTIVITY.format(
+            number=number, words=" ".join(random.choices(WORDS, k=12)), value=random.randrange(1000000)
+        )
+        activities.append(activity)
+        total_size += len(activity)
+        number += 1
+    activities.append("</iati-activities>\n")
+    return "".join(activities).encode("utf-8")
+
+
+def write_files(dir_name: str) -> list[str]:
+    random.seed(1)
+    pathnames = []
+    for number in range(NUMBER_OF_FILES):
+        pathname = os.path.join(dir_name, "dataset-{}.xml".format(number))
+        with open(pathname, "wb") as xml_file:
+            xml_file.write(make_synthetic_dataset(FILE_SIZE_MB))
+        pathnames.append(pathname)
+    return pathnames
+
+
+def zip_files(pathnames: list[str], zip_pathname: str, processes: int) -> float:
+    """Returns the time taken to zip the files, compressing them with the given number of processes"""
+
+    executor = None
+    if processes > 1:
+        executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+        # starts the processes before timing
+        list(executor.map(abs, range(processes)))
+
+    start = time.perf_counter()
+
+    with open(zip_pathname, "wb") as zip_fileobj, ZipWriter(zip_fileobj, logging.getLogger(), executor) as zip_writer:
+        for pathname in pathnames:
+            zip_writer.add_file(os.path.basename(pathname), pathname)
+
+    elapsed = time.perf_counter() - start
+
+    if executor is not None:
+        executor.shutdown()
+
+    return elapsed
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    process_counts = [1] + [processes for processes in [2, 4, 8, 16, 32] if processes <= cpu_count]
+
+    with tempfile.TemporaryDirectory() as dir_name:
+        pathnames = write_files(dir_name)
+        total_mb = sum(os.path.getsize(pathname) for pathname in pathnames) / (1024 * 1024)
+
+        single_process_time = None
+        for processes in process_counts:
+            elapsed = zip_files(pathnames, os.path.join(dir_name, "archive.zip"), processes)
+            single_process_time = single_process_time or elapsed
+            print(
+                "{:>2} processes: {:7.1f} MB/s ({:.0f} MB in {:5.2f}s), {:4.1f}x speedup".format(
+                    processes, total_mb / elapsed, total_mb, elapsed, single_process_time / elapsed
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+--
+-- depends: 20240827_01_pVOLG
+DROP TABLE IF EXISTS registry_sync_state;
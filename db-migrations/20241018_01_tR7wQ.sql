@@ -0,0 +1,15 @@
+--
+-- depends: 20240827_01_pVOLG
+--
+CREATE TABLE registry_sync_state
+(
+    registry_url        VARCHAR NOT NULL PRIMARY KEY,
+    high_water_mark     VARCHAR,
+    last_full_sync      TIMESTAMP WITH TIME ZONE
+);
+
+COMMENT ON TABLE registry_sync_state IS 'the state of the incremental sync with each data registration service URL';
+
+COMMENT ON COLUMN registry_sync_state.high_water_mark IS 'the latest metadata_modified value of any dataset fetched from the registration service';
+
+COMMENT ON COLUMN registry_sync_state.last_full_sync IS 'the time of the last sync which fetched all datasets from the registration service';
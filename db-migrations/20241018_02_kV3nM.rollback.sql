@@ -0,0 +1,14 @@
+--
+-- depends: 20241018_01_tR7wQ
+ALTER TABLE
+    iati_datasets
+ALTER COLUMN
+    registration_service_dataset_metadata SET COMPRESSION DEFAULT;
+
+ALTER TABLE
+    iati_datasets
+ALTER COLUMN
+    registration_service_publisher_metadata SET COMPRESSION DEFAULT;
+
+ALTER TABLE
+    iati_datasets RESET (toast_tuple_target);
@@ -0,0 +1,17 @@
+--
+-- depends: 20241018_01_tR7wQ
+--
+ALTER TABLE
+    iati_datasets
+ALTER COLUMN
+    registration_service_dataset_metadata SET COMPRESSION lz4;
+
+ALTER TABLE
+    iati_datasets
+ALTER COLUMN
+    registration_service_publisher_metadata SET COMPRESSION lz4;
+
+-- rows are compressed once they are over this size (rather than the default of about 2kB),
+-- so that the registration metadata of a typical dataset is compressed
+ALTER TABLE
+    iati_datasets SET (toast_tuple_target = 512);
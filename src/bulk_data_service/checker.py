@@ -4,10 +4,11 @@ import traceback
 import uuid
 
 from bulk_data_service.dataset_indexing import create_and_upload_indices
+from bulk_data_service.dataset_reconciliation import reconcile_blobs_with_datasets
 from bulk_data_service.dataset_remover import remove_deleted_datasets_from_bds, remove_expired_downloads
 from bulk_data_service.dataset_updater import add_or_update_datasets
 from bulk_data_service.zipper import zipper_run
-from dataset_registration.registration_services import get_registered_datasets
+from dataset_registration.registration_services import get_registered_datasets, save_registration_sync_state
 from utilities.db import get_datasets_in_bds
 from utilities.prometheus import initialise_prometheus_client, update_metrics_from_db
 
@@ -15,16 +16,20 @@ from utilities.prometheus import initialise_prometheus_client, update_metrics_fr
 def checker(context: dict):
     context = initialise_prometheus_client(context)
 
+    datasets_in_bds = get_datasets_in_bds(context)
+
+    if context["reconcile_blobs"]:
+        reconcile_blobs_with_datasets(context, datasets_in_bds)
+
     if context["single_run"]:
-        checker_run(context, get_datasets_in_bds(context))
+        checker_run(context, datasets_in_bds)
     else:
-        checker_service_loop(context)
+        checker_service_loop(context, datasets_in_bds)
 
 
-def checker_service_loop(context: dict):
+def checker_service_loop(context: dict, datasets_in_bds: dict[uuid.UUID, dict]):
 
     datasets_in_zip = {}  # type: dict[uuid.UUID, dict]
-    datasets_in_bds = get_datasets_in_bds(context)
 
     while True:
         try:
@@ -67,6 +72,8 @@ def checker_run(context: dict, datasets_in_bds: dict[uuid.UUID, dict]):
 
     add_or_update_datasets(context, datasets_in_bds, registered_datasets)
 
+    save_registration_sync_state(context)
+
     remove_expired_downloads(context, datasets_in_bds)
 
     create_and_upload_indices(context, datasets_in_bds)
@@ -0,0 +1,68 @@
+import uuid
+
+from azure.storage.blob import BlobProperties, BlobServiceClient
+
+from utilities.azure import azure_list_blob_properties, get_azure_blob_name, get_azure_container_name
+from utilities.db import db_connection, insert_or_update_datasets
+
+
+def reconcile_blobs_with_datasets(context: dict, datasets_in_bds: dict[uuid.UUID, dict]):
+    """Checks that every downloaded dataset has its XML and ZIP blobs in Azure, with the expected hash
+
+    The blobs are listed in bulk (a few thousand per request) rather than checked one at a time. Any
+    dataset whose blobs are missing, or have a hash in their metadata different to the one in the
+    database, has its hash and server headers cleared, so it is downloaded and uploaded again in full
+    on the next checker run. Blobs uploaded before the hash was stored in their metadata are only
+    checked for existence."""
+
+    context["logger"].info("Reconciling Azure blobs with datasets in database")
+
+    az_blob_service = BlobServiceClient.from_connection_string(context["AZURE_STORAGE_CONNECTION_STRING"])
+
+    blobs = {
+        iati_blob_type: azure_list_blob_properties(az_blob_service, get_azure_container_name(context, iati_blob_type))
+        for iati_blob_type in ["xml", "zip"]
+    }
+
+    az_blob_service.close()
+
+    datasets_to_redownload = [
+        dataset
+        for dataset in datasets_in_bds.values()
+        if dataset["hash"] is not None and not dataset_blobs_match(dataset, blobs)
+    ]
+
+    for dataset in datasets_to_redownload:
+        context["logger"].warning(
+            "dataset id: {} - Azure blobs missing or don't match hash in database, "
+            "so clearing hash to force a redownload".format(dataset["id"])
+        )
+
+        dataset["hash"] = None
+        dataset["hash_excluding_generated_timestamp"] = None
+        dataset["server_header_etag"] = None
+        dataset["server_header_last_modified"] = None
+
+    with db_connection(context) as db_conn:
+        insert_or_update_datasets(db_conn, datasets_to_redownload)
+
+    context["logger"].info(
+        "Reconciliation finished. Datasets checked: {}. Datasets to redownload: {}".format(
+            len(datasets_in_bds), len(datasets_to_redownload)
+        )
+    )
+
+
+def dataset_blobs_match(dataset: dict, blobs: dict[str, dict[str, BlobProperties]]) -> bool:
+    for iati_blob_type, blobs_of_type in blobs.items():
+        blob_name = get_azure_blob_name(dataset, iati_blob_type)
+
+        if blob_name not in blobs_of_type:
+            return False
+
+        blob_hash = (blobs_of_type[blob_name].metadata or {}).get("hash")
+
+        if blob_hash is not None and blob_hash != dataset["hash"]:
+            return False
+
+    return True
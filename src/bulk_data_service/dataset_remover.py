@@ -2,11 +2,10 @@ import uuid
 from datetime import timedelta
 from typing import Any
 
-import psycopg
 from azure.storage.blob import BlobServiceClient
 
 from utilities.azure import delete_azure_iati_blob
-from utilities.db import get_db_connection, insert_or_update_dataset, remove_dataset_from_db
+from utilities.db import db_connection, insert_or_update_dataset, remove_dataset_from_db
 from utilities.misc import get_timestamp
 
 
@@ -14,8 +13,6 @@ def remove_deleted_datasets_from_bds(
     context: dict[str, Any], datasets_in_bds: dict[uuid.UUID, dict], registered_datasets: dict[uuid.UUID, dict]
 ):
 
-    db_conn = get_db_connection(context)
-
     az_blob_service = BlobServiceClient.from_connection_string(context["AZURE_STORAGE_CONNECTION_STRING"])
 
     ids_to_delete = [k for k in datasets_in_bds.keys() if k not in registered_datasets]
@@ -29,7 +26,9 @@ def remove_deleted_datasets_from_bds(
             "service so removing from Bulk Data Service".format(id)
         )
 
-        remove_dataset_from_db(db_conn, id)
+        # a pooled connection is only held for the DB change, not while the blobs are deleted
+        with db_connection(context) as db_conn:
+            remove_dataset_from_db(db_conn, id)
 
         delete_azure_iati_blob(context, az_blob_service, datasets_in_bds[id], "xml")
 
@@ -39,31 +38,25 @@ def remove_deleted_datasets_from_bds(
 
     az_blob_service.close()
 
-    db_conn.close()
-
 
 def remove_expired_downloads(context: dict[str, Any], datasets_in_bds: dict[uuid.UUID, dict]):
 
-    db_conn = get_db_connection(context)
-
     az_blob_service = BlobServiceClient.from_connection_string(context["AZURE_STORAGE_CONNECTION_STRING"])
 
     expired_datasets = 0
 
     for dataset in datasets_in_bds.values():
         if dataset_has_expired(context, dataset):
-            remove_download_for_expired_dataset(context, db_conn, az_blob_service, dataset)
+            remove_download_for_expired_dataset(context, az_blob_service, dataset)
             expired_datasets += 1
 
     context["prom_metrics"]["datasets_expired"].set(expired_datasets)
 
     az_blob_service.close()
 
-    db_conn.close()
-
 
 def remove_download_for_expired_dataset(
-    context: dict[str, Any], db_conn: psycopg.Connection, az_blob_service: BlobServiceClient, bds_dataset: dict
+    context: dict[str, Any], az_blob_service: BlobServiceClient, bds_dataset: dict
 ) -> dict:
 
     max_hours = int(context["REMOVE_LAST_GOOD_DOWNLOAD_AFTER_FAILING_HOURS"])
@@ -78,7 +71,8 @@ def remove_download_for_expired_dataset(
     bds_dataset["hash"] = None
     bds_dataset["hash_excluding_generated_timestamp"] = None
 
-    insert_or_update_dataset(db_conn, bds_dataset)
+    with db_connection(context) as db_conn:
+        insert_or_update_dataset(db_conn, bds_dataset)
 
     delete_azure_iati_blob(context, az_blob_service, bds_dataset, "xml")
 
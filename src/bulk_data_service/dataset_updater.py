@@ -1,25 +1,28 @@
 import concurrent.futures
 import json
-import traceback
+import tempfile
 import uuid
 from datetime import datetime, timedelta
-from itertools import batched
 from random import random
+from typing import BinaryIO, Mapping
 
-import psycopg
 import requests
 from azure.storage.blob import BlobServiceClient
 
-from utilities.azure import azure_blob_exists, azure_upload_to_blob
-from utilities.db import get_db_connection, insert_or_update_dataset
-from utilities.http import get_requests_session, http_download_dataset, http_head_dataset, parse_last_modified_header
-from utilities.misc import (
-    get_hash,
-    get_hash_excluding_generated_timestamp,
-    get_timestamp,
-    set_timestamp_tz_utc,
-    zip_data_as_single_file,
+from bulk_data_service.download_scheduler import HostScheduler, create_host_scheduler
+from utilities.azure import azure_upload_to_blob, get_azure_blob_name, get_azure_blob_service
+from utilities.bds_dataset import BDSDataset
+from utilities.db import DatasetWriteBuffer, create_dataset_write_buffer
+from utilities.http import (
+    get_conditional_request_headers,
+    get_requests_session,
+    http_download_dataset,
+    parse_last_modified_header,
 )
+from utilities.misc import DatasetHasher, get_file_md5, get_timestamp, zip_file_as_single_file
+
+# size of the chunks in which datasets are streamed to disk and hashed
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 
 def add_or_update_datasets(
@@ -29,48 +32,68 @@ def add_or_update_datasets(
     context["prom_metrics"]["total_number_of_datasets"].set(len(registered_datasets))
     context["prom_metrics"]["datasets_added"].set(len(registered_datasets) - len(datasets_in_bds))
 
-    threads = []
+    if context["DOWNLOADER_ENGINE"] == "asyncio":
+        from bulk_data_service.dataset_updater_async import add_or_update_datasets_async
+
+        add_or_update_datasets_async(context, datasets_in_bds, registered_datasets)
+        return
 
-    num_batches = int(len(registered_datasets) / int(context["NUMBER_DOWNLOADER_THREADS"])) + 1
+    scheduler = create_host_scheduler(context, registered_datasets)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_batches) as executor:
-        for dataset_batch_ids in batched(registered_datasets, num_batches):
+    db_writer = create_dataset_write_buffer(context)
 
-            dataset_batch = {k: registered_datasets[k] for k in dataset_batch_ids}
+    number_of_workers = max(1, min(int(context["NUMBER_DOWNLOADER_THREADS"]), len(registered_datasets)))
 
-            threads.append(executor.submit(add_or_update_dataset_batch, context, datasets_in_bds, dataset_batch))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=number_of_workers) as executor:
+            workers = [
+                executor.submit(
+                    add_or_update_datasets_worker, context, datasets_in_bds, registered_datasets, scheduler, db_writer
+                )
+                for _ in range(number_of_workers)
+            ]
 
-        for future in concurrent.futures.as_completed(threads):
-            future.result()
+            for future in concurrent.futures.as_completed(workers):
+                future.result()
+    finally:
+        db_writer.flush()
 
 
-def add_or_update_dataset_batch(
-    context: dict, datasets_in_bds: dict[uuid.UUID, dict], registered_datasets_to_update: dict[uuid.UUID, dict]
+def add_or_update_datasets_worker(
+    context: dict,
+    datasets_in_bds: dict[uuid.UUID, dict],
+    registered_datasets: dict[uuid.UUID, dict],
+    scheduler: HostScheduler,
+    db_writer: DatasetWriteBuffer,
 ):
+    """Takes datasets one at a time from the shared scheduler and checks/downloads them until none are left
 
-    db_conn = get_db_connection(context)
+    Each worker pulls its next dataset only when it has finished the previous one, so a worker that hits
+    several slow servers simply processes fewer datasets, rather than delaying a fixed batch. Changes to
+    datasets are written to the DB in batches by the shared db_writer."""
 
-    az_blob_service = BlobServiceClient.from_connection_string(context["AZURE_STORAGE_CONNECTION_STRING"])
+    az_blob_service = get_azure_blob_service(context)
 
     session = get_requests_session()
 
-    for registered_dataset_id in registered_datasets_to_update:
-
-        add_or_update_registered_dataset(
-            context,
-            registered_dataset_id,
-            datasets_in_bds,
-            registered_datasets_to_update,
-            az_blob_service,
-            session,
-            db_conn,
-        )
-
-    session.close()
-
-    az_blob_service.close()
+    try:
+        while (registered_dataset_id := scheduler.next_dataset()) is not None:
+            try:
+                add_or_update_registered_dataset(
+                    context,
+                    registered_dataset_id,
+                    datasets_in_bds,
+                    registered_datasets,
+                    az_blob_service,
+                    session,
+                    db_writer,
+                )
+            finally:
+                scheduler.dataset_finished(registered_dataset_id)
+    finally:
+        session.close()
 
-    db_conn.close()
+        az_blob_service.close()
 
 
 def add_or_update_registered_dataset(
@@ -80,9 +103,33 @@ def add_or_update_registered_dataset(
     registered_datasets: dict[uuid.UUID, dict],
     az_blob_service: BlobServiceClient,
     session: requests.Session,
-    db_conn: psycopg.Connection,
+    db_writer: DatasetWriteBuffer,
 ):
 
+    bds_dataset = get_bds_dataset_for_update_check(datasets_in_bds, registered_datasets, registered_dataset_id)
+
+    download_within_hours = get_randomised_download_within_hours(context)
+
+    only_if_changed = download_only_if_changed(bds_dataset, download_within_hours)
+
+    try:
+        download_and_save_dataset(
+            context, session, az_blob_service, db_writer, bds_dataset, only_if_changed, download_within_hours
+        )
+    except RuntimeError as e:
+        record_dataset_download_failure(context, db_writer, bds_dataset, e, only_if_changed, download_within_hours)
+    except Exception as e:
+        record_dataset_download_exception(context, db_writer, bds_dataset, e)
+
+
+def get_bds_dataset_for_update_check(
+    datasets_in_bds: dict[uuid.UUID, dict],
+    registered_datasets: dict[uuid.UUID, dict],
+    registered_dataset_id: uuid.UUID,
+) -> dict:
+
+    bds_dataset: dict
+
     if registered_dataset_id not in datasets_in_bds:
         bds_dataset = create_bds_dataset(registered_datasets[registered_dataset_id])
         datasets_in_bds[registered_dataset_id] = bds_dataset
@@ -90,50 +137,70 @@ def add_or_update_registered_dataset(
         bds_dataset = datasets_in_bds[registered_dataset_id]
         update_bds_dataset_registration_info(bds_dataset, registered_datasets[registered_dataset_id])
 
-    attempt_download = True
-
     bds_dataset["last_update_check"] = get_timestamp()
 
-    download_within_hours = get_randomised_download_within_hours(context)
+    return bds_dataset
 
-    if dataset_downloaded_within(bds_dataset, download_within_hours):
 
-        attempt_download = check_dataset_etag_last_mod_header(
-            context, db_conn, session, bds_dataset, download_within_hours
-        )
+def get_download_request_headers(bds_dataset: dict, only_if_changed: bool) -> dict[str, str]:
+    if not only_if_changed:
+        return {}
 
-    if attempt_download:
-        try:
-            download_and_save_dataset(context, session, az_blob_service, bds_dataset)
+    return get_conditional_request_headers(
+        bds_dataset["server_header_etag"], bds_dataset["server_header_last_modified"]
+    )
 
-            datasets_in_bds[registered_dataset_id] = bds_dataset
 
-            insert_or_update_dataset(db_conn, bds_dataset)
+def record_dataset_download_success(context: dict, db_writer: DatasetWriteBuffer, bds_dataset: dict):
 
-            context["logger"].info("dataset id: {} - Added/updated dataset".format(bds_dataset["id"]))
+    db_writer.add(bds_dataset)
+
+    context["logger"].info("dataset id: {} - Added/updated dataset".format(bds_dataset["id"]))
+
+
+def record_dataset_verified_unchanged(context: dict, db_writer: DatasetWriteBuffer, bds_dataset: dict):
+
+    bds_dataset["last_verified_on_server"] = bds_dataset["last_head_attempt"]
+
+    db_writer.add(bds_dataset)
+
+
+def record_dataset_download_failure(
+    context: dict,
+    db_writer: DatasetWriteBuffer,
+    bds_dataset: dict,
+    e: RuntimeError,
+    only_if_changed: bool = False,
+    download_within_hours: int = 0,
+):
+
+    if only_if_changed:
+        record_conditional_request_failure(context, bds_dataset, e, download_within_hours)
+
+        if dataset_downloaded_within(bds_dataset, 6):
+            db_writer.add(bds_dataset)
+            return
+
+    bds_dataset["download_error_message"] = json.dumps(
+        {"bds_message": "Download of IATI XML failed with non-200 HTTP status"} | e.args[0]
+    )
+    context["logger"].warning("dataset id: {} - {}".format(bds_dataset["id"], bds_dataset["download_error_message"]))
+    bds_dataset["last_download_attempt"] = get_timestamp()
+    bds_dataset["last_download_http_status"] = e.args[0]["http_status_code"]
+    db_writer.add(bds_dataset)
 
-        except RuntimeError as e:
-            bds_dataset["download_error_message"] = json.dumps(
-                {"bds_message": "Download of IATI XML failed with non-200 HTTP status"} | e.args[0]
-            )
-            context["logger"].warning(
-                "dataset id: {} - {}".format(registered_dataset_id, bds_dataset["download_error_message"])
-            )
-            bds_dataset["last_download_attempt"] = get_timestamp()
-            bds_dataset["last_download_http_status"] = e.args[0]["http_status_code"]
-            insert_or_update_dataset(db_conn, bds_dataset)
-        except Exception as e:
-            bds_dataset["last_download_attempt"] = get_timestamp()
-            bds_dataset["download_error_message"] = json.dumps(
-                {
-                    "bds_message": "Download of IATI XML produced EXCEPTION with GET request",
-                    "message": "{}".format(e),
-                }
-            )
-            context["logger"].warning(
-                "dataset id: {} - {}".format(registered_dataset_id, bds_dataset["download_error_message"])
-            )
-            insert_or_update_dataset(db_conn, bds_dataset)
+
+def record_dataset_download_exception(context: dict, db_writer: DatasetWriteBuffer, bds_dataset: dict, e: Exception):
+
+    bds_dataset["last_download_attempt"] = get_timestamp()
+    bds_dataset["download_error_message"] = json.dumps(
+        {
+            "bds_message": "Download of IATI XML produced EXCEPTION with GET request",
+            "message": "{}".format(e),
+        }
+    )
+    context["logger"].warning("dataset id: {} - {}".format(bds_dataset["id"], bds_dataset["download_error_message"]))
+    db_writer.add(bds_dataset)
 
 
 def get_randomised_download_within_hours(context: dict) -> int:
@@ -150,101 +217,152 @@ def dataset_downloaded_within(bds_dataset: dict, hours: int) -> bool:
     return bds_dataset["last_successful_download"] is not None and bds_dataset["last_successful_download"] > hours_ago
 
 
-def check_dataset_etag_last_mod_header(
-    context: dict,
-    db_conn: psycopg.Connection,
-    session: requests.Session,
-    bds_dataset: dict,
-    download_within_hours: int,
-) -> bool:
+def download_only_if_changed(bds_dataset: dict, download_within_hours: int) -> bool:
+    """A dataset without a hash (e.g., its blobs were found missing by reconciliation) is always downloaded"""
 
-    attempt_download = True
+    return bds_dataset["hash"] is not None and dataset_downloaded_within(bds_dataset, download_within_hours)
 
-    try:
-        head_response = http_head_dataset(session, bds_dataset["source_url"])
 
-        if "ETag" in head_response.headers and head_response.headers["ETag"] != bds_dataset["server_header_etag"]:
+def dataset_changed_on_server(
+    context: dict, bds_dataset: dict, status_code: int, headers: Mapping[str, str], download_within_hours: int
+) -> bool:
+    """Decides from the response to a conditional GET whether the dataset needs to be downloaded again
 
-            context["logger"].info(
-                "dataset id: {} - Last successful download within {} hours, "
-                "but ETag changed so redownloading".format(bds_dataset["id"], download_within_hours)
-            )
+    A 304 means the dataset is unchanged. Servers which ignore the conditional headers return a 200,
+    in which case the ETag and Last-Modified headers are compared with the stored values before the
+    body is read."""
 
-            update_dataset_head_request_fields(bds_dataset, head_response.status_code)
+    if status_code == 304:
+        context["logger"].info(
+            "dataset id: {} - Last successful download within {} hours, "
+            "server returned 304 Not Modified so not redownloading".format(bds_dataset["id"], download_within_hours)
+        )
+        return False
 
-        elif "Last-Modified" in head_response.headers and set_timestamp_tz_utc(
-            datetime.strptime(head_response.headers["Last-Modified"], "%a, %d %b %Y %H:%M:%S GMT")
-        ) != set_timestamp_tz_utc(bds_dataset["server_header_last_modified"]):
+    if "ETag" in headers and headers["ETag"] != bds_dataset["server_header_etag"]:
+        context["logger"].info(
+            "dataset id: {} - Last successful download within {} hours, "
+            "but ETag changed so redownloading".format(bds_dataset["id"], download_within_hours)
+        )
+        return True
 
-            context["logger"].info(
-                "dataset id: {} - Last successful download within {} hours, "
-                "but Last-Modified header changed so redownloading".format(bds_dataset["id"], download_within_hours)
-            )
+    if (
+        "Last-Modified" in headers
+        and parse_last_modified_header(headers["Last-Modified"]) != bds_dataset["server_header_last_modified"]
+    ):
+        context["logger"].info(
+            "dataset id: {} - Last successful download within {} hours, "
+            "but Last-Modified header changed so redownloading".format(bds_dataset["id"], download_within_hours)
+        )
+        return True
 
-            update_dataset_head_request_fields(bds_dataset, head_response.status_code)
+    context["logger"].info(
+        "dataset id: {} - Last successful download within {} hours, "
+        "Last-Modified and ETag same, so not redownloading".format(bds_dataset["id"], download_within_hours)
+    )
+    return False
 
-        else:
-            context["logger"].info(
-                "dataset id: {} - Last successful download within {} hours, "
-                "Last-Modified and ETag same, so not redownloading".format(bds_dataset["id"], download_within_hours)
-            )
 
-            update_dataset_head_request_fields(bds_dataset, head_response.status_code)
+def record_conditional_request_failure(context: dict, bds_dataset: dict, e: RuntimeError, download_within_hours: int):
 
-            bds_dataset["last_verified_on_server"] = bds_dataset["last_head_attempt"]
+    if dataset_downloaded_within(bds_dataset, 6):
+        extra_err_message = "Dataset downloaded within the last 6 hours so not recording a failed download."
+    else:
+        extra_err_message = "Dataset not downloaded within the last 6 hours so also recording a failed download."
 
-            insert_or_update_dataset(db_conn, bds_dataset)
+    bds_dataset["head_error_message"] = json.dumps(
+        {
+            "bds_message": (
+                "Last successful download within {} hours, "
+                "but conditional GET request to check ETag/Last-Modified "
+                "returned non-200/304 status. {} "
+                "Request exception details: {}".format(download_within_hours, extra_err_message, e)
+            )
+        }
+        | e.args[0]
+    )
 
-            attempt_download = False
+    context["logger"].warning("dataset id: {} - {}".format(bds_dataset["id"], bds_dataset["head_error_message"]))
 
-    except RuntimeError as e:
+    update_dataset_head_request_fields(bds_dataset, e.args[0]["http_status_code"], bds_dataset["head_error_message"])
 
-        if dataset_downloaded_within(bds_dataset, 6):
-            extra_err_message = "Dataset downloaded within the last 6 hours so not forcing full re-download attempt."
-            attempt_download = False
-        else:
-            extra_err_message = "Dataset not downloaded within the last 6 hours so forcing full re-download attempt."
-            attempt_download = True
-
-        bds_dataset["head_error_message"] = json.dumps(
-            {
-                "bds_message": (
-                    "Last successful download within {} hours, "
-                    "but HEAD request to check ETag/Last-Modified "
-                    "return non-200 status. {} "
-                    "HEAD request exception details: {}".format(download_within_hours, extra_err_message, e)
-                )
-            } | e.args[0]
-        )
 
-        context["logger"].warning("dataset id: {} - {}".format(bds_dataset["id"], bds_dataset["head_error_message"]))
+def download_and_save_dataset(
+    context: dict,
+    session: requests.Session,
+    az_blob_service: BlobServiceClient,
+    db_writer: DatasetWriteBuffer,
+    bds_dataset: dict,
+    only_if_changed: bool,
+    download_within_hours: int,
+):
+    """Downloads the dataset with a single GET request, which is conditional if only_if_changed is set
 
-        update_dataset_head_request_fields(
-            bds_dataset, e.args[0]["http_status_code"], bds_dataset["head_error_message"]
-        )
+    For a conditional request, the response headers are checked before the body is read, and if the
+    dataset hasn't changed on the server it is only marked as verified. Otherwise the body is streamed
+    to a temporary file and hashed in chunks, so memory use doesn't depend on the size of the dataset."""
 
-        insert_or_update_dataset(db_conn, bds_dataset)
+    last_download_attempt = get_timestamp()
 
-    except Exception as e:
-        context["logger"].warning(
-            "dataset id: {} - EXCEPTION with HEAD request, details: {}".format(bds_dataset["id"], e)
+    with tempfile.TemporaryFile() as xml_file:
+        with http_download_dataset(
+            session,
+            bds_dataset["source_url"],
+            conditional_headers=get_download_request_headers(bds_dataset, only_if_changed),
+        ) as download_response:
+
+            if only_if_changed:
+                update_dataset_head_request_fields(bds_dataset, download_response.status_code)
+
+                if not dataset_changed_on_server(
+                    context,
+                    bds_dataset,
+                    download_response.status_code,
+                    download_response.headers,
+                    download_within_hours,
+                ):
+                    record_dataset_verified_unchanged(context, db_writer, bds_dataset)
+                    return
+
+            hasher = DatasetHasher()
+
+            for chunk in download_response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                xml_file.write(chunk)
+                hasher.update(chunk)
+
+        save_dataset_download(
+            context,
+            az_blob_service,
+            bds_dataset,
+            last_download_attempt,
+            download_response.status_code,
+            download_response.headers,
+            xml_file,
+            hasher,
         )
-        if "{}".format(e) == "str.replace() takes no keyword arguments":
-            context["logger"].error("Full traceback: " "{}".format(traceback.format_exc()))
 
-    return attempt_download
+    record_dataset_download_success(context, db_writer, bds_dataset)
 
 
-def download_and_save_dataset(
-    context: dict, session: requests.Session, az_blob_service: BlobServiceClient, bds_dataset: dict
+def save_dataset_download(
+    context: dict,
+    az_blob_service: BlobServiceClient,
+    bds_dataset: dict,
+    last_download_attempt: datetime,
+    status_code: int,
+    headers: Mapping[str, str],
+    xml_file: BinaryIO,
+    hasher: DatasetHasher,
 ):
+    """Uploads a downloaded dataset (XML and zipped) to Azure if it has changed, and updates its record
 
-    last_download_attempt = get_timestamp()
+    The XML has already been written to xml_file and hashed as it was downloaded, and the ZIP is
+    written to a temporary file, so the dataset is never held in memory. Both blobs are uploaded with
+    their Content-MD5, and with the hash of the XML in their metadata, which is what the blob
+    reconciliation (see dataset_reconciliation.py) compares against the database."""
 
-    download_response = http_download_dataset(session, bds_dataset["source_url"])
-
-    hash = get_hash(download_response.text)
-    hash_excluding_generated = get_hash_excluding_generated_timestamp(download_response.text)
+    hash = hasher.hexdigest()
+    hash_excluding_generated = hasher.hexdigest_excluding_generated_timestamp()
 
     if hash == bds_dataset["hash"]:
         context["logger"].info(
@@ -252,41 +370,44 @@ def download_and_save_dataset(
             "previous value, so not re-zipping and re-uploading to Azure".format(bds_dataset["id"])
         )
     else:
-        iati_xml_zipped = zip_data_as_single_file(bds_dataset["name"] + ".xml", download_response.text)
-
-        response_xml = azure_upload_to_blob(
-            az_blob_service,
-            context["AZURE_STORAGE_BLOB_CONTAINER_NAME_IATI_XML"],
-            "{}/{}.xml".format(bds_dataset["publisher_name"], bds_dataset["name"]),
-            download_response.text,
-            "application/xml",
-        )
+        with tempfile.TemporaryFile() as zip_file:
+            zip_file_as_single_file(bds_dataset["name"] + ".xml", xml_file, zip_file)
+
+            xml_file.seek(0)
+
+            response_xml = azure_upload_to_blob(
+                az_blob_service,
+                context["AZURE_STORAGE_BLOB_CONTAINER_NAME_IATI_XML"],
+                get_azure_blob_name(bds_dataset, "xml"),
+                xml_file,
+                "application/xml",
+                content_md5=hasher.content_md5(),
+                metadata={"hash": hash},
+                max_concurrency=int(context["AZURE_UPLOAD_MAX_CONCURRENCY"]),
+            )
 
-        context["logger"].debug(
-            "dataset id: {} - Azure XML upload response: {}".format(bds_dataset["id"], response_xml)
-        )
+            context["logger"].debug(
+                "dataset id: {} - Azure XML upload response: {}".format(bds_dataset["id"], response_xml)
+            )
 
-        response_zip = azure_upload_to_blob(
-            az_blob_service,
-            context["AZURE_STORAGE_BLOB_CONTAINER_NAME_IATI_ZIP"],
-            "{}/{}.zip".format(bds_dataset["publisher_name"], bds_dataset["name"]),
-            iati_xml_zipped,
-            "application/zip",
-        )
+            response_zip = azure_upload_to_blob(
+                az_blob_service,
+                context["AZURE_STORAGE_BLOB_CONTAINER_NAME_IATI_ZIP"],
+                get_azure_blob_name(bds_dataset, "zip"),
+                zip_file,
+                "application/zip",
+                content_md5=get_file_md5(zip_file),
+                metadata={"hash": hash},
+                max_concurrency=int(context["AZURE_UPLOAD_MAX_CONCURRENCY"]),
+            )
 
-        if not azure_blob_exists(
-            az_blob_service,
-            context["AZURE_STORAGE_BLOB_CONTAINER_NAME_IATI_XML"],
-            "{}/{}.xml".format(bds_dataset["publisher_name"], bds_dataset["name"]),
-        ):
-            context["logger"].error("dataset id: {} - Azure XML upload failed")
             context["logger"].debug(
-                "dataset id: {} - Azure ZIP upload response: {}".format(bds_dataset["id"], response_xml)
+                "dataset id: {} - Azure ZIP upload response: {}".format(bds_dataset["id"], response_zip)
             )
 
     last_modified_header = None
-    if download_response.headers.get("Last-Modified", None) is not None:
-        last_modified_header = parse_last_modified_header(download_response.headers.get("Last-Modified", ""))
+    if headers.get("Last-Modified", None) is not None:
+        last_modified_header = parse_last_modified_header(headers.get("Last-Modified", ""))
 
     bds_dataset.update(
         {
@@ -294,14 +415,14 @@ def download_and_save_dataset(
             "hash_excluding_generated_timestamp": hash_excluding_generated,
             "last_update_check": last_download_attempt,
             "last_download_attempt": last_download_attempt,
-            "last_download_http_status": download_response.status_code,
+            "last_download_http_status": status_code,
             "last_successful_download": last_download_attempt,
             "last_verified_on_server": last_download_attempt,
             "download_error_message": None,
             "content_modified": None,
             "content_modified_excluding_generated_timestamp": None,
             "server_header_last_modified": last_modified_header,
-            "server_header_etag": download_response.headers.get("ETag", None),
+            "server_header_etag": headers.get("ETag", None),
         }
     )
 
@@ -312,33 +433,35 @@ def update_dataset_head_request_fields(dataset: dict, status_code: int, error_ms
     dataset["head_error_message"] = error_msg
 
 
-def create_bds_dataset(registered_dataset: dict) -> dict:
-    return {
-        "id": registered_dataset["id"],
-        "name": registered_dataset["name"],
-        "publisher_id": registered_dataset["publisher_id"],
-        "publisher_name": registered_dataset["publisher_name"],
-        "type": registered_dataset["type"],
-        "source_url": registered_dataset["source_url"],
-        "hash": None,
-        "hash_excluding_generated_timestamp": None,
-        "last_update_check": None,
-        "last_head_attempt": None,
-        "last_head_http_status": None,
-        "head_error_message": None,
-        "last_verified_on_server": None,
-        "last_download_attempt": None,
-        "last_download_http_status": None,
-        "last_successful_download": None,
-        "download_error_message": None,
-        "content_modified": None,
-        "content_modified_excluding_generated_timestamp": None,
-        "server_header_last_modified": None,
-        "server_header_etag": None,
-        "registration_service_dataset_metadata": registered_dataset["registration_service_dataset_metadata"],
-        "registration_service_publisher_metadata": registered_dataset["registration_service_publisher_metadata"],
-        "registration_service_name": registered_dataset["registration_service_name"],
-    }
+def create_bds_dataset(registered_dataset: dict) -> BDSDataset:
+    return BDSDataset(
+        {
+            "id": registered_dataset["id"],
+            "name": registered_dataset["name"],
+            "publisher_id": registered_dataset["publisher_id"],
+            "publisher_name": registered_dataset["publisher_name"],
+            "type": registered_dataset["type"],
+            "source_url": registered_dataset["source_url"],
+            "hash": None,
+            "hash_excluding_generated_timestamp": None,
+            "last_update_check": None,
+            "last_head_attempt": None,
+            "last_head_http_status": None,
+            "head_error_message": None,
+            "last_verified_on_server": None,
+            "last_download_attempt": None,
+            "last_download_http_status": None,
+            "last_successful_download": None,
+            "download_error_message": None,
+            "content_modified": None,
+            "content_modified_excluding_generated_timestamp": None,
+            "server_header_last_modified": None,
+            "server_header_etag": None,
+            "registration_service_dataset_metadata": registered_dataset["registration_service_dataset_metadata"],
+            "registration_service_publisher_metadata": registered_dataset["registration_service_publisher_metadata"],
+            "registration_service_name": registered_dataset["registration_service_name"],
+        }
+    )
 
 
 def update_bds_dataset_registration_info(bds_dataset: dict, registered_dataset: dict):
@@ -0,0 +1,222 @@
+import asyncio
+import concurrent.futures
+import tempfile
+import uuid
+from typing import IO
+
+import aiohttp
+from azure.storage.blob import BlobServiceClient
+
+from bulk_data_service.dataset_updater import (
+    DOWNLOAD_CHUNK_SIZE,
+    dataset_changed_on_server,
+    download_only_if_changed,
+    get_bds_dataset_for_update_check,
+    get_download_request_headers,
+    get_randomised_download_within_hours,
+    record_dataset_download_exception,
+    record_dataset_download_failure,
+    record_dataset_download_success,
+    record_dataset_verified_unchanged,
+    save_dataset_download,
+    update_dataset_head_request_fields,
+)
+from bulk_data_service.download_scheduler import HostScheduler, create_host_scheduler
+from utilities.azure import get_azure_blob_service
+from utilities.db import DatasetWriteBuffer, create_dataset_write_buffer
+from utilities.http import get_aiohttp_session, http_download_dataset_async
+from utilities.misc import DatasetHasher, get_timestamp
+
+
+def add_or_update_datasets_async(
+    context: dict, datasets_in_bds: dict[uuid.UUID, dict], registered_datasets: dict[uuid.UUID, dict]
+):
+    """Checks and downloads all registered datasets using asyncio for the HTTP requests
+
+    Datasets are handed out by the per-host scheduler and their (conditional) GET requests are in flight
+    concurrently (up to DOWNLOADER_MAX_CONCURRENT_REQUESTS), so a slow publisher server only delays
+    its own datasets. The blocking steps which follow a request (hashing, uploading to Azure, writing
+    to the DB) are run on a pool of NUMBER_DOWNLOADER_THREADS threads."""
+
+    asyncio.run(add_or_update_all_datasets_async(context, datasets_in_bds, registered_datasets))
+
+
+async def add_or_update_all_datasets_async(
+    context: dict, datasets_in_bds: dict[uuid.UUID, dict], registered_datasets: dict[uuid.UUID, dict]
+):
+
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=int(context["NUMBER_DOWNLOADER_THREADS"]))
+    )
+
+    max_concurrent_requests = int(context["DOWNLOADER_MAX_CONCURRENT_REQUESTS"])
+
+    scheduler = create_host_scheduler(context, registered_datasets)
+
+    az_blob_service = get_azure_blob_service(context)
+
+    db_writer = create_dataset_write_buffer(context)
+
+    try:
+        async with get_aiohttp_session(max_concurrent_requests) as session:
+            await dispatch_datasets_async(
+                context,
+                scheduler,
+                max_concurrent_requests,
+                datasets_in_bds,
+                registered_datasets,
+                az_blob_service,
+                session,
+                db_writer,
+            )
+    finally:
+        await asyncio.to_thread(db_writer.flush)
+
+        az_blob_service.close()
+
+
+async def dispatch_datasets_async(
+    context: dict,
+    scheduler: HostScheduler,
+    max_concurrent_requests: int,
+    datasets_in_bds: dict[uuid.UUID, dict],
+    registered_datasets: dict[uuid.UUID, dict],
+    az_blob_service: BlobServiceClient,
+    session: aiohttp.ClientSession,
+    db_writer: DatasetWriteBuffer,
+):
+    """Starts a task for each dataset as the scheduler hands it out, with max_concurrent_requests in progress"""
+
+    dataset_slots = asyncio.Semaphore(max_concurrent_requests)
+
+    tasks = []
+
+    while True:
+        await dataset_slots.acquire()
+
+        registered_dataset_id = await scheduler.next_dataset_async()
+
+        if registered_dataset_id is None:
+            break
+
+        tasks.append(
+            asyncio.create_task(
+                add_or_update_scheduled_dataset_async(
+                    context,
+                    registered_dataset_id,
+                    scheduler,
+                    dataset_slots,
+                    datasets_in_bds,
+                    registered_datasets,
+                    az_blob_service,
+                    session,
+                    db_writer,
+                )
+            )
+        )
+
+    await asyncio.gather(*tasks)
+
+
+async def add_or_update_scheduled_dataset_async(
+    context: dict,
+    registered_dataset_id: uuid.UUID,
+    scheduler: HostScheduler,
+    dataset_slots: asyncio.Semaphore,
+    datasets_in_bds: dict[uuid.UUID, dict],
+    registered_datasets: dict[uuid.UUID, dict],
+    az_blob_service: BlobServiceClient,
+    session: aiohttp.ClientSession,
+    db_writer: DatasetWriteBuffer,
+):
+    try:
+        await add_or_update_registered_dataset_async(
+            context, registered_dataset_id, datasets_in_bds, registered_datasets, az_blob_service, session, db_writer
+        )
+    finally:
+        scheduler.dataset_finished(registered_dataset_id)
+        dataset_slots.release()
+
+
+async def add_or_update_registered_dataset_async(
+    context: dict,
+    registered_dataset_id: uuid.UUID,
+    datasets_in_bds: dict[uuid.UUID, dict],
+    registered_datasets: dict[uuid.UUID, dict],
+    az_blob_service: BlobServiceClient,
+    session: aiohttp.ClientSession,
+    db_writer: DatasetWriteBuffer,
+):
+
+    bds_dataset = get_bds_dataset_for_update_check(datasets_in_bds, registered_datasets, registered_dataset_id)
+
+    download_within_hours = get_randomised_download_within_hours(context)
+
+    only_if_changed = download_only_if_changed(bds_dataset, download_within_hours)
+
+    try:
+        await download_and_save_dataset_async(
+            context, session, az_blob_service, db_writer, bds_dataset, only_if_changed, download_within_hours
+        )
+    except RuntimeError as e:
+        await asyncio.to_thread(
+            record_dataset_download_failure, context, db_writer, bds_dataset, e, only_if_changed, download_within_hours
+        )
+    except Exception as e:
+        await asyncio.to_thread(record_dataset_download_exception, context, db_writer, bds_dataset, e)
+
+
+async def download_and_save_dataset_async(
+    context: dict,
+    session: aiohttp.ClientSession,
+    az_blob_service: BlobServiceClient,
+    db_writer: DatasetWriteBuffer,
+    bds_dataset: dict,
+    only_if_changed: bool,
+    download_within_hours: int,
+):
+
+    last_download_attempt = get_timestamp()
+
+    download_response = await http_download_dataset_async(
+        session,
+        bds_dataset["source_url"],
+        conditional_headers=get_download_request_headers(bds_dataset, only_if_changed),
+    )
+
+    with tempfile.TemporaryFile() as xml_file:
+        try:
+            if only_if_changed:
+                update_dataset_head_request_fields(bds_dataset, download_response.status)
+
+                if not dataset_changed_on_server(
+                    context, bds_dataset, download_response.status, download_response.headers, download_within_hours
+                ):
+                    await asyncio.to_thread(record_dataset_verified_unchanged, context, db_writer, bds_dataset)
+                    return
+
+            hasher = DatasetHasher()
+
+            async for chunk in download_response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(write_and_hash_chunk, xml_file, hasher, chunk)
+        finally:
+            download_response.release()
+
+        await asyncio.to_thread(
+            save_dataset_download,
+            context,
+            az_blob_service,
+            bds_dataset,
+            last_download_attempt,
+            download_response.status,
+            download_response.headers,
+            xml_file,
+            hasher,
+        )
+
+    await asyncio.to_thread(record_dataset_download_success, context, db_writer, bds_dataset)
+
+
+def write_and_hash_chunk(xml_file: IO[bytes], hasher: DatasetHasher, chunk: bytes):
+    xml_file.write(chunk)
+    hasher.update(chunk)
@@ -0,0 +1,113 @@
+import asyncio
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Optional
+from urllib.parse import urlsplit
+
+# how often the asyncio engine re-checks for a dataset while waiting on busy hosts (seconds)
+ASYNC_POLL_INTERVAL = 0.1
+
+
+class HostScheduler:
+    """Hands out datasets to the downloader, interleaving the hosts which serve them
+
+    Datasets are grouped by the host in their source_url. A dataset is only handed out when its host
+    has fewer than max_per_host datasets in progress, and at least min_interval seconds have passed
+    since the last dataset for that host was handed out. Hosts take turns, so a server hosting many
+    datasets cannot take all the workers, and is not sent a burst of requests at once."""
+
+    def __init__(self, datasets: dict[uuid.UUID, dict], max_per_host: int, min_interval: float):
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+
+        self.pending: dict[str, deque[uuid.UUID]] = {}
+        for dataset_id, dataset in datasets.items():
+            self.pending.setdefault(get_source_host(dataset["source_url"]), deque()).append(dataset_id)
+
+        self.hosts_with_pending = deque(self.pending.keys())
+        self.in_progress = {host: 0 for host in self.pending}
+        self.last_started = {host: -math.inf for host in self.pending}
+        self.dataset_hosts: dict[uuid.UUID, str] = {}
+
+        self.condition = threading.Condition()
+
+    def next_dataset(self) -> Optional[uuid.UUID]:
+        """Blocks until a dataset can be started, or returns None if there are none left to hand out"""
+
+        with self.condition:
+            while True:
+                dataset_id, wait = self.take_next_ready_dataset()
+
+                if dataset_id is not None or wait is None:
+                    return dataset_id
+
+                self.condition.wait(None if wait == math.inf else wait)
+
+    async def next_dataset_async(self) -> Optional[uuid.UUID]:
+        """Equivalent of next_dataset() for the asyncio engine, which waits without blocking the event loop"""
+
+        while True:
+            with self.condition:
+                dataset_id, wait = self.take_next_ready_dataset()
+
+            if dataset_id is not None or wait is None:
+                return dataset_id
+
+            await asyncio.sleep(min(wait, ASYNC_POLL_INTERVAL))
+
+    def dataset_finished(self, dataset_id: uuid.UUID):
+        with self.condition:
+            self.in_progress[self.dataset_hosts.pop(dataset_id)] -= 1
+            self.condition.notify_all()
+
+    def take_next_ready_dataset(self) -> tuple[Optional[uuid.UUID], Optional[float]]:
+        """Takes the next dataset whose host is ready, starting from the host after the last one used
+
+        Returns a tuple of the dataset id (or None) and how long to wait before trying again: None if
+        there are no datasets left, or math.inf if all hosts with datasets are at max_per_host. Must be
+        called with self.condition held."""
+
+        now = time.monotonic()
+        wait = math.inf
+
+        for _ in range(len(self.hosts_with_pending)):
+            host = self.hosts_with_pending[0]
+            self.hosts_with_pending.rotate(-1)
+
+            if self.in_progress[host] >= self.max_per_host:
+                continue
+
+            next_allowed_start = self.last_started[host] + self.min_interval
+            if next_allowed_start > now:
+                wait = min(wait, next_allowed_start - now)
+                continue
+
+            dataset_id = self.pending[host].popleft()
+            if len(self.pending[host]) == 0:
+                self.hosts_with_pending.pop()
+
+            self.in_progress[host] += 1
+            self.last_started[host] = now
+            self.dataset_hosts[dataset_id] = host
+
+            return dataset_id, 0
+
+        return None, (wait if len(self.hosts_with_pending) > 0 else None)
+
+
+def get_source_host(source_url: str) -> str:
+    try:
+        return urlsplit(source_url).hostname or ""
+    except ValueError:
+        return ""
+
+
+def create_host_scheduler(context: dict, datasets: dict[uuid.UUID, dict]) -> HostScheduler:
+    return HostScheduler(
+        datasets,
+        int(context["DOWNLOADER_MAX_CONCURRENT_REQUESTS_PER_HOST"]),
+        float(context["DOWNLOADER_MIN_SECONDS_BETWEEN_REQUESTS_PER_HOST"]),
+    )
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import json
+import os
+import uuid
+
+from bulk_data_service.zippers import get_local_pathname_dataset_xml
+
+
+def get_working_dir_entry(dataset: dict) -> dict:
+    """Returns the entry recording a dataset's XML in the ZIP working dir, as kept in datasets_in_working_dir"""
+
+    return {
+        "id": dataset["id"],
+        "name": dataset["name"],
+        "publisher_name": dataset["publisher_name"],
+        "hash": dataset["hash"],
+    }
+
+
+def get_working_dir_manifest_pathname(context: dict) -> str:
+    return "{}/working-dir-manifest.json.gz".format(context["ZIP_WORKING_DIR"])
+
+
+def save_working_dir_manifest(context: dict, datasets_in_working_dir: dict[uuid.UUID, dict]):
+    """Saves the working dir entries, with the path and size of each dataset's XML, as gzipped JSON
+
+    Only the datasets whose XML is in the working dir are saved. The manifest is replaced atomically."""
+
+    manifest = []
+
+    for dataset in datasets_in_working_dir.values():
+        pathname = get_local_pathname_dataset_xml(context, dataset)
+
+        if not os.path.exists(pathname):
+            continue
+
+        manifest.append(
+            dataset
+            | {
+                "id": str(dataset["id"]),
+                "path": os.path.relpath(pathname, context["ZIP_WORKING_DIR"]),
+                "size": os.path.getsize(pathname),
+            }
+        )
+
+    manifest_pathname = get_working_dir_manifest_pathname(context)
+
+    try:
+        with gzip.open(manifest_pathname + ".tmp", "wt", encoding="utf-8") as manifest_fileobj:
+            json.dump(manifest, manifest_fileobj)
+
+        os.replace(manifest_pathname + ".tmp", manifest_pathname)
+    except OSError as e:
+        context["logger"].error("Unable to save ZIP working dir manifest to {}: {}".format(manifest_pathname, e))
+
+
+def load_working_dir_manifest(context: dict) -> dict[uuid.UUID, dict]:
+    """Returns the working dir entries saved by the last run, for the datasets whose XML is still as it was
+
+    The XML of each dataset in the manifest must be at the path and of the size recorded, and its
+    SHA1 must be the dataset's hash, otherwise the dataset is left out, so that it is downloaded again.
+    A manifest which can't be read is ignored, so that all the datasets are downloaded again."""
+
+    manifest_pathname = get_working_dir_manifest_pathname(context)
+
+    if not os.path.exists(manifest_pathname):
+        return {}
+
+    try:
+        with gzip.open(manifest_pathname, "rt", encoding="utf-8") as manifest_fileobj:
+            manifest = json.load(manifest_fileobj)
+
+        datasets_in_working_dir = get_verified_working_dir_entries(context, manifest)
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        context["logger"].warning("Unable to load ZIP working dir manifest from {}: {}".format(manifest_pathname, e))
+        return {}
+
+    context["logger"].info(
+        "Loaded ZIP working dir manifest: XML of {} of {} datasets verified.".format(
+            len(datasets_in_working_dir), len(manifest)
+        )
+    )
+
+    return datasets_in_working_dir
+
+
+def get_verified_working_dir_entries(context: dict, manifest: list[dict]) -> dict[uuid.UUID, dict]:
+    datasets_in_working_dir = {}
+
+    for manifest_entry in manifest:
+        dataset = get_working_dir_entry(manifest_entry | {"id": uuid.UUID(manifest_entry["id"])})
+
+        if working_dir_xml_matches_manifest(context, dataset, manifest_entry):
+            datasets_in_working_dir[dataset["id"]] = dataset
+
+    return datasets_in_working_dir
+
+
+def working_dir_xml_matches_manifest(context: dict, dataset: dict, manifest_entry: dict) -> bool:
+    pathname = get_local_pathname_dataset_xml(context, dataset)
+
+    return (
+        dataset["hash"] is not None
+        and manifest_entry["path"] == os.path.relpath(pathname, context["ZIP_WORKING_DIR"])
+        and os.path.exists(pathname)
+        and os.path.getsize(pathname) == manifest_entry["size"]
+        and get_sha1_of_file(pathname) == dataset["hash"]
+    )
+
+
+def get_sha1_of_file(pathname: str) -> str:
+    with open(pathname, "rb") as xml_file:
+        return hashlib.file_digest(xml_file, "sha1").hexdigest()
@@ -1,26 +1,46 @@
 import datetime
+import multiprocessing
 import os
 import shutil
 import time
 import uuid
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Optional
 
 from azure.core.exceptions import ResourceNotFoundError
 from azure.storage.blob import BlobServiceClient
 
 from bulk_data_service.dataset_indexing import get_index_name
-from bulk_data_service.zippers import CodeforIATILegacyZipper, IATIBulkDataServiceZipper
-from utilities.azure import azure_download_blob, get_azure_blob_name, get_azure_container_name
+from bulk_data_service.working_dir_manifest import (
+    get_working_dir_entry,
+    load_working_dir_manifest,
+    save_working_dir_manifest,
+)
+from bulk_data_service.zippers import (
+    CodeforIATILegacyZipper,
+    IATIBulkDataServiceZipper,
+    IATIDataZipper,
+    get_local_datasets_dir,
+    get_local_pathname_dataset_xml,
+    get_local_pathname_dataset_zip,
+)
+from utilities.azure import azure_download_blob, get_azure_blob_name, get_azure_blob_service, get_azure_container_name
 from utilities.db import get_datasets_in_bds
+from utilities.misc import unzip_single_file
 
 
 def zipper(context: dict):
 
     datasets = get_datasets_in_bds(context)
 
+    # the XML already in the working dir from before a restart is reused, if it is as the manifest records
+    datasets_in_working_dir = load_working_dir_manifest(context)
+
     if context["single_run"]:
-        zipper_run(context, {}, datasets)
+        zipper_run(context, datasets_in_working_dir, datasets)
     else:
-        zipper_service_loop(context, {}, datasets)
+        zipper_service_loop(context, datasets_in_working_dir, datasets)
 
 
 def zipper_service_loop(
@@ -38,36 +58,86 @@ def zipper_run(context: dict, datasets_in_working_dir: dict[uuid.UUID, dict], da
     run_start = datetime.datetime.now(datetime.UTC)
     context["logger"].info("Zipper run starting")
 
-    setup_working_dir_with_downloaded_datasets(context, datasets_in_working_dir, datasets_in_bds)
+    updated_dataset_ids = setup_working_dir_with_downloaded_datasets(context, datasets_in_working_dir, datasets_in_bds)
 
     zip_creators = [
         IATIBulkDataServiceZipper(
-            context, "{}-1".format(context["ZIP_WORKING_DIR"]), datasets_in_working_dir, datasets_in_bds
+            context,
+            "{}-1".format(context["ZIP_WORKING_DIR"]),
+            datasets_in_working_dir,
+            datasets_in_bds,
+            updated_dataset_ids,
         ),
         CodeforIATILegacyZipper(
-            context, "{}-2".format(context["ZIP_WORKING_DIR"]), datasets_in_working_dir, datasets_in_bds
+            context,
+            "{}-2".format(context["ZIP_WORKING_DIR"]),
+            datasets_in_working_dir,
+            datasets_in_bds,
+            updated_dataset_ids,
         ),
     ]
 
-    for zip_creator in zip_creators:
+    compression_executor = get_compression_executor(context)
+
+    # the ZIP files are built at the same time, their files being compressed by the same processes
+    with ThreadPoolExecutor(max_workers=len(zip_creators)) as zip_threads:
+        zip_builds = [
+            zip_threads.submit(build_zip, context, zip_creator, compression_executor) for zip_creator in zip_creators
+        ]
+        try:
+            for zip_build in zip_builds:
+                zip_build.result()
+        finally:
+            if compression_executor is not None:
+                compression_executor.shutdown(cancel_futures=True)
+
+    # saved only once the ZIP files are built, as unchanged datasets are copied from the previous ZIP files
+    save_working_dir_manifest(context, datasets_in_working_dir)
+
+    run_end = datetime.datetime.now(datetime.UTC)
+    context["logger"].info("Zipper run finished in {}.".format(run_end - run_start))
+
+
+def build_zip(context: dict, zip_creator: IATIDataZipper, compression_executor: Optional[Executor]):
 
-        if os.path.exists(zip_creator.zip_working_dir):
-            shutil.rmtree(zip_creator.zip_working_dir)
-        shutil.copytree(context["ZIP_WORKING_DIR"], zip_creator.zip_working_dir)
+    zip_creator.keep_previous_zip()
 
-        zip_creator.prepare()
+    # the zipper's working dir only holds the files it creates, as the datasets are zipped from the ZIP working dir
+    if os.path.exists(zip_creator.zip_working_dir):
+        shutil.rmtree(zip_creator.zip_working_dir)
+    os.makedirs(zip_creator.zip_working_dir)
 
-        zip_creator.zip()
+    zip_creator.prepare()
+
+    if context["ZIP_UPLOAD_MODE"] == "stream":
+        zip_creator.zip_to_azure(compression_executor)
+    else:
+        zip_creator.zip(compression_executor)
 
         zip_creator.upload()
 
-    run_end = datetime.datetime.now(datetime.UTC)
-    context["logger"].info("Zipper run finished in {}.".format(run_end - run_start))
+
+def get_compression_executor(context: dict) -> Optional[Executor]:
+    """Returns a pool of ZIP_COMPRESSION_PROCESSES processes (0 for one per CPU), or None to compress in this one
+
+    The processes are started with 'spawn', as forking a process which is running threads isn't safe."""
+
+    processes = int(context["ZIP_COMPRESSION_PROCESSES"]) or os.cpu_count() or 1
+
+    if processes == 1:
+        return None
+
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
 
 
 def setup_working_dir_with_downloaded_datasets(
     context: dict, datasets_in_working_dir: dict[uuid.UUID, dict], datasets_in_bds: dict[uuid.UUID, dict]
-):
+) -> set[uuid.UUID]:
+    """Brings the XML files in the working dir up to date, and returns the ids of the new or updated datasets
+
+    datasets_in_working_dir holds a working dir entry (see get_working_dir_entry) for each dataset in
+    the working dir, recording the hash of the file there. These are copies of the fields needed, so
+    an update to a dataset in datasets_in_bds is seen as a change of hash here."""
 
     clean_working_dir(context, datasets_in_working_dir)
 
@@ -78,9 +148,11 @@ def setup_working_dir_with_downloaded_datasets(
     new_or_updated_datasets = {
         k: v
         for k, v in datasets_with_downloads.items()
-        if k not in datasets_in_working_dir or datasets_in_working_dir[k]["hash"] != datasets_with_downloads[k]["hash"]
+        if k not in datasets_in_working_dir or datasets_in_working_dir[k] != get_working_dir_entry(v)
     }
 
+    remove_renamed_datasets_from_working_dir(context, datasets_in_working_dir, new_or_updated_datasets)
+
     context["logger"].info(
         "Found {} datasets with downloads. "
         "{} are new or updated and will be (re-)downloaded.".format(
@@ -91,13 +163,35 @@ def setup_working_dir_with_downloaded_datasets(
     download_new_or_updated_to_working_dir(context, new_or_updated_datasets)
 
     datasets_in_working_dir.clear()
-    datasets_in_working_dir.update(datasets_with_downloads)
+    datasets_in_working_dir.update({k: get_working_dir_entry(v) for k, v in datasets_with_downloads.items()})
+
+    return set(new_or_updated_datasets)
 
 
 def clean_working_dir(context: dict, datasets_in_zip: dict[uuid.UUID, dict]):
     if len(datasets_in_zip) == 0:
         context["logger"].info("First zip run of session, so deleting all XML " "files in the ZIP working dir.")
         shutil.rmtree("{}/{}".format(context["ZIP_WORKING_DIR"], "iati-data"), ignore_errors=True)
+        shutil.rmtree("{}-dataset-zips".format(context["ZIP_WORKING_DIR"]), ignore_errors=True)
+    else:
+        remove_untracked_files_from_working_dir(context, datasets_in_zip)
+
+
+def remove_untracked_files_from_working_dir(context: dict, datasets_in_zip: dict[uuid.UUID, dict]):
+    """Removes the files in the working dir that aren't those of the datasets in it
+
+    These can be left by a run which stopped before saving the working dir manifest."""
+
+    tracked_files = {get_local_pathname_dataset_xml(context, dataset) for dataset in datasets_in_zip.values()} | {
+        get_local_pathname_dataset_zip(context, dataset) for dataset in datasets_in_zip.values()
+    }
+
+    for dir_name in [get_local_datasets_dir(context), "{}-dataset-zips".format(context["ZIP_WORKING_DIR"])]:
+        for dirpath, _, filenames in os.walk(dir_name):
+            for filename in filenames:
+                if os.path.join(dirpath, filename) not in tracked_files:
+                    context["logger"].info("Removing untracked file {} from ZIP working dir.".format(filename))
+                    os.remove(os.path.join(dirpath, filename))
 
 
 def remove_datasets_without_dls_from_working_dir(
@@ -109,6 +203,16 @@ def remove_datasets_without_dls_from_working_dir(
         delete_local_xml_from_zip_working_dir(context, dataset)
 
 
+def remove_renamed_datasets_from_working_dir(
+    context: dict, datasets_in_zip: dict[uuid.UUID, dict], updated_datasets: dict[uuid.UUID, dict]
+):
+    for dataset_id, dataset in updated_datasets.items():
+        if dataset_id in datasets_in_zip and get_local_pathname_dataset_xml(
+            context, datasets_in_zip[dataset_id]
+        ) != get_local_pathname_dataset_xml(context, dataset):
+            delete_local_xml_from_zip_working_dir(context, datasets_in_zip[dataset_id])
+
+
 def download_indices_to_working_dir(context: dict):
     az_blob_service = BlobServiceClient.from_connection_string(context["AZURE_STORAGE_CONNECTION_STRING"])
 
@@ -131,42 +235,89 @@ def download_index_to_working_dir(context: dict, az_blob_service: BlobServiceCli
 
 
 def download_new_or_updated_to_working_dir(context: dict, updated_datasets: dict[uuid.UUID, dict]):
+    """Downloads the new or updated datasets into the working dir, ZIP_DOWNLOAD_THREADS at a time"""
 
-    az_blob_service = BlobServiceClient.from_connection_string(context["AZURE_STORAGE_CONNECTION_STRING"])
-
-    xml_container_name = get_azure_container_name(context, "xml")
+    download_threads = int(context["ZIP_DOWNLOAD_THREADS"])
 
-    os.makedirs("{}/iati-data/datasets".format(context["ZIP_WORKING_DIR"]), exist_ok=True)
+    az_blob_service = get_azure_blob_service(context, max_connections=download_threads)
 
-    for dataset in updated_datasets.values():
-        filename = get_local_pathname_dataset_xml(context, dataset)
+    os.makedirs(get_local_datasets_dir(context), exist_ok=True)
 
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-
-        context["logger"].info("dataset id: {} - Downloading".format(dataset["id"]))
+    context["logger"].info(
+        "Downloading {} new or updated datasets with {} threads.".format(len(updated_datasets), download_threads)
+    )
 
+    with ThreadPoolExecutor(max_workers=download_threads) as download_threads_pool:
+        downloads = [
+            download_threads_pool.submit(download_updated_dataset_to_working_dir, context, az_blob_service, dataset)
+            for dataset in updated_datasets.values()
+        ]
         try:
-            azure_download_blob(az_blob_service, xml_container_name, get_azure_blob_name(dataset, "xml"), filename)
-        except ResourceNotFoundError as e:
-            context["logger"].error(
-                "dataset id: {} - Failed to download from Azure: {}".format(dataset["id"], e).replace("\n", " ")
-            )
+            for download in as_completed(downloads):
+                download.result()
+        finally:
+            download_threads_pool.shutdown(cancel_futures=True)
 
     az_blob_service.close()
 
 
-def get_local_pathname_dataset_xml(context: dict, dataset: dict) -> str:
-    return "{}/iati-data/datasets/{}".format(context["ZIP_WORKING_DIR"], get_azure_blob_name(dataset, "xml"))
+def download_updated_dataset_to_working_dir(context: dict, az_blob_service: BlobServiceClient, dataset: dict):
+
+    context["logger"].info("dataset id: {} - Downloading".format(dataset["id"]))
+
+    try:
+        download_dataset_to_working_dir(context, az_blob_service, dataset)
+    except ResourceNotFoundError as e:
+        context["logger"].error(
+            "dataset id: {} - Failed to download from Azure: {}".format(dataset["id"], e).replace("\n", " ")
+        )
+
+
+def download_dataset_to_working_dir(context: dict, az_blob_service: BlobServiceClient, dataset: dict):
+    """Downloads a dataset's ZIP, and extracts its XML into the working dir, or downloads its XML if that fails
+
+    The dataset's ZIP is kept, so that its compressed XML can be copied into the bulk ZIP files
+    without being compressed again."""
+
+    xml_filename = get_local_pathname_dataset_xml(context, dataset)
+    zip_filename = get_local_pathname_dataset_zip(context, dataset)
+
+    os.makedirs(os.path.dirname(xml_filename), exist_ok=True)
+    os.makedirs(os.path.dirname(zip_filename), exist_ok=True)
+
+    try:
+        azure_download_blob(
+            az_blob_service,
+            get_azure_container_name(context, "zip"),
+            get_azure_blob_name(dataset, "zip"),
+            zip_filename,
+        )
+        unzip_single_file(zip_filename, xml_filename)
+        return
+    except (ResourceNotFoundError, OSError, zipfile.BadZipFile) as e:
+        context["logger"].warning(
+            "dataset id: {} - Unable to use ZIP from Azure, so downloading XML. "
+            "Details: {}".format(dataset["id"], e).replace("\n", " ")
+        )
+
+    delete_local_file(context, dataset, zip_filename)
+
+    azure_download_blob(
+        az_blob_service, get_azure_container_name(context, "xml"), get_azure_blob_name(dataset, "xml"), xml_filename
+    )
 
 
 def delete_local_xml_from_zip_working_dir(context: dict, dataset: dict):
-    dataset_local_xml = get_local_pathname_dataset_xml(context, dataset)
+    delete_local_file(context, dataset, get_local_pathname_dataset_xml(context, dataset))
+    delete_local_file(context, dataset, get_local_pathname_dataset_zip(context, dataset))
+
 
-    if os.path.exists(dataset_local_xml):
+def delete_local_file(context: dict, dataset: dict, filename: str):
+    if os.path.exists(filename):
         try:
-            os.remove(dataset_local_xml)
+            os.remove(filename)
         except FileNotFoundError as e:
             context["logger"].error(
-                "dataset id: {} - Error removing local XML file from "
+                "dataset id: {} - Error removing local file from "
                 "ZIP working dir. Details: {}.".format(dataset["id"], e)
             )
@@ -1,14 +1,40 @@
 import json
 import os
-import shutil
 import uuid
+import zipfile
 from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import Executor
+from typing import IO, Iterable, Optional
 
 from azure.storage.blob import BlobServiceClient
 
 from bulk_data_service.dataset_indexing import get_index_name
-from utilities.azure import azure_download_blob, get_azure_container_name, upload_zip_to_azure
-from utilities.misc import filter_dict_by_structure, get_number_xml_files_in_dir, get_timestamp_as_str_z
+from utilities.azure import (
+    azure_download_blob,
+    azure_zip_upload_stream,
+    get_azure_blob_name,
+    get_azure_container_name,
+    upload_zip_to_azure,
+)
+from utilities.misc import filter_dict_by_structure, get_timestamp_as_str_z
+from utilities.zip_writer import ZipWriter
+
+
+def get_local_pathname_dataset_xml(context: dict, dataset: dict) -> str:
+    return "{}/{}".format(get_local_datasets_dir(context), get_azure_blob_name(dataset, "xml"))
+
+
+def get_local_datasets_dir(context: dict) -> str:
+    """Returns the dir in the ZIP working dir holding the XML of the datasets, which all the zippers share"""
+
+    return "{}/iati-data/datasets".format(context["ZIP_WORKING_DIR"])
+
+
+def get_local_pathname_dataset_zip(context: dict, dataset: dict) -> str:
+    """Returns where a dataset's own ZIP is kept, alongside (but outside) the ZIP working dir"""
+
+    return "{}-dataset-zips/{}".format(context["ZIP_WORKING_DIR"], get_azure_blob_name(dataset, "zip"))
 
 
 class IATIDataZipper(ABC):
@@ -19,10 +45,12 @@ class IATIDataZipper(ABC):
         zip_working_dir: str,
         datasets_in_working_dir: dict[uuid.UUID, dict],
         datasets_in_bds: dict[uuid.UUID, dict],
+        updated_dataset_ids: set[uuid.UUID],
     ):
         self.context = context
         self.datasets_in_working_dir = datasets_in_working_dir
         self.datasets_in_bds = datasets_in_bds
+        self.updated_dataset_ids = updated_dataset_ids
         self.zip_working_dir = zip_working_dir
 
     @abstractmethod
@@ -42,15 +70,206 @@ class IATIDataZipper(ABC):
     def zip_local_filename_no_extension(self) -> str:
         return "iati-data"
 
-    def zip(self):
-        self.context["logger"].info("Zipping {} datasets.".format(get_number_xml_files_in_dir(self.zip_working_dir)))
-        shutil.make_archive(
-            self.get_zip_local_pathname_no_extension(),
-            "zip",
-            root_dir=self.zip_working_dir,
-            base_dir=self.zip_internal_directory_name,
+    @property
+    def zip_datasets_directory_name(self) -> str:
+        return "datasets"
+
+    def get_dataset_archive_name(self, dataset: dict) -> str:
+        return "{}/{}/{}".format(
+            self.zip_internal_directory_name, self.zip_datasets_directory_name, get_azure_blob_name(dataset, "xml")
         )
 
+    def zip(self, compression_executor: Optional[Executor] = None):
+        with open(self.get_zip_local_pathname(), "wb") as zip_fileobj:
+            self.write_zip(zip_fileobj, compression_executor)
+
+    def zip_to_azure(self, compression_executor: Optional[Executor] = None):
+        """Creates the ZIP file and uploads it to Azure as it is written, without writing it locally
+
+        As there is no previous ZIP file to copy from on the next run, the XML of the datasets is copied
+        from their own ZIPs instead."""
+
+        self.context["logger"].info(
+            "Streaming {} ZIP to Azure with filename: {}.".format(self.zip_type, self.get_zip_local_filename())
+        )
+
+        with azure_zip_upload_stream(self.context, self.get_zip_local_filename()) as zip_stream:
+            self.write_zip(zip_stream, compression_executor)
+
+    def write_zip(self, zip_fileobj: IO[bytes], compression_executor: Optional[Executor] = None):
+        """Writes the ZIP file, copying the already-compressed XML of datasets rather than compressing it
+
+        The files in the ZIP file are given by get_zip_layout, so the XML of the datasets isn't copied
+        into the zipper's working dir. Instead of compressing every file on each run, the XML of a
+        dataset is copied, still compressed, from:
+
+        - the previous ZIP file (kept by keep_previous_zip), if the dataset hasn't been updated since
+        - otherwise, the dataset's own ZIP (see get_local_pathname_dataset_zip), if it was downloaded
+
+        Only the XML of datasets in neither, and the other files, such as the indices and metadata, are
+        compressed, by compression_executor's processes if given."""
+
+        zip_layout = self.get_zip_layout()
+
+        self.context["logger"].info(
+            "Zipping {} datasets.".format(sum(1 for archive_name in zip_layout if archive_name.endswith(".xml")))
+        )
+
+        reusable_archive_names = self.get_reusable_archive_names()
+
+        dataset_zip_pathnames = self.get_dataset_zip_pathnames()
+
+        previous_zip = self.open_previous_zip()
+
+        with ZipWriter(zip_fileobj, self.context["logger"], compression_executor) as zip_writer:
+            members_added = self.add_layout_to_zip(
+                zip_writer, zip_layout, previous_zip, reusable_archive_names, dataset_zip_pathnames
+            )
+
+        if previous_zip is not None:
+            previous_zip.close()
+            os.remove(self.get_previous_zip_pathname())
+
+        self.context["logger"].info(
+            "{} ZIP created: {} dataset files copied from previous ZIP, {} copied from dataset ZIPs, "
+            "{} files compressed.".format(
+                self.zip_type,
+                members_added["previous_zip"],
+                members_added["dataset_zip"],
+                members_added["compressed"],
+            )
+        )
+
+    def add_layout_to_zip(
+        self,
+        zip_writer: ZipWriter,
+        zip_layout: dict[str, str],
+        previous_zip: Optional[zipfile.ZipFile],
+        reusable_archive_names: set[str],
+        dataset_zip_pathnames: dict[str, str],
+    ) -> Counter:
+        """Adds the directories and files of the ZIP's layout to the ZIP, counting where each file came from"""
+
+        members_added: Counter = Counter()
+
+        for archive_dirname in get_archive_directory_names(zip_layout):
+            zip_writer.add_directory(archive_dirname)
+
+        for archive_name, pathname in sorted(zip_layout.items()):
+            compressed_source = self.get_previous_zip_member(
+                previous_zip, reusable_archive_names, archive_name, pathname
+            ) or self.get_dataset_zip_member(dataset_zip_pathnames.get(archive_name), pathname)
+
+            if compressed_source is not None:
+                source_zip_pathname, source_info, source_type = compressed_source
+                zip_writer.add_compressed_member(archive_name, source_zip_pathname, source_info, pathname)
+                members_added[source_type] += 1
+            else:
+                zip_writer.add_file(archive_name, pathname)
+                members_added["compressed"] += 1
+
+        return members_added
+
+    def get_zip_layout(self) -> dict[str, str]:
+        """Returns the files to put in the ZIP, as a map from their names in the ZIP to their local pathnames
+
+        The XML of the datasets is shared by all the zippers, and is added from the ZIP working dir. The
+        other files, such as the indices and metadata, are created by prepare() in the zipper's own
+        working dir, and are added from there."""
+
+        return get_files_in_dir(
+            get_local_datasets_dir(self.context),
+            "{}/{}".format(self.zip_internal_directory_name, self.zip_datasets_directory_name),
+        ) | get_files_in_dir(
+            os.path.join(self.zip_working_dir, self.zip_internal_directory_name), self.zip_internal_directory_name
+        )
+
+    def get_previous_zip_member(
+        self,
+        previous_zip: Optional[zipfile.ZipFile],
+        reusable_archive_names: set[str],
+        archive_name: str,
+        pathname: str,
+    ) -> Optional[tuple[str, zipfile.ZipInfo, str]]:
+        """Returns the previous ZIP file and its member for a file, if it can be copied from there"""
+
+        if previous_zip is None or archive_name not in reusable_archive_names:
+            return None
+
+        try:
+            previous_info = previous_zip.getinfo(archive_name)
+        except KeyError:
+            return None
+
+        # guards against the file in the working dir having changed without its hash changing
+        if previous_info.file_size != os.path.getsize(pathname):
+            return None
+
+        return self.get_previous_zip_pathname(), previous_info, "previous_zip"
+
+    def get_dataset_zip_member(
+        self, dataset_zip_pathname: Optional[str], pathname: str
+    ) -> Optional[tuple[str, zipfile.ZipInfo, str]]:
+        """Returns a dataset's own ZIP and its single member, if the dataset's XML can be copied from there"""
+
+        if dataset_zip_pathname is None or not os.path.exists(dataset_zip_pathname):
+            return None
+
+        try:
+            with zipfile.ZipFile(dataset_zip_pathname) as dataset_zip:
+                dataset_zip_members = dataset_zip.infolist()
+        except (OSError, zipfile.BadZipFile) as e:
+            self.context["logger"].warning(
+                "Unable to read dataset ZIP {}, so compressing its XML. Details: {}".format(dataset_zip_pathname, e)
+            )
+            return None
+
+        # ZIPs made before dataset ZIPs were deflated store the XML uncompressed
+        if (
+            len(dataset_zip_members) != 1
+            or dataset_zip_members[0].compress_type != zipfile.ZIP_DEFLATED
+            or dataset_zip_members[0].file_size != os.path.getsize(pathname)
+        ):
+            return None
+
+        return dataset_zip_pathname, dataset_zip_members[0], "dataset_zip"
+
+    def get_reusable_archive_names(self) -> set[str]:
+        """Returns the names in the ZIP of the XML files of the datasets which haven't changed since the last run"""
+
+        return {
+            self.get_dataset_archive_name(dataset)
+            for dataset_id, dataset in self.datasets_in_working_dir.items()
+            if dataset_id not in self.updated_dataset_ids
+        }
+
+    def get_dataset_zip_pathnames(self) -> dict[str, str]:
+        """Returns the local pathnames of the datasets' own ZIPs, by the name of their XML in the ZIP"""
+
+        return {
+            self.get_dataset_archive_name(dataset): get_local_pathname_dataset_zip(self.context, dataset)
+            for dataset in self.datasets_in_working_dir.values()
+        }
+
+    def keep_previous_zip(self):
+        """Moves the ZIP file from the last run out of the working dir, so that it survives the dir's recreation"""
+
+        if os.path.exists(self.get_zip_local_pathname()):
+            os.replace(self.get_zip_local_pathname(), self.get_previous_zip_pathname())
+
+    def open_previous_zip(self) -> Optional[zipfile.ZipFile]:
+
+        if not os.path.exists(self.get_previous_zip_pathname()):
+            return None
+
+        try:
+            return zipfile.ZipFile(self.get_previous_zip_pathname())
+        except (OSError, zipfile.BadZipFile) as e:
+            self.context["logger"].warning(
+                "Unable to open previous {} ZIP, so compressing all files. Details: {}".format(self.zip_type, e)
+            )
+            return None
+
     def upload(self):
         self.context["logger"].info(
             "Uploading {} ZIP to Azure with filename: {}.".format(self.zip_type, self.get_zip_local_filename())
@@ -66,6 +285,36 @@ class IATIDataZipper(ABC):
     def get_zip_local_pathname_no_extension(self) -> str:
         return "{}/{}".format(self.zip_working_dir, self.zip_local_filename_no_extension)
 
+    def get_previous_zip_pathname(self) -> str:
+        return "{}-previous.zip".format(self.zip_working_dir)
+
+
+def get_files_in_dir(dir_name: str, archive_dir_name: str) -> dict[str, str]:
+    """Returns the pathnames of the files in a dir and its subdirs, by their names in a ZIP under archive_dir_name"""
+
+    files = {}
+
+    for dirpath, _, filenames in os.walk(dir_name):
+        for filename in filenames:
+            pathname = os.path.join(dirpath, filename)
+            files[os.path.join(archive_dir_name, os.path.relpath(pathname, dir_name))] = pathname
+
+    return files
+
+
+def get_archive_directory_names(archive_names: Iterable[str]) -> list[str]:
+    """Returns the names of all the directories containing the given files in a ZIP, sorted"""
+
+    archive_dirnames = set()
+
+    for archive_name in archive_names:
+        archive_dirname = os.path.dirname(archive_name)
+        while archive_dirname != "" and archive_dirname not in archive_dirnames:
+            archive_dirnames.add(archive_dirname)
+            archive_dirname = os.path.dirname(archive_dirname)
+
+    return sorted(archive_dirnames)
+
 
 class IATIBulkDataServiceZipper(IATIDataZipper):
 
@@ -98,20 +347,6 @@ class IATIBulkDataServiceZipper(IATIDataZipper):
 class CodeforIATILegacyZipper(IATIDataZipper):
 
     def prepare(self):
-        # rename 'iati-data' directory to 'iati-data-main'
-        if os.path.exists(os.path.join(self.zip_working_dir, super().zip_internal_directory_name)):
-            os.rename(
-                os.path.join(self.zip_working_dir, super().zip_internal_directory_name),
-                os.path.join(self.zip_working_dir, self.zip_internal_directory_name),
-            )
-
-        # rename 'datasets' directory to 'data'
-        if os.path.exists(os.path.join(self.zip_working_dir, self.zip_internal_directory_name, "datasets")):
-            os.rename(
-                os.path.join(self.zip_working_dir, self.zip_internal_directory_name, "datasets"),
-                os.path.join(self.zip_working_dir, self.zip_internal_directory_name, "data"),
-            )
-
         self.create_empty_files_for_non_downloadable_datasets()
 
         if not os.path.exists(os.path.join(self.zip_working_dir, self.zip_internal_directory_name, "metadata")):
@@ -125,15 +360,10 @@ class CodeforIATILegacyZipper(IATIDataZipper):
         self.create_zip_file_metadata()
 
     def create_empty_files_for_non_downloadable_datasets(self):
-        for dataset_in_bds_db in self.datasets_in_bds:
-            dataset = self.datasets_in_bds[dataset_in_bds_db]
-            dataset_pathname = self.get_dataset_data_pathname(self.datasets_in_bds[dataset_in_bds_db])
-            dataset_filename = self.get_dataset_data_filename(self.datasets_in_bds[dataset_in_bds_db])
-            if dataset["last_successful_download"] is None:
-                if not os.path.exists(dataset_pathname):
-                    os.makedirs(dataset_pathname, exist_ok=True)
-            if not os.path.exists(dataset_filename):
-                open(dataset_filename, "w").close()
+        for dataset in self.datasets_in_bds.values():
+            if not os.path.exists(get_local_pathname_dataset_xml(self.context, dataset)):
+                os.makedirs(self.get_dataset_data_pathname(dataset), exist_ok=True)
+                open(self.get_dataset_data_filename(dataset), "w").close()
 
     def write_publisher_metadata_files(self):
         for dataset_in_bds_db in self.datasets_in_bds:
@@ -173,7 +403,7 @@ class CodeforIATILegacyZipper(IATIDataZipper):
                 with open(dataset_metadata_filename, "w") as pub_file:
                     pub_file.write(
                         self.filter_dataset_metadata_file(
-                            self.datasets_in_bds[dataset_in_bds_db]["registration_service_dataset_metadata"]
+                            str(self.datasets_in_bds[dataset_in_bds_db]["registration_service_dataset_metadata"])
                         )
                     )
 
@@ -219,6 +449,10 @@ class CodeforIATILegacyZipper(IATIDataZipper):
     def zip_internal_directory_name(self) -> str:
         return "iati-data-main"
 
+    @property
+    def zip_datasets_directory_name(self) -> str:
+        return "data"
+
     @property
     def zip_local_filename_no_extension(self) -> str:
         return "code-for-iati-data-download"
@@ -5,11 +5,22 @@ _config_variables = [
     "DATA_REGISTRY_BASE_URL",
     "DATA_REGISTRY_PUBLISHER_METADATA_URL",
     "DATA_REGISTRY_PUBLISHER_METADATA_REFRESH_AFTER_HOURS",
+    "DATA_REGISTRY_PUBLISHER_METADATA_CACHE_FILE",
+    "DATA_REGISTRY_FETCH_THREADS",
+    "DATA_REGISTRY_FULL_RESYNC_AFTER_HOURS",
+    "DATA_REGISTRY_SNAPSHOT_FILE",
     "WEB_BASE_URL",
     "NUMBER_DOWNLOADER_THREADS",
+    "DOWNLOADER_ENGINE",
+    "DOWNLOADER_MAX_CONCURRENT_REQUESTS",
+    "DOWNLOADER_MAX_CONCURRENT_REQUESTS_PER_HOST",
+    "DOWNLOADER_MIN_SECONDS_BETWEEN_REQUESTS_PER_HOST",
     "FORCE_REDOWNLOAD_AFTER_HOURS",
     "REMOVE_LAST_GOOD_DOWNLOAD_AFTER_FAILING_HOURS",
     "ZIP_WORKING_DIR",
+    "ZIP_DOWNLOAD_THREADS",
+    "ZIP_COMPRESSION_PROCESSES",
+    "ZIP_UPLOAD_MODE",
     "DB_NAME",
     "DB_USER",
     "DB_PASS",
@@ -17,15 +28,39 @@ _config_variables = [
     "DB_PORT",
     "DB_SSL_MODE",
     "DB_CONNECTION_TIMEOUT",
+    "DB_WRITE_BATCH_SIZE",
+    "DB_WRITE_BATCH_MAX_SECONDS",
     "AZURE_STORAGE_CONNECTION_STRING",
     "AZURE_STORAGE_BLOB_CONTAINER_NAME_IATI_XML",
     "AZURE_STORAGE_BLOB_CONTAINER_NAME_IATI_ZIP",
-    "CHECKER_LOOP_WAIT_MINS"
+    "AZURE_UPLOAD_BLOCK_SIZE_MB",
+    "AZURE_UPLOAD_MAX_CONCURRENCY",
+    "CHECKER_LOOP_WAIT_MINS",
 ]
 
+# values for the optional config variables, used when they are not set in the environment (a variable
+# set to an empty value is left empty, which e.g. disables the snapshot and publisher metadata cache files)
+_config_defaults = {
+    "DATA_REGISTRY_PUBLISHER_METADATA_CACHE_FILE": "/tmp/bulk-data-service-publisher-metadata.json.gz",
+    "DATA_REGISTRY_FETCH_THREADS": "4",
+    "DATA_REGISTRY_FULL_RESYNC_AFTER_HOURS": "24",
+    "DATA_REGISTRY_SNAPSHOT_FILE": "/tmp/bulk-data-service-registry-snapshot.json.gz",
+    "DOWNLOADER_ENGINE": "threads",
+    "DOWNLOADER_MAX_CONCURRENT_REQUESTS": "500",
+    "DOWNLOADER_MAX_CONCURRENT_REQUESTS_PER_HOST": "4",
+    "DOWNLOADER_MIN_SECONDS_BETWEEN_REQUESTS_PER_HOST": "0.1",
+    "ZIP_DOWNLOAD_THREADS": "16",
+    "ZIP_COMPRESSION_PROCESSES": "0",
+    "ZIP_UPLOAD_MODE": "file",
+    "DB_WRITE_BATCH_SIZE": "500",
+    "DB_WRITE_BATCH_MAX_SECONDS": "30",
+    "AZURE_UPLOAD_BLOCK_SIZE_MB": "8",
+    "AZURE_UPLOAD_MAX_CONCURRENCY": "4",
+}
+
 
 def get_config() -> dict[str, str]:
-    config = {env_var: os.getenv(env_var, "") for env_var in _config_variables}
+    config = {env_var: os.getenv(env_var, _config_defaults.get(env_var, "")) for env_var in _config_variables}
 
     config["WEB_BASE_URL"] = config["WEB_BASE_URL"].strip("/")
 
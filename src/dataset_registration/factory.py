@@ -8,3 +8,11 @@ def get_func_to_fetch_list_registered_datasets(config: dict) -> Callable[..., di
     else:
         from dataset_registration.iati_register_your_data import fetch_datasets_metadata
     return fetch_datasets_metadata
+
+
+def get_func_to_save_registration_sync_state(config: dict) -> Callable[[dict], None]:
+    if config["DATA_REGISTRATION"] == "ckan-registry":
+        from dataset_registration.iati_registry_ckan import save_sync_state
+    else:
+        from dataset_registration.iati_register_your_data import save_sync_state
+    return save_sync_state
@@ -5,3 +5,7 @@ import requests
 
 def fetch_datasets_metadata(context: dict, session: requests.Session) -> dict[uuid.UUID, dict]:
     return {}
+
+
+def save_sync_state(context: dict):
+    pass
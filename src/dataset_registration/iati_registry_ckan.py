@@ -1,121 +1,380 @@
+import concurrent.futures
 import json
 import random
+import threading
+import time
 import uuid
 from datetime import datetime, timedelta
 from logging import Logger
-from typing import Any
+from typing import Any, Callable, Iterable, Optional
+from urllib.parse import quote
 
+import ijson  # type: ignore
 import requests
 
-from utilities.http import http_get_json
+from dataset_registration.publisher_metadata_cache import PublisherMetadataCache
+from utilities.bds_dataset import BDSDataset
+from utilities.db import get_registration_info_of_datasets_in_bds, get_registry_sync_state, save_registry_sync_state
+from utilities.http import http_get_json, http_get_json_items
 from utilities.misc import get_timestamp
 
-PUBLISHER_METADATA: dict[str, Any] = {}
-PUBLISHER_METADATA_LAST_UPDATE: datetime = get_timestamp() - timedelta(hours=25)
+# number of datasets requested per page, and how many times a page is requested before giving up
+REGISTRY_PAGE_SIZE = 1000
+REGISTRY_PAGE_FETCH_ATTEMPTS = 3
+
+# the order of the Registry's results, which must be stable for them to be fetched in pages
+REGISTRY_PAGE_SORT = "id asc"
+
+# datasets can be committed to the Registry with a metadata_modified slightly earlier than the latest one
+# already seen, so incremental syncs ask for datasets modified since this long before the high-water mark
+REGISTRY_SYNC_OVERLAP = timedelta(minutes=10)
+
+PUBLISHER_METADATA = PublisherMetadataCache()
+
+# the datasets as of the last sync with the Registry, which incremental syncs update, and the sync state,
+# which is unsaved until the datasets fetched by the sync have been committed to the DB
+REGISTERED_DATASETS: dict[uuid.UUID, dict] = {}
+REGISTRY_SYNC_STATE: dict[str, Any] = {
+    "registry_url": None,
+    "high_water_mark": None,
+    "last_full_sync": None,
+    "unsaved": False,
+}
 
 
 def fetch_datasets_metadata(context: dict, session: requests.Session) -> dict[uuid.UUID, dict]:
+    """Fetches the datasets from the Registry: either all of them, or only those changed since the last sync
 
-    datasets_list_from_registry = fetch_datasets_metadata_from_iati_registry(context, session)
+    An incremental sync asks the Registry for the datasets modified since the high-water mark (the
+    latest metadata_modified seen), and for the ids of all datasets, to detect deletions, and merges
+    these into the datasets from the last sync. A full sync is done when there is no previous sync
+    state (in memory, or in the DB after a restart), every DATA_REGISTRY_FULL_RESYNC_AFTER_HOURS as a
+    safety net, and always if that is 0 or run_for_n_datasets is set.
 
-    random.shuffle(datasets_list_from_registry)
+    The new sync state is only saved to the DB by save_sync_state, once the checker has committed
+    the datasets, as after a restart an incremental sync starts from the high-water mark in the DB."""
 
-    cleaned_datasets_metadata = clean_datasets_metadata(context["logger"], datasets_list_from_registry)
+    if incremental_sync_possible(context):
+        fetch_changed_datasets_metadata(context, session)
+    else:
+        fetch_all_datasets_metadata(context, session)
 
-    add_publisher_metadata(context, session, cleaned_datasets_metadata)
+    # a sync of only run_for_n_datasets datasets can't be the base for a later incremental sync
+    REGISTRY_SYNC_STATE["unsaved"] = context["run_for_n_datasets"] is None
 
-    datasets_metadata = convert_datasets_metadata(cleaned_datasets_metadata)
+    return dict(REGISTERED_DATASETS)
 
-    return datasets_metadata
 
+def save_sync_state(context: dict):
+    """Saves the state of the last sync to the DB, once the datasets it fetched have been committed"""
 
-def fetch_datasets_metadata_from_iati_registry(context: dict, session: requests.Session) -> list[dict]:
+    if not REGISTRY_SYNC_STATE["unsaved"]:
+        return
 
-    api_url = context["DATA_REGISTRY_BASE_URL"]
+    save_registry_sync_state(
+        context,
+        REGISTRY_SYNC_STATE["registry_url"],
+        REGISTRY_SYNC_STATE["high_water_mark"],
+        REGISTRY_SYNC_STATE["last_full_sync"],
+    )
 
-    number_of_datasets = http_get_json(session, api_url + "?rows=1")["result"]["count"]
+    REGISTRY_SYNC_STATE["unsaved"] = False
 
-    if context["run_for_n_datasets"] is not None:
-        number_of_datasets = min(number_of_datasets, int(context["run_for_n_datasets"]))
 
-    batch_size = number_of_datasets if number_of_datasets < 1000 else 1000
+def incremental_sync_possible(context: dict) -> bool:
+    full_resync_after_hours = int(context["DATA_REGISTRY_FULL_RESYNC_AFTER_HOURS"])
+
+    if full_resync_after_hours == 0 or context["run_for_n_datasets"] is not None:
+        return False
+
+    if REGISTRY_SYNC_STATE["registry_url"] != context["DATA_REGISTRY_BASE_URL"]:
+        load_registry_sync_state(context)
+
+    return (
+        REGISTRY_SYNC_STATE["high_water_mark"] is not None
+        and REGISTRY_SYNC_STATE["last_full_sync"] is not None
+        and REGISTRY_SYNC_STATE["last_full_sync"] > get_timestamp() - timedelta(hours=full_resync_after_hours)
+    )
 
-    datasets_metadata_downloaded = 0
-    datasets_metadata = []
 
-    while datasets_metadata_downloaded < number_of_datasets:
-        response = http_get_json(
-            session, "{}?rows={}&start={}".format(api_url, batch_size, str(datasets_metadata_downloaded))
+def load_registry_sync_state(context: dict):
+    """Loads the state of the last sync from the DB, with the registration info of the datasets in the DB"""
+
+    registry_url = context["DATA_REGISTRY_BASE_URL"]
+
+    REGISTERED_DATASETS.clear()
+    REGISTRY_SYNC_STATE.update(
+        {"registry_url": registry_url, "high_water_mark": None, "last_full_sync": None, "unsaved": False}
+    )
+
+    sync_state = get_registry_sync_state(context, registry_url)
+
+    if sync_state is None:
+        return
+
+    REGISTERED_DATASETS.update(get_registration_info_of_datasets_in_bds(context, "ckan-registry"))
+    REGISTRY_SYNC_STATE.update(sync_state)
+
+    context["logger"].info(
+        "Loaded state of last sync with IATI Registry (CKAN) from DB. High-water mark: {}. Datasets: {}".format(
+            sync_state["high_water_mark"], len(REGISTERED_DATASETS)
         )
+    )
 
-        datasets_metadata.extend(response["result"]["results"])
 
-        datasets_metadata_downloaded += len(response["result"]["results"])
+def fetch_all_datasets_metadata(context: dict, session: requests.Session):
 
-    return datasets_metadata
+    converter = RegistryDatasetConverter(context["logger"])
 
+    datasets_metadata = fetch_datasets_metadata_from_iati_registry(context, session, convert=converter.convert)
 
-def add_publisher_metadata(context: dict, session: requests.Session, datasets_from_registry: list[dict[str, Any]]):
-    for registry_dataset in datasets_from_registry:
-        publisher_metadata = ""
-        if "organization" in registry_dataset and "name" in registry_dataset["organization"]:
-            publisher_metadata = get_publisher_metadata_as_str(
-                context, session, registry_dataset["organization"]["name"]
-            )
-        registry_dataset["registration_service_publisher_metadata"] = publisher_metadata
+    random.shuffle(datasets_metadata)
 
+    REGISTERED_DATASETS.clear()
+    REGISTERED_DATASETS.update({dataset["id"]: dataset for dataset in datasets_metadata})
 
-def get_publisher_metadata_as_str(context: dict, session: requests.Session, publisher_name: str) -> str:
-    global PUBLISHER_METADATA, PUBLISHER_METADATA_LAST_UPDATE
-
-    if PUBLISHER_METADATA_LAST_UPDATE < get_timestamp() - timedelta(
-        hours=int(context["DATA_REGISTRY_PUBLISHER_METADATA_REFRESH_AFTER_HOURS"])
-    ):
-        context["logger"].info(
-            "Refreshing publisher metadata from IATI Registry (CKAN) "
-            "after {} hours...".format(context["DATA_REGISTRY_PUBLISHER_METADATA_REFRESH_AFTER_HOURS"])
+    update_publisher_metadata_of_registered_datasets(context, session, REGISTERED_DATASETS)
+
+    REGISTRY_SYNC_STATE.update(
+        {
+            "registry_url": context["DATA_REGISTRY_BASE_URL"],
+            "high_water_mark": converter.high_water_mark,
+            "last_full_sync": get_timestamp(),
+        }
+    )
+
+
+def fetch_changed_datasets_metadata(context: dict, session: requests.Session):
+
+    modified_since = datetime.fromisoformat(REGISTRY_SYNC_STATE["high_water_mark"]) - REGISTRY_SYNC_OVERLAP
+
+    converter = RegistryDatasetConverter(context["logger"], REGISTRY_SYNC_STATE["high_water_mark"])
+
+    changed_datasets_metadata = fetch_datasets_metadata_from_iati_registry(
+        context,
+        session,
+        {"fq": "metadata_modified:[{}Z TO *]".format(modified_since.isoformat())},
+        converter.convert,
+    )
+
+    registered_ids = {
+        dataset["id"] for dataset in fetch_datasets_metadata_from_iati_registry(context, session, {"fl": "id"})
+    }
+
+    # changed datasets which are no longer valid are removed, as they are from a full sync
+    for dataset_id in [k for k in REGISTERED_DATASETS if str(k) not in registered_ids or str(k) in converter.ids_seen]:
+        del REGISTERED_DATASETS[dataset_id]
+
+    REGISTERED_DATASETS.update(
+        {dataset["id"]: dataset for dataset in changed_datasets_metadata if str(dataset["id"]) in registered_ids}
+    )
+
+    update_publisher_metadata_of_registered_datasets(context, session, REGISTERED_DATASETS)
+
+    REGISTRY_SYNC_STATE["high_water_mark"] = converter.high_water_mark
+
+    context["logger"].info(
+        "Incremental sync with IATI Registry (CKAN): {} datasets changed since {}. Datasets registered: {}".format(
+            len(converter.ids_seen), modified_since.isoformat(), len(REGISTERED_DATASETS)
         )
-        update_publisher_metadata_cache(context, session)
-        PUBLISHER_METADATA_LAST_UPDATE = get_timestamp()
+    )
+
+
+class RegistryDatasetConverter:
+    """Validates and converts datasets from the Registry one at a time, as they are parsed
+
+    This lets each page of the Registry's results be streamed, so that neither a whole page nor the
+    whole list of datasets is ever held in the Registry's format. The ids of all the datasets seen
+    (valid or not) and the latest metadata_modified are kept for incremental syncs. Pages are fetched
+    by several threads, so these are updated under a lock."""
+
+    def __init__(self, logger: Logger, high_water_mark: Optional[str] = None):
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.ids_seen: set[str] = set()
+        self.high_water_mark = high_water_mark
+
+    def convert(self, registry_dataset: dict[str, Any]) -> Optional[dict]:
+        with self.lock:
+            self.ids_seen.add(registry_dataset["id"])
+            self.update_high_water_mark(registry_dataset.get("metadata_modified"))
+
+        if not ckan_dataset_is_valid(self.logger, registry_dataset):
+            return None
 
-    return PUBLISHER_METADATA[publisher_name] if publisher_name in PUBLISHER_METADATA else "{}"
+        return convert_dataset_metadata(registry_dataset)
 
+    def update_high_water_mark(self, metadata_modified: Optional[str]):
+        # CKAN's metadata_modified values are ISO 8601 in UTC, with no timezone, so compare as strings
+        if metadata_modified and (self.high_water_mark is None or metadata_modified > self.high_water_mark):
+            self.high_water_mark = metadata_modified
 
-def update_publisher_metadata_cache(context: dict, session: requests.Session):
-    global PUBLISHER_METADATA, PUBLISHER_METADATA_LAST_UPDATE
 
-    url = context["DATA_REGISTRY_PUBLISHER_METADATA_URL"]
+def fetch_datasets_metadata_from_iati_registry(
+    context: dict,
+    session: requests.Session,
+    query: Optional[dict[str, str]] = None,
+    convert: Callable[[dict], Optional[dict]] = lambda registry_dataset: registry_dataset,
+) -> list[dict]:
+    """Fetches the metadata of datasets from the Registry, requesting the pages concurrently
 
-    PUBLISHER_METADATA = {}
+    All datasets are fetched, unless query has additional parameters for package_search (e.g., fq
+    to filter, or fl to choose the fields returned). The number of datasets is known from the first
+    request, so all the pages can be requested at once, by up to DATA_REGISTRY_FETCH_THREADS threads.
+    Each dataset is passed to convert as soon as it is parsed from the page, and left out if that
+    returns None.
 
+    The pages are sorted by id, so that they are stable, but datasets can still move between pages if
+    datasets are added or removed while they are being fetched. Duplicates are removed by id, keeping
+    the first occurrence in page order, and if the number of datasets has changed by the end, as a
+    dataset may then have been skipped, they are all fetched again."""
+
+    api_url = (
+        context["DATA_REGISTRY_BASE_URL"]
+        + "?"
+        + "".join("{}={}&".format(param, quote(value)) for param, value in (query or {}).items())
+        + "sort={}&".format(quote(REGISTRY_PAGE_SORT))
+    )
+
+    number_of_datasets = fetch_number_of_datasets(session, api_url)
+
+    for attempt in range(1, REGISTRY_PAGE_FETCH_ATTEMPTS + 1):
+        datasets_metadata = fetch_registry_pages(context, session, api_url, number_of_datasets, convert)
+
+        number_of_datasets_after_fetch = fetch_number_of_datasets(session, api_url)
+
+        if number_of_datasets_after_fetch == number_of_datasets:
+            return datasets_metadata
+
+        context["logger"].warning(
+            "Number of datasets in IATI Registry (CKAN) changed from {} to {} while fetching them, "
+            "so fetching them again.".format(number_of_datasets, number_of_datasets_after_fetch)
+        )
+
+        number_of_datasets = number_of_datasets_after_fetch
+
+    raise RuntimeError(
+        "Number of datasets in IATI Registry (CKAN) changed while fetching them, {} times".format(
+            REGISTRY_PAGE_FETCH_ATTEMPTS
+        )
+    )
+
+
+def fetch_registry_pages(
+    context: dict,
+    session: requests.Session,
+    api_url: str,
+    number_of_datasets: int,
+    convert: Callable[[dict], Optional[dict]],
+) -> list[dict]:
+
+    if context["run_for_n_datasets"] is not None:
+        number_of_datasets = min(number_of_datasets, int(context["run_for_n_datasets"]))
+
+    batch_size = max(1, min(number_of_datasets, REGISTRY_PAGE_SIZE))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=int(context["DATA_REGISTRY_FETCH_THREADS"])) as executor:
+        pages = executor.map(
+            lambda start: fetch_registry_page(context, session, api_url, batch_size, start, convert),
+            range(0, number_of_datasets, batch_size),
+        )
+
+        datasets_metadata = deduplicate_datasets_metadata(context, pages)
+
+    context["logger"].info(
+        "Fetched metadata for {} datasets from IATI Registry (CKAN). Expected {}.".format(
+            len(datasets_metadata), number_of_datasets
+        )
+    )
+
+    return datasets_metadata
+
+
+def fetch_number_of_datasets(session: requests.Session, api_url: str) -> int:
     try:
-        publishers_metadata = http_get_json(session, url, 60, True)
+        return http_get_json(session, api_url + "rows=1")["result"]["count"]
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        raise RuntimeError("Failed to fetch number of datasets from IATI Registry (CKAN): {}".format(e)) from e
+
+
+def fetch_registry_page(
+    context: dict,
+    session: requests.Session,
+    api_url: str,
+    batch_size: int,
+    start: int,
+    convert: Callable[[dict], Optional[dict]],
+) -> list[dict]:
+
+    for attempt in range(1, REGISTRY_PAGE_FETCH_ATTEMPTS + 1):
+        try:
+            registry_datasets = http_get_json_items(
+                session, "{}rows={}&start={}".format(api_url, batch_size, start), "result.results.item"
+            )
+            return [
+                dataset for registry_dataset in registry_datasets if (dataset := convert(registry_dataset)) is not None
+            ]
+        except (RuntimeError, requests.RequestException, ijson.JSONError) as e:
+            if attempt == REGISTRY_PAGE_FETCH_ATTEMPTS:
+                raise RuntimeError(
+                    "Failed to fetch page of datasets starting at {} after {} attempts: {}".format(
+                        start, REGISTRY_PAGE_FETCH_ATTEMPTS, e
+                    )
+                ) from e
+
+            context["logger"].warning(
+                "Error fetching page of datasets starting at {} from IATI Registry (CKAN), "
+                "retrying. Details: {}".format(start, e)
+            )
+
+            time.sleep(2**attempt)
+
+    return []
 
-        PUBLISHER_METADATA = {publisher["name"]: json.dumps(publisher) for publisher in publishers_metadata["result"]}
 
-    except RuntimeError as e:
-        context["logger"].error("HTTP error when fetching publisher metadata from IATI Registry (CKAN): {}".format(e))
-    except Exception as e:
-        context["logger"].error(
-            "Unexpected error when fetching publisher metadata from IATI Registry (CKAN): {}".format(e)
+def deduplicate_datasets_metadata(context: dict, pages: Iterable[list[dict]]) -> list[dict]:
+    datasets_metadata = {}  # type: dict[str, dict]
+    duplicates = 0
+
+    for page in pages:
+        for dataset_metadata in page:
+            if dataset_metadata["id"] in datasets_metadata:
+                duplicates += 1
+                continue
+            datasets_metadata[dataset_metadata["id"]] = dataset_metadata
+
+    if duplicates > 0:
+        context["logger"].info("Skipped {} duplicate datasets from IATI Registry (CKAN)".format(duplicates))
+
+    return list(datasets_metadata.values())
+
+
+def update_publisher_metadata_of_registered_datasets(
+    context: dict, session: requests.Session, registered_datasets: dict[uuid.UUID, dict]
+):
+    for registered_dataset in registered_datasets.values():
+        registered_dataset["registration_service_publisher_metadata"] = get_publisher_metadata_as_str(
+            context, session, registered_dataset["publisher_name"]
         )
 
 
-def clean_datasets_metadata(logger: Logger, datasets_from_registry: list[dict[str, Any]]) -> list[dict[str, Any]]:
-    """Cleans the list of datasets from the IATI Registry
+def get_publisher_metadata_as_str(context: dict, session: requests.Session, publisher_name: str) -> str:
+    return PUBLISHER_METADATA.get(
+        context["logger"],
+        publisher_name,
+        timedelta(hours=int(context["DATA_REGISTRY_PUBLISHER_METADATA_REFRESH_AFTER_HOURS"])),
+        context["DATA_REGISTRY_PUBLISHER_METADATA_CACHE_FILE"],
+        lambda: fetch_publisher_metadata(context, session),
+    )
 
-    The data from the Registry should never be missing the values below, so if it is, we log an error
-    and skip that item. This allows for tidy conversion using dictionary comprehension."""
 
-    cleaned_datasets_metadata = []
+def fetch_publisher_metadata(context: dict, session: requests.Session) -> dict[str, str]:
 
-    for dataset_metadata in datasets_from_registry:
-        if not ckan_dataset_is_valid(logger, dataset_metadata):
-            continue
+    context["logger"].info("Refreshing publisher metadata from IATI Registry (CKAN)...")
 
-        cleaned_datasets_metadata.append(dataset_metadata)
+    publishers_metadata = http_get_json(session, context["DATA_REGISTRY_PUBLISHER_METADATA_URL"], 60, True)
 
-    return cleaned_datasets_metadata
+    return {publisher["name"]: json.dumps(publisher) for publisher in publishers_metadata["result"]}
 
 
 def ckan_dataset_is_valid(logger: Logger, registry_dataset: dict[str, Any]) -> bool:
@@ -164,10 +423,9 @@ def ckan_field_is_valid(value: Any) -> bool:
     return value is not None and value != "None" and value != ""
 
 
-def convert_datasets_metadata(datasets_from_registry: list[dict]) -> dict[uuid.UUID, dict]:
-
-    registered_datasets = {
-        uuid.UUID(dataset["id"]): {
+def convert_dataset_metadata(dataset: dict) -> dict:
+    return BDSDataset(
+        {
             "id": uuid.UUID(dataset["id"]),
             "name": dataset["name"],
             "publisher_id": uuid.UUID(dataset["organization"]["id"]),
@@ -184,10 +442,7 @@ def convert_datasets_metadata(datasets_from_registry: list[dict]) -> dict[uuid.U
             ),
             "registration_service_name": "ckan-registry",
         }
-        for dataset in datasets_from_registry
-    }
-
-    return registered_datasets
+    )
 
 
 def get_source_url(ckan_dataset: dict) -> str:
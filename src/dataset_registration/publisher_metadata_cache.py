@@ -0,0 +1,108 @@
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import Callable, Optional
+
+from utilities.misc import get_timestamp
+
+# after a failed refresh, the stale metadata is used for this long before another attempt
+PUBLISHER_METADATA_RETRY_AFTER = timedelta(minutes=15)
+
+
+class PublisherMetadataCache:
+    """Publisher metadata (as JSON strings, by publisher name), refreshed when older than a TTL
+
+    The metadata is saved to cache_file (if not empty) after each refresh, and loaded from it on first
+    use, so after a restart the metadata is only fetched again once it is older than the TTL. If a
+    refresh fails, the stale metadata is kept and used until a refresh succeeds, rather than every
+    publisher's metadata being blanked."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.metadata: dict[str, str] = {}
+        self.last_refresh: Optional[datetime] = None
+        self.last_refresh_attempt: Optional[datetime] = None
+        self.loaded_cache_file: Optional[str] = None
+
+    def get(
+        self,
+        logger: Logger,
+        publisher_name: str,
+        ttl: timedelta,
+        cache_file: str,
+        fetch_metadata: Callable[[], dict[str, str]],
+    ) -> str:
+
+        with self.lock:
+            if self.loaded_cache_file != cache_file:
+                self.load(logger, cache_file)
+
+            if self.needs_refresh(ttl):
+                self.refresh(logger, cache_file, fetch_metadata)
+
+            return self.metadata.get(publisher_name, "{}")
+
+    def needs_refresh(self, ttl: timedelta) -> bool:
+        now = get_timestamp()
+
+        if self.last_refresh is not None and self.last_refresh >= now - ttl:
+            return False
+
+        return self.last_refresh_attempt is None or self.last_refresh_attempt < now - PUBLISHER_METADATA_RETRY_AFTER
+
+    def refresh(self, logger: Logger, cache_file: str, fetch_metadata: Callable[[], dict[str, str]]):
+
+        self.last_refresh_attempt = get_timestamp()
+
+        try:
+            metadata = fetch_metadata()
+        except Exception as e:
+            logger.error(
+                "Failed to refresh publisher metadata, using metadata of {} publishers from {}. "
+                "Details: {}".format(len(self.metadata), self.last_refresh, e)
+            )
+            return
+
+        self.metadata = metadata
+        self.last_refresh = self.last_refresh_attempt
+
+        if cache_file != "":
+            self.save(logger, cache_file)
+
+    def load(self, logger: Logger, cache_file: str):
+
+        self.loaded_cache_file = cache_file
+
+        if cache_file == "" or not os.path.exists(cache_file):
+            return
+
+        try:
+            with gzip.open(cache_file, "rt", encoding="utf-8") as cache_fileobj:
+                cache = json.load(cache_fileobj)
+
+            self.metadata = cache["publishers"]
+            self.last_refresh = get_timestamp(cache["refreshed"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Unable to load publisher metadata from {}: {}".format(cache_file, e))
+            return
+
+        logger.info(
+            "Loaded metadata of {} publishers from {}, refreshed {}".format(
+                len(self.metadata), cache_file, self.last_refresh
+            )
+        )
+
+    def save(self, logger: Logger, cache_file: str):
+
+        cache = {"refreshed": self.last_refresh.isoformat() if self.last_refresh else "", "publishers": self.metadata}
+
+        try:
+            with gzip.open(cache_file + ".tmp", "wt", encoding="utf-8") as cache_fileobj:
+                json.dump(cache, cache_fileobj)
+
+            os.replace(cache_file + ".tmp", cache_file)
+        except OSError as e:
+            logger.error("Unable to save publisher metadata to {}: {}".format(cache_file, e))
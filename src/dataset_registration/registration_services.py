@@ -1,15 +1,119 @@
+import gzip
+import json
+import os
 import uuid
 
+import ijson  # type: ignore
 import requests
 
-from dataset_registration.factory import get_func_to_fetch_list_registered_datasets
+from dataset_registration.factory import (
+    get_func_to_fetch_list_registered_datasets,
+    get_func_to_save_registration_sync_state,
+)
+from utilities.bds_dataset import BDSDataset
+from utilities.misc import get_timestamp, get_timestamp_as_str
+
+# fields of registered datasets which hold UUIDs, stored as strings in snapshots
+SNAPSHOT_UUID_FIELDS = ["id", "publisher_id"]
 
 
 def get_registered_datasets(context: dict) -> dict[uuid.UUID, dict]:
+    """Fetches the registered datasets, falling back to the last snapshot if the registration service fails
+
+    After every successful fetch of the full list of datasets, it is saved as a snapshot to
+    DATA_REGISTRY_SNAPSHOT_FILE. Any failure to fetch the list (including a connection error or
+    timeout) raises a RuntimeError if there is no snapshot to fall back to. When the checker is run
+    with a snapshot to replay, that is used instead of the registration service, so runs can be
+    repeated without the network."""
+
+    if context["replay_registration_snapshot"] is not None:
+        return load_registration_snapshot(context, context["replay_registration_snapshot"])
+
     session = requests.Session()
 
     fetch_datasets_metadata = get_func_to_fetch_list_registered_datasets(context)
 
-    datasets_metadata = fetch_datasets_metadata(context, session)
+    try:
+        datasets_metadata = fetch_datasets_metadata(context, session)
+    except (RuntimeError, requests.RequestException, ijson.JSONError) as e:
+        if not registration_snapshot_available(context):
+            raise RuntimeError("Unable to fetch list of datasets from registration service: {}".format(e)) from e
+
+        context["logger"].error(
+            "Unable to fetch list of datasets from registration service, using last snapshot "
+            "from {}. Details: {}".format(context["DATA_REGISTRY_SNAPSHOT_FILE"], e)
+        )
+
+        return load_registration_snapshot(context, context["DATA_REGISTRY_SNAPSHOT_FILE"])
+
+    # a partial list of datasets would look like mass unregistration, if it were used as a fallback
+    if context["DATA_REGISTRY_SNAPSHOT_FILE"] != "" and context["run_for_n_datasets"] is None:
+        save_registration_snapshot(context, context["DATA_REGISTRY_SNAPSHOT_FILE"], datasets_metadata)
 
     return datasets_metadata
+
+
+def save_registration_sync_state(context: dict):
+    """Saves the state of the last sync with the registration service, once its datasets are in the DB
+
+    Called by the checker after it has committed the registered datasets, so that a crash part way
+    through a run can't leave a sync state which says datasets have been synced when they haven't."""
+
+    if context["replay_registration_snapshot"] is not None:
+        return
+
+    get_func_to_save_registration_sync_state(context)(context)
+
+
+def registration_snapshot_available(context: dict) -> bool:
+    return context["DATA_REGISTRY_SNAPSHOT_FILE"] != "" and os.path.exists(context["DATA_REGISTRY_SNAPSHOT_FILE"])
+
+
+def save_registration_snapshot(context: dict, snapshot_file: str, registered_datasets: dict[uuid.UUID, dict]):
+    """Saves the registered datasets as gzipped JSON, replacing any previous snapshot atomically"""
+
+    snapshot = {
+        "created": get_timestamp_as_str(),
+        "registration_service": context["DATA_REGISTRATION"],
+        "datasets": [
+            dict(dataset) | {field: str(dataset[field]) for field in SNAPSHOT_UUID_FIELDS}
+            for dataset in registered_datasets.values()
+        ],
+    }
+
+    snapshot_file_tmp = snapshot_file + ".tmp"
+
+    try:
+        with gzip.open(snapshot_file_tmp, "wt", encoding="utf-8") as snapshot_fileobj:
+            # default=str decompresses CompressedText values
+            json.dump(snapshot, snapshot_fileobj, default=str)
+
+        os.replace(snapshot_file_tmp, snapshot_file)
+    except OSError as e:
+        context["logger"].error("Unable to save snapshot of registered datasets to {}: {}".format(snapshot_file, e))
+
+
+def load_registration_snapshot(context: dict, snapshot_file: str) -> dict[uuid.UUID, dict]:
+
+    try:
+        with gzip.open(snapshot_file, "rt", encoding="utf-8") as snapshot_fileobj:
+            snapshot = json.load(snapshot_fileobj)
+    except (OSError, ValueError) as e:
+        raise RuntimeError("Unable to load snapshot of registered datasets from {}: {}".format(snapshot_file, e))
+
+    context["logger"].info(
+        "Loaded snapshot of {} registered datasets from {}, created {} ({} ago)".format(
+            len(snapshot["datasets"]),
+            snapshot_file,
+            snapshot["created"],
+            get_timestamp() - get_timestamp(snapshot["created"]),
+        )
+    )
+
+    registered_datasets: dict[uuid.UUID, dict] = {}
+
+    for dataset in snapshot["datasets"]:
+        dataset.update({field: uuid.UUID(dataset[field]) for field in SNAPSHOT_UUID_FIELDS})
+        registered_datasets[dataset["id"]] = BDSDataset(dataset)
+
+    return registered_datasets
@@ -5,7 +5,7 @@ from bulk_data_service.zipper import zipper
 from config.config import get_config
 from config.initialisation import misc_global_initialisation
 from utilities.azure import create_azure_blob_containers
-from utilities.db import apply_db_migrations
+from utilities.db import apply_db_migrations, create_db_connection_pool
 from utilities.logging import initialise_logging
 
 
@@ -15,10 +15,18 @@ def main(args: argparse.Namespace):
 
     logger = initialise_logging(config)
 
-    context = config | {"logger": logger, "single_run": args.single_run, "run_for_n_datasets": args.run_for_n_datasets}
+    context = config | {
+        "logger": logger,
+        "single_run": args.single_run,
+        "run_for_n_datasets": args.run_for_n_datasets,
+        "reconcile_blobs": args.reconcile_blobs,
+        "replay_registration_snapshot": args.replay_registration_snapshot,
+    }
 
     apply_db_migrations(context)
 
+    context["db_pool"] = create_db_connection_pool(context)
+
     create_azure_blob_containers(context)
 
     misc_global_initialisation(context)
@@ -47,4 +55,15 @@ if __name__ == "__main__":
         type=int,
         help="Run on the first N datasets from registration service (useful for testing)",
     )
+    parser.add_argument(
+        "--reconcile-blobs",
+        action="store_true",
+        help="Before starting the checker, check the Azure blobs of all datasets and redownload any missing ones",
+    )
+    parser.add_argument(
+        "--replay-registration-snapshot",
+        metavar="SNAPSHOT_FILE",
+        help="Use the list of datasets in a snapshot saved earlier, instead of fetching it from the registration "
+        "service (useful for repeatable testing and benchmarking)",
+    )
     main(parser.parse_args())
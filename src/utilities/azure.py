@@ -1,37 +1,111 @@
-from typing import Any
+import concurrent.futures
+import hashlib
+import io
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
 
 import azure
-from azure.storage.blob import BlobServiceClient, ContentSettings
+import requests
+from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.storage.blob import BlobBlock, BlobClient, BlobProperties, BlobServiceClient, ContentSettings
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
+# number of times a staged-block upload is attempted before giving up; each attempt only
+# uploads the blocks which the previous attempts didn't manage to stage
+STAGED_UPLOAD_ATTEMPTS = 5
 
-def azure_blob_exists(az_blob_service: BlobServiceClient, container_name: str, blob_name: str) -> bool:
-    blob_client = az_blob_service.get_blob_client(container_name, blob_name)
-    return blob_client.exists()
+
+def get_azure_blob_service(context: dict, max_connections: Optional[int] = None) -> BlobServiceClient:
+    """Creates a BlobServiceClient which uploads large blobs in blocks of AZURE_UPLOAD_BLOCK_SIZE_MB
+
+    If it is to be used by more threads at once than the default pool of 10 connections allows,
+    max_connections sets the size of the connection pool."""
+
+    if max_connections is None:
+        return BlobServiceClient.from_connection_string(
+            context["AZURE_STORAGE_CONNECTION_STRING"], max_block_size=get_azure_upload_block_size(context)
+        )
+
+    # the Azure SDK does its own retries, so none are done by the adapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=max_connections, max_retries=Retry(total=False, raise_on_status=False))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return BlobServiceClient.from_connection_string(
+        context["AZURE_STORAGE_CONNECTION_STRING"],
+        max_block_size=get_azure_upload_block_size(context),
+        session=session,
+    )
+
+
+def get_azure_upload_block_size(context: dict) -> int:
+    return int(context["AZURE_UPLOAD_BLOCK_SIZE_MB"]) * 1024 * 1024
 
 
 def azure_download_blob(az_blob_service: BlobServiceClient, container_name: str, blob_name: str, filename: str):
+    """Downloads a blob to a file, streaming it to disk rather than reading it all into memory
+
+    It is downloaded to a temporary file, which replaces filename once complete, so that a failed
+    download never leaves a partial file."""
 
     blob_client = az_blob_service.get_blob_client(container_name, blob_name)
 
-    with open(file=filename, mode="wb") as xml_output:
-        download_stream = blob_client.download_blob()
-        xml_output.write(download_stream.readall())
+    try:
+        with open(file=filename + ".tmp", mode="wb") as output:
+            blob_client.download_blob().readinto(output)
+        os.replace(filename + ".tmp", filename)
+    except BaseException:
+        if os.path.exists(filename + ".tmp"):
+            os.remove(filename + ".tmp")
+        raise
+    finally:
+        blob_client.close()
+
+
+def azure_list_blob_properties(az_blob_service: BlobServiceClient, container_name: str) -> dict[str, BlobProperties]:
+    """Lists all blobs in a container, with their properties and metadata, using paged list requests"""
+
+    container_client = az_blob_service.get_container_client(container_name)
+
+    blobs = {blob.name: blob for blob in container_client.list_blobs(include=["metadata"])}
 
-    blob_client.close()
+    container_client.close()
+
+    return blobs
 
 
 def azure_upload_to_blob(
-    az_blob_service: BlobServiceClient, container_name: str, blob_name: str, content: Any, content_type: str
+    az_blob_service: BlobServiceClient,
+    container_name: str,
+    blob_name: str,
+    content: Any,
+    content_type: str,
+    content_md5: Optional[bytes] = None,
+    metadata: Optional[dict[str, str]] = None,
+    max_concurrency: int = 1,
 ) -> dict[str, Any]:
+    """Uploads content to a blob, overwriting any existing blob
+
+    Content larger than the client's max_single_put_size is uploaded in blocks of the client's
+    max_block_size (see get_azure_blob_service), with max_concurrency blocks uploaded at once.
+    If the upload fails, an exception is raised by the Azure SDK, so the returned response (which has
+    the blob's new etag and last_modified) doesn't need to be checked with a further request."""
 
     blob_client = az_blob_service.get_blob_client(container_name, blob_name)
 
-    content_settings = ContentSettings(content_type=content_type)
+    content_settings = ContentSettings(content_type=content_type, content_md5=content_md5)
 
     if content_type == "application/xml":
         content_settings.content_encoding = "UTF-8"
 
-    return blob_client.upload_blob(content, overwrite=True, content_settings=content_settings)
+    return blob_client.upload_blob(
+        content, overwrite=True, content_settings=content_settings, metadata=metadata, max_concurrency=max_concurrency
+    )
 
 
 def create_azure_blob_containers(context: dict):
@@ -120,7 +194,7 @@ def get_azure_blob_public_url(context: dict, dataset: dict, iati_blob_type: str)
 
 
 def upload_zip_to_azure(context: dict, zip_local_pathname: str, zip_azure_filename: str):
-    az_blob_service = BlobServiceClient.from_connection_string(context["AZURE_STORAGE_CONNECTION_STRING"])
+    az_blob_service = get_azure_blob_service(context)
 
     blob_client = az_blob_service.get_blob_client(
         context["AZURE_STORAGE_BLOB_CONTAINER_NAME_IATI_ZIP"], zip_azure_filename
@@ -128,7 +202,237 @@ def upload_zip_to_azure(context: dict, zip_local_pathname: str, zip_azure_filena
 
     content_settings = ContentSettings(content_type="zip")
 
-    with open(zip_local_pathname, "rb") as data:
-        blob_client.upload_blob(data, overwrite=True, content_settings=content_settings)
+    try:
+        azure_upload_file_in_blocks(
+            context,
+            blob_client,
+            zip_local_pathname,
+            content_settings,
+            get_azure_upload_block_size(context),
+            int(context["AZURE_UPLOAD_MAX_CONCURRENCY"]),
+        )
+    finally:
+        blob_client.close()
+
+        az_blob_service.close()
+
+
+@contextmanager
+def azure_zip_upload_stream(context: dict, zip_azure_filename: str) -> Iterator[io.BufferedWriter]:
+    """Opens a stream which uploads the ZIP written to it to Azure, replacing the blob when the stream is closed
+
+    If an exception is raised before the stream is closed, the blob is left as it was."""
+
+    az_blob_service = get_azure_blob_service(context)
+
+    blob_client = az_blob_service.get_blob_client(
+        context["AZURE_STORAGE_BLOB_CONTAINER_NAME_IATI_ZIP"], zip_azure_filename
+    )
+
+    try:
+        with AzureBlockBlobWriter(
+            context, blob_client, get_azure_upload_block_size(context), int(context["AZURE_UPLOAD_MAX_CONCURRENCY"])
+        ) as block_writer:
+            zip_stream = io.BufferedWriter(block_writer)
+            try:
+                yield zip_stream
+                zip_stream.flush()
+                block_writer.commit(ContentSettings(content_type="zip"))
+            finally:
+                zip_stream.detach()
+    finally:
+        blob_client.close()
+
+        az_blob_service.close()
+
+
+class AzureBlockBlobWriter(io.RawIOBase):
+    """A write-only, unseekable stream which uploads the data written to it as a block blob
+
+    The data is staged in blocks of block_size as it is written, up to max_concurrency blocks at once,
+    and each block is retried on failure. The blob is only replaced when commit() is called, after all
+    the data is written, so readers never see a partial upload."""
+
+    def __init__(self, context: dict, blob_client: BlobClient, block_size: int, max_concurrency: int):
+        super().__init__()
+        self.context = context
+        self.blob_client = blob_client
+        self.block_size = block_size
+        self.max_concurrency = max_concurrency
+        self.upload_id = uuid.uuid4().hex[:16]
+        self.buffer = bytearray()
+        self.position = 0
+        self.block_ids: list[str] = []
+        self.staging: list[concurrent.futures.Future] = []
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(cancel_futures=True)
+        super().__exit__(*exc_info)
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+
+        while len(self.buffer) >= self.block_size:
+            self.stage(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+
+        return len(data)
+
+    def stage(self, data: bytes):
+        block_id = "{}-{:08d}".format(self.upload_id, len(self.block_ids))
+        self.block_ids.append(block_id)
+
+        self.staging.append(
+            self.executor.submit(
+                azure_call_with_retries,
+                self.context,
+                "Staging block {} of {}".format(block_id, self.blob_client.blob_name),
+                lambda: self.blob_client.stage_block(block_id, io.BytesIO(data), length=len(data)),
+            )
+        )
+
+        # waits for the oldest blocks, so that no more than max_concurrency blocks are held in memory
+        while len(self.staging) > self.max_concurrency:
+            self.staging.pop(0).result()
+
+    def commit(self, content_settings: ContentSettings):
+        if len(self.buffer) > 0:
+            self.stage(bytes(self.buffer))
+            self.buffer.clear()
+
+        while self.staging:
+            self.staging.pop(0).result()
+
+        azure_call_with_retries(
+            self.context,
+            "Committing {} blocks of {}".format(len(self.block_ids), self.blob_client.blob_name),
+            lambda: self.blob_client.commit_block_list(
+                [BlobBlock(block_id=block_id) for block_id in self.block_ids], content_settings=content_settings
+            ),
+        )
+
+        self.context["logger"].info(
+            "Uploaded {} ({} bytes) in {} blocks.".format(
+                self.blob_client.blob_name, self.position, len(self.block_ids)
+            )
+        )
+
+
+def azure_call_with_retries(context: dict, description: str, operation: Callable[[], Any]) -> Any:
+
+    for attempt in range(1, STAGED_UPLOAD_ATTEMPTS + 1):
+        try:
+            return operation()
+        except AzureError as e:
+            if attempt == STAGED_UPLOAD_ATTEMPTS:
+                raise e
+
+            context["logger"].warning("{} failed, retrying. Details: {}".format(description, e).replace("\n", " "))
+
+            time.sleep(2**attempt)
+
+
+def azure_upload_file_in_blocks(
+    context: dict,
+    blob_client: BlobClient,
+    local_pathname: str,
+    content_settings: ContentSettings,
+    block_size: int,
+    max_concurrency: int,
+):
+    """Uploads a large file as a block blob, staging the blocks in parallel, and resuming after failures
+
+    The block IDs are derived from the file's size and modification time and the block's position, so
+    if an attempt fails part way through, the next attempt asks Azure which blocks are already staged
+    (uncommitted) and only uploads the rest. The blob is only replaced when the full list of blocks is
+    committed, so readers never see a partial upload."""
+
+    file_size = os.path.getsize(local_pathname)
+
+    block_ids = get_block_ids(local_pathname, file_size, block_size)
+
+    for attempt in range(1, STAGED_UPLOAD_ATTEMPTS + 1):
+        try:
+            staged_block_ids = get_uncommitted_block_ids(blob_client)
+
+            blocks_to_stage = [
+                (i, block_id) for i, block_id in enumerate(block_ids) if block_id not in staged_block_ids
+            ]
+
+            context["logger"].info(
+                "Uploading {} in {} blocks, {} already staged. Attempt {} of {}.".format(
+                    local_pathname,
+                    len(block_ids),
+                    len(block_ids) - len(blocks_to_stage),
+                    attempt,
+                    STAGED_UPLOAD_ATTEMPTS,
+                )
+            )
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                for future in concurrent.futures.as_completed(
+                    executor.submit(
+                        stage_file_block, blob_client, local_pathname, i * block_size, block_size, block_id
+                    )
+                    for i, block_id in blocks_to_stage
+                ):
+                    future.result()
+
+            blob_client.commit_block_list(
+                [BlobBlock(block_id=block_id) for block_id in block_ids], content_settings=content_settings
+            )
+            return
+        except AzureError as e:
+            if attempt == STAGED_UPLOAD_ATTEMPTS:
+                raise e
+
+            context["logger"].warning(
+                "Staged upload of {} failed, retrying. Details: {}".format(local_pathname, e).replace("\n", " ")
+            )
+
+            time.sleep(2**attempt)
+
+
+def get_block_ids(local_pathname: str, file_size: int, block_size: int) -> list[str]:
+    """Block IDs must be the same length for all blocks in a blob, and no more than 64 bytes
+
+    The block size is part of the fingerprint, as blocks staged with a different block size hold
+    different ranges of the file, so mustn't be reused."""
+
+    mtime_ns = os.stat(local_pathname).st_mtime_ns
+
+    file_fingerprint = hashlib.sha1(
+        "{}:{}:{}:{}".format(local_pathname, file_size, mtime_ns, block_size).encode("utf-8")
+    ).hexdigest()[:16]
+
+    number_of_blocks = max(1, -(-file_size // block_size))
+
+    return ["{}-{:08d}".format(file_fingerprint, i) for i in range(number_of_blocks)]
+
+
+def get_uncommitted_block_ids(blob_client: BlobClient) -> set[str]:
+    try:
+        _, uncommitted_blocks = blob_client.get_block_list("uncommitted")
+    except ResourceNotFoundError:
+        return set()
+
+    return {block.id for block in uncommitted_blocks}
+
+
+def stage_file_block(blob_client: BlobClient, local_pathname: str, offset: int, block_size: int, block_id: str):
+    with open(local_pathname, "rb") as local_file:
+        local_file.seek(offset)
+        data = local_file.read(block_size)
 
-    az_blob_service.close()
+    blob_client.stage_block(block_id, io.BytesIO(data), length=len(data))
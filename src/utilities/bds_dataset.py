@@ -0,0 +1,140 @@
+import sys
+from collections.abc import MutableMapping
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+from utilities.compressed_text import CompressedText
+
+# the fields of a dataset record, which are the columns of the iati_datasets table
+DATASET_FIELDS = (
+    "id",
+    "name",
+    "publisher_id",
+    "publisher_name",
+    "type",
+    "source_url",
+    "hash",
+    "hash_excluding_generated_timestamp",
+    "last_update_check",
+    "last_head_attempt",
+    "last_head_http_status",
+    "head_error_message",
+    "last_verified_on_server",
+    "last_download_attempt",
+    "last_download_http_status",
+    "last_successful_download",
+    "download_error_message",
+    "content_modified",
+    "content_modified_excluding_generated_timestamp",
+    "server_header_last_modified",
+    "server_header_etag",
+    "registration_service_dataset_metadata",
+    "registration_service_publisher_metadata",
+    "registration_service_name",
+)
+
+# string fields whose values are repeated across many datasets (e.g., all the datasets of a
+# publisher), which are interned so that every dataset refers to a single copy of each value
+INTERNED_FIELDS = frozenset(
+    ["publisher_name", "type", "registration_service_publisher_metadata", "registration_service_name"]
+)
+
+# large string fields which are unique to each dataset and rarely read, which are held compressed,
+# as CompressedText, and only decompressed when str() is called on them
+COMPRESSED_FIELDS = frozenset(["registration_service_dataset_metadata"])
+
+_FIELDS = frozenset(DATASET_FIELDS)
+
+_MISSING = object()
+
+# records are passed everywhere the plain dicts representing datasets are, and are annotated as
+# such, so they are type checked as dicts
+if TYPE_CHECKING:
+    _DatasetMapping = dict[str, Any]
+else:
+    _DatasetMapping = MutableMapping
+
+
+class BDSDataset(_DatasetMapping):
+    """A dataset record, which keeps track of the fields changed since it was last saved to the DB
+
+    It is used exactly like the plain dicts which represent datasets elsewhere, but setting a field to a
+    different value records the field as changed, so that only the changed columns need to be written.
+    A record which isn't in the DB yet (in_db is False) is always written in full.
+
+    The fields are stored in slots rather than a dict, which with the interning of repeated values
+    and the compression of the registration metadata makes a record a fraction of the size of the
+    equivalent dict. Only the fields in DATASET_FIELDS can be set; a field which hasn't been set is
+    missing, as a key would be from a dict."""
+
+    __slots__ = DATASET_FIELDS + ("in_db", "_changed_fields")
+
+    def __init__(self, fields: dict[str, Any], in_db: bool = False):
+        self.in_db = in_db
+        self._changed_fields: Optional[set[str]] = None
+        for field, value in fields.items():
+            self[field] = value
+        self._changed_fields = None
+
+    def __getitem__(self, field: str) -> Any:
+        if field not in _FIELDS:
+            raise KeyError(field)
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field: str, value: Any):
+        if field not in _FIELDS:
+            raise KeyError(field)
+
+        if field in INTERNED_FIELDS and type(value) is str:
+            value = sys.intern(value)
+        elif field in COMPRESSED_FIELDS and type(value) is str:
+            value = CompressedText(value)
+
+        if getattr(self, field, _MISSING) != value:
+            if self._changed_fields is None:
+                self._changed_fields = set()
+            self._changed_fields.add(field)
+
+        setattr(self, field, value)
+
+    def __delitem__(self, field: str):
+        if field not in _FIELDS or not hasattr(self, field):
+            raise KeyError(field)
+        delattr(self, field)
+
+    def __iter__(self) -> Iterator[str]:
+        return (field for field in DATASET_FIELDS if hasattr(self, field))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return "BDSDataset({!r}, in_db={})".format(dict(self), self.in_db)
+
+    @property
+    def changed_fields(self) -> set[str]:
+        return self._changed_fields if self._changed_fields is not None else set()
+
+    def get_changes(self) -> dict[str, Any]:
+        """Returns the changed fields, with the id"""
+
+        return {field: self[field] for field in self.changed_fields} | {"id": self["id"]}
+
+    def mark_saved(self, saved_fields: dict[str, Any]):
+        """Marks the record as saved to the DB with the given fields, once they have been committed
+
+        A field which has been changed again since the values saved were taken is still changed."""
+
+        self.in_db = True
+
+        if self._changed_fields is None:
+            return
+
+        for field, value in saved_fields.items():
+            if getattr(self, field, _MISSING) == value:
+                self._changed_fields.discard(field)
+
+        if len(self._changed_fields) == 0:
+            self._changed_fields = None
@@ -0,0 +1,53 @@
+import zlib
+
+# a preset dictionary of strings common in the Registry's dataset metadata, which primes the
+# compressor so that even a small metadata record compresses well
+_ZDICT = (
+    b'"license_id": "", "license_title": "", "license_url": "", "maintainer": null, "maintainer_email": null, '
+    b'"metadata_created": "", "metadata_modified": "", "notes": "", "num_resources": 1, "num_tags": 0, '
+    b'"organization": {"id": "", "name": "", "title": "", "type": "organization", "description": "", '
+    b'"image_url": "", "created": "", "is_organization": true, "approval_status": "approved", "state": "active"}, '
+    b'"owner_org": "", "private": false, "state": "active", "title": "", "type": "dataset", '
+    b'"resources": [{"cache_last_updated": null, "cache_url": null, "created": "", "description": null, '
+    b'"format": "IATI-XML", "hash": "", "id": "", "last_modified": null, "metadata_modified": "", '
+    b'"mimetype": null, "mimetype_inner": null, "name": null, "package_id": "", "position": 0, '
+    b'"resource_type": null, "size": null, "state": "active", "url": "", "url_type": null}], '
+    b'"extras": [{"key": "activity_count", "value": ""}, {"key": "country", "value": ""}, '
+    b'{"key": "data_updated", "value": ""}, {"key": "filetype", "value": "activity"}, '
+    b'{"key": "iati_version", "value": "2.03"}, {"key": "language", "value": ""}, '
+    b'{"key": "secondary_publisher", "value": ""}, {"key": "validation_status", "value": ""}], '
+    b'"groups": [], "tags": [], "relationships_as_object": [], "relationships_as_subject": [], '
+    b'"author": null, "author_email": null, "creator_user_id": "", "id": "", "isopen": false, "name": "", '
+    b'"url": null, "version": null, "https://iatiregistry.org/'
+)
+
+
+class CompressedText:
+    """A string held compressed in memory, and decompressed only when str() is called on it
+
+    Used for large text values which are kept for every dataset but rarely read, such as the JSON
+    metadata records from the registration service. Two values are equal if their text is equal, and
+    a value is equal to (and hashes the same as) the str of its text."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, text: str):
+        compressor = zlib.compressobj(zdict=_ZDICT)
+        self.data = compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+    def __str__(self) -> str:
+        decompressor = zlib.decompressobj(zdict=_ZDICT)
+        return (decompressor.decompress(self.data) + decompressor.flush()).decode("utf-8")
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, CompressedText):
+            return self.data == other.data
+        if isinstance(other, str):
+            return str(self) == other
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(str(self))
+
+    def __repr__(self) -> str:
+        return "CompressedText({} bytes)".format(len(self.data))
@@ -1,9 +1,28 @@
+import datetime
+import functools
+import threading
+import time
 import uuid
-from typing import Any
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
 
 import psycopg
+from psycopg_pool import ConnectionPool
 from yoyo import get_backend, read_migrations  # type: ignore
 
+from utilities.bds_dataset import BDSDataset
+from utilities.compressed_text import CompressedText
+
+
+class CompressedTextDumper(psycopg.adapt.Dumper):
+    """Passes CompressedText values to Postgres as the text they hold, like str values"""
+
+    def dump(self, obj: CompressedText) -> bytes:
+        return str(obj).encode("utf-8")
+
+
+psycopg.adapters.register_dumper(CompressedText, CompressedTextDumper)
+
 
 def apply_db_migrations(context: dict):
 
@@ -21,37 +40,139 @@ def apply_db_migrations(context: dict):
         backend.apply_migrations(backend.to_apply(migrations))
 
 
+def get_db_connection_params(context: dict) -> dict[str, Any]:
+    return {
+        "dbname": context["DB_NAME"],
+        "user": context["DB_USER"],
+        "password": context["DB_PASS"],
+        "host": context["DB_HOST"],
+        "port": context["DB_PORT"],
+        "sslmode": "prefer" if context["DB_SSL_MODE"] is None else context["DB_SSL_MODE"],
+        "connect_timeout": context["DB_CONNECTION_TIMEOUT"],
+    }
+
+
 def get_db_connection(context: dict) -> psycopg.Connection:
-    connection = psycopg.connect(
-        dbname=context["DB_NAME"],
-        user=context["DB_USER"],
-        password=context["DB_PASS"],
-        host=context["DB_HOST"],
-        port=context["DB_PORT"],
-        sslmode="prefer" if context["DB_SSL_MODE"] is None else context["DB_SSL_MODE"],
-        connect_timeout=context["DB_CONNECTION_TIMEOUT"],
-    )
+    connection = psycopg.connect(**get_db_connection_params(context))
     return connection
 
 
+def create_db_connection_pool(context: dict) -> ConnectionPool:
+    """Creates the process-wide pool of DB connections, which is stored in the context as db_pool
+
+    Up to one connection per downloader thread may be in use at once (when threads write batches of
+    datasets at the same time), and the other steps of a run (removals, metrics, etc.) borrow one
+    briefly, hence the two extra connections. Connections are checked
+    before they are handed out, so ones dropped by the server while idle are replaced."""
+
+    db_pool = ConnectionPool(
+        kwargs=get_db_connection_params(context),
+        min_size=1,
+        max_size=int(context["NUMBER_DOWNLOADER_THREADS"]) + 2,
+        check=ConnectionPool.check_connection,
+        name="bulk-data-service",
+        open=True,
+    )
+
+    db_pool.wait(timeout=float(context["DB_CONNECTION_TIMEOUT"]))
+
+    return db_pool
+
+
+@contextmanager
+def db_connection(context: dict) -> Iterator[psycopg.Connection]:
+    """Borrows a connection from the pool in context["db_pool"], returning it when the block exits"""
+
+    with context["db_pool"].connection() as connection:
+        yield connection
+
+
 def get_datasets_in_bds(context: dict) -> dict[uuid.UUID, dict]:
 
-    connection = get_db_connection(context)
-    cursor = connection.cursor(row_factory=psycopg.rows.dict_row)
-    cursor.execute("""SELECT * FROM iati_datasets""")
-    results_as_list = cursor.fetchall()
-    cursor.close()
+    with db_connection(context) as connection:
+        cursor = connection.cursor(row_factory=psycopg.rows.dict_row)
+        cursor.execute("""SELECT * FROM iati_datasets""")
+        results_as_list = cursor.fetchall()
+        cursor.close()
 
-    results = {result["id"]: result for result in results_as_list}
+    results: dict[uuid.UUID, dict] = {result["id"]: BDSDataset(result, in_db=True) for result in results_as_list}
 
     return results
 
 
 def insert_or_update_dataset(connection: psycopg.Connection, data):
-    columns = ", ".join([k for k in data])
-    placeholders = ", ".join(["%({})s".format(k) for k in data])
+    insert_or_update_datasets(connection, [data])
+
+
+def insert_or_update_datasets(connection: psycopg.Connection, datasets: list[dict]):
+    dataset_changes = [get_dataset_changes(dataset) for dataset in datasets]
+
+    write_dataset_changes(connection, dataset_changes)
+
+    for dataset, (_, fields) in zip(datasets, dataset_changes):
+        mark_dataset_saved(dataset, fields)
+
+
+def get_dataset_changes(dataset: dict) -> tuple[bool, dict]:
+    """Returns whether the dataset must be written in full (inserted or updated), and the fields to write
+
+    A BDSDataset loaded from (or already saved to) the DB only needs its changed fields updated, which
+    avoids rewriting the large registration metadata columns each time a dataset is checked. The
+    dataset isn't marked as saved until the changes are committed (see mark_dataset_saved)."""
+
+    if isinstance(dataset, BDSDataset) and dataset.in_db:
+        return False, dataset.get_changes()
+
+    return True, dict(dataset)
+
+
+def mark_dataset_saved(dataset: dict, fields: dict):
+    if isinstance(dataset, BDSDataset):
+        dataset.mark_saved(fields)
+
+
+def write_dataset_changes(connection: psycopg.Connection, dataset_changes: list[tuple[bool, dict]]):
+    """Writes a batch of dataset changes (see get_dataset_changes) in a single transaction
+
+    Changes are grouped by the statement they need, and each group is sent with executemany, which
+    psycopg pipelines, so the batch costs roughly one round trip and one commit rather than one of each
+    per dataset."""
+
+    fields_by_sql: dict[str, list[dict]] = {}
+
+    for full_row, fields in dataset_changes:
+        if full_row:
+            sql = get_insert_or_update_dataset_sql(tuple(fields.keys()))
+        elif len(fields) > 1:
+            sql = get_update_dataset_fields_sql(tuple(sorted(fields.keys())))
+        else:
+            continue
+
+        fields_by_sql.setdefault(sql, []).append(fields)
+
+    if len(fields_by_sql) == 0:
+        return
+
+    cursor = connection.cursor()
+    for sql, fields_to_write in fields_by_sql.items():
+        cursor.executemany(sql, fields_to_write)  # type: ignore
+    cursor.close()
+    connection.commit()
+
+
+@functools.cache
+def get_update_dataset_fields_sql(fields: tuple[str, ...]) -> str:
+    set_fields = ", ".join(["{} = %({})s".format(field, field) for field in fields if field != "id"])
+
+    return "UPDATE iati_datasets SET {} WHERE id = %(id)s".format(set_fields)
+
 
-    add_sql = """INSERT INTO iati_datasets ({})
+@functools.cache
+def get_insert_or_update_dataset_sql(fields: tuple[str, ...]) -> str:
+    columns = ", ".join(fields)
+    placeholders = ", ".join(["%({})s".format(k) for k in fields])
+
+    return """INSERT INTO iati_datasets ({})
                         VALUES ({})
                  ON CONFLICT (id) DO
                     UPDATE SET
@@ -83,10 +204,161 @@ def insert_or_update_dataset(connection: psycopg.Connection, data):
         """.format(
         columns, placeholders
     )
-    cursor = connection.cursor()
-    cursor.execute(add_sql, data)  # type: ignore
-    cursor.close()
-    connection.commit()
+
+
+class DatasetWriteBuffer:
+    """Collects changes to datasets and writes them to the DB in batches (write-behind)
+
+    The changes to a dataset are taken when it is added (see get_dataset_changes), so later changes to
+    it don't affect what is written, and changes to the same dataset are merged. A dataset is only
+    marked as saved once its changes have been committed. The buffer is written
+    to the DB when it holds max_size datasets, or when a dataset is added more than max_seconds after
+    the last write, and flush() must be called at the end of a run to write whatever remains. It can
+    be shared between threads.
+
+    If a write fails, its changes are put back in the buffer, to be written with the next batch. A
+    failure when a dataset is added is logged rather than raised, as it isn't that dataset's fault,
+    and no write is attempted again for max_seconds. A failure in flush() is raised."""
+
+    def __init__(self, context: dict, max_size: int, max_seconds: float):
+        self.context = context
+        self.max_size = max_size
+        self.max_seconds = max_seconds
+
+        self.pending: dict[uuid.UUID, tuple[dict, bool, dict]] = {}
+        self.last_write = time.monotonic()
+        self.next_write_attempt = self.last_write
+        self.lock = threading.Lock()
+
+    def add(self, dataset: dict):
+        with self.lock:
+            self.add_pending(dataset, *get_dataset_changes(dataset))
+
+            if not self.write_due():
+                return
+
+            changes_to_write = self.take_pending()
+
+        try:
+            self.write(changes_to_write)
+        except psycopg.Error as e:
+            self.context["logger"].error(
+                "Unable to write {} datasets to the database, will retry with the next batch. "
+                "Details: {}".format(len(changes_to_write), e)
+            )
+
+    def flush(self):
+        with self.lock:
+            changes_to_write = self.take_pending()
+
+        self.write(changes_to_write)
+
+    def add_pending(self, dataset: dict, full_row: bool, fields: dict):
+        if fields["id"] in self.pending:
+            _, pending_full_row, pending_fields = self.pending[fields["id"]]
+            full_row, fields = pending_full_row or full_row, pending_fields | fields
+
+        self.pending[fields["id"]] = (dataset, full_row, fields)
+
+    def write_due(self) -> bool:
+        now = time.monotonic()
+
+        return now >= self.next_write_attempt and (
+            len(self.pending) >= self.max_size or now - self.last_write >= self.max_seconds
+        )
+
+    def take_pending(self) -> list[tuple[dict, bool, dict]]:
+        changes_to_write = list(self.pending.values())
+        self.pending = {}
+        self.last_write = time.monotonic()
+        return changes_to_write
+
+    def put_back_pending(self, dataset_changes: list[tuple[dict, bool, dict]]):
+        """Puts back the changes of a failed write, under any changes to the same datasets added since"""
+
+        with self.lock:
+            newer_pending = self.pending
+            self.pending = {}
+
+            for dataset, full_row, fields in dataset_changes + list(newer_pending.values()):
+                self.add_pending(dataset, full_row, fields)
+
+            self.next_write_attempt = time.monotonic() + self.max_seconds
+
+    def write(self, dataset_changes: list[tuple[dict, bool, dict]]):
+        if len(dataset_changes) == 0:
+            return
+
+        try:
+            with db_connection(self.context) as connection:
+                write_dataset_changes(connection, [(full_row, fields) for _, full_row, fields in dataset_changes])
+        except BaseException:
+            self.put_back_pending(dataset_changes)
+            raise
+
+        for dataset, _, fields in dataset_changes:
+            mark_dataset_saved(dataset, fields)
+
+        self.context["logger"].info("Wrote {} datasets to the database".format(len(dataset_changes)))
+
+
+def create_dataset_write_buffer(context: dict) -> DatasetWriteBuffer:
+    return DatasetWriteBuffer(
+        context, int(context["DB_WRITE_BATCH_SIZE"]), float(context["DB_WRITE_BATCH_MAX_SECONDS"])
+    )
+
+
+def get_registry_sync_state(context: dict, registry_url: str) -> Optional[dict]:
+    with db_connection(context) as connection:
+        cursor = connection.cursor(row_factory=psycopg.rows.dict_row)
+        cursor.execute(
+            """SELECT high_water_mark, last_full_sync
+                 FROM registry_sync_state
+                WHERE registry_url = %(registry_url)s""",
+            {"registry_url": registry_url},
+        )
+        sync_state = cursor.fetchone()
+        cursor.close()
+
+    return sync_state
+
+
+def save_registry_sync_state(
+    context: dict, registry_url: str, high_water_mark: Optional[str], last_full_sync: datetime.datetime
+):
+    with db_connection(context) as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            """INSERT INTO registry_sync_state (registry_url, high_water_mark, last_full_sync)
+                    VALUES (%(registry_url)s, %(high_water_mark)s, %(last_full_sync)s)
+               ON CONFLICT (registry_url) DO
+                    UPDATE SET
+                        high_water_mark = %(high_water_mark)s,
+                        last_full_sync = %(last_full_sync)s
+            """,
+            {"registry_url": registry_url, "high_water_mark": high_water_mark, "last_full_sync": last_full_sync},
+        )
+        cursor.close()
+        connection.commit()
+
+
+def get_registration_info_of_datasets_in_bds(context: dict, registration_service_name: str) -> dict[uuid.UUID, dict]:
+    """Returns the registration info of the datasets in the DB, in the form returned by the registration service"""
+
+    with db_connection(context) as connection:
+        cursor = connection.cursor(row_factory=psycopg.rows.dict_row)
+        cursor.execute(
+            """SELECT id, name, publisher_id, publisher_name, source_url, type,
+                      registration_service_dataset_metadata, registration_service_publisher_metadata,
+                      registration_service_name
+                 FROM iati_datasets
+                WHERE registration_service_name = %(registration_service_name)s""",
+            {"registration_service_name": registration_service_name},
+        )
+        results_as_list = cursor.fetchall()
+        cursor.close()
+
+    return {result["id"]: BDSDataset(result) for result in results_as_list}
 
 
 def remove_dataset_from_db(connection: psycopg.Connection, dataset_id):
@@ -98,9 +370,8 @@ def remove_dataset_from_db(connection: psycopg.Connection, dataset_id):
 
 
 def execute_scalar_db_query(context: dict, sql: str) -> Any:
-    connection = get_db_connection(context)
-    value = execute_scalar_db_query_with_conn(connection, sql)
-    connection.close()
+    with db_connection(context) as connection:
+        value = execute_scalar_db_query_with_conn(connection, sql)
     return value
 
 
@@ -1,6 +1,9 @@
+import asyncio
 import datetime
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 
+import aiohttp
+import ijson  # type: ignore
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util import Retry
@@ -26,6 +29,11 @@ def get_requests_session() -> requests.Session:
     return session
 
 
+def get_aiohttp_session(max_connections: int) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(limit=max_connections, ssl=False)
+    return aiohttp.ClientSession(connector=connector, headers={"User-Agent": "IATI Bulk Data Service 0.1"})
+
+
 def http_get_json(session: requests.Session, url: str, timeout: int = 30, exception_on_non_200: bool = True) -> Any:
 
     response = session.get(url=url, timeout=timeout)
@@ -38,16 +46,46 @@ def http_get_json(session: requests.Session, url: str, timeout: int = 30, except
     return response.json()
 
 
-def http_head_dataset(session: requests.Session, url: str, timeout: int = 10, retries: int = 2) -> requests.Response:
+def http_get_json_items(session: requests.Session, url: str, prefix: str, timeout: int = 30) -> Iterator[Any]:
+    """Yields the items at prefix (e.g., "result.results.item") of a JSON response, as each is parsed
+
+    The response is streamed and parsed incrementally, so only one item is in memory at a time,
+    rather than the whole document. Numbers are parsed as int or float, as with response.json()."""
+
+    with session.get(url=url, timeout=timeout, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError(
+                "HTTP status code {} and reason {} when fetching {}".format(response.status_code, response.reason, url)
+            )
+
+        response.raw.decode_content = True
+
+        yield from ijson.items(response.raw, prefix, use_float=True)
+
 
-    response = session.head(url=url, timeout=timeout, allow_redirects=True, verify=False)
+def http_download_dataset(
+    session: requests.Session,
+    url: str,
+    timeout: int = 25,
+    retries: int = 2,
+    conditional_headers: Optional[dict[str, str]] = None,
+) -> requests.Response:
+    """Starts a GET request for a dataset, returning once the headers have been received
+
+    The body is streamed, so the caller must read or close the response. If conditional_headers
+    are given, a 304 Not Modified response is also accepted."""
+
+    response = session.get(
+        url=url, headers=conditional_headers, timeout=timeout, allow_redirects=True, verify=False, stream=True
+    )
 
-    if response.status_code != 200:
+    if not http_download_status_ok(response.status_code, conditional_headers):
+        response.close()
         raise RuntimeError(
             {
-                "message": "HEAD request failed with non-200 status",
+                "message": "HTTP GET request failed with non-200 status",
                 "url": response.url,
-                "http_method": "HEAD",
+                "http_method": "GET",
                 "http_status_code": response.status_code,
                 "http_reason": response.reason,
                 "http_headers": dict(response.headers),
@@ -57,22 +95,78 @@ def http_head_dataset(session: requests.Session, url: str, timeout: int = 10, re
     return response
 
 
-def http_download_dataset(
-    session: requests.Session, url: str, timeout: int = 25, retries: int = 2
-) -> requests.Response:
+def http_download_status_ok(status_code: int, conditional_headers: Optional[dict[str, str]]) -> bool:
+    return status_code == 200 or (bool(conditional_headers) and status_code == 304)
+
+
+def get_conditional_request_headers(etag: Optional[str], last_modified: Optional[datetime.datetime]) -> dict[str, str]:
+    conditional_headers = {}
+
+    if etag:
+        conditional_headers["If-None-Match"] = etag
+
+    if last_modified is not None:
+        conditional_headers["If-Modified-Since"] = format_http_date(last_modified)
+
+    return conditional_headers
+
 
-    response = session.get(url=url, timeout=timeout, allow_redirects=True, verify=False)
+def format_http_date(date: datetime.datetime) -> str:
+    return date.astimezone(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
 
-    if response.status_code != 200:
+
+async def http_download_dataset_async(
+    session: aiohttp.ClientSession,
+    url: str,
+    timeout: int = 25,
+    retries: int = 2,
+    conditional_headers: Optional[dict[str, str]] = None,
+) -> aiohttp.ClientResponse:
+    """Equivalent of http_download_dataset() for aiohttp: the caller must read or release the response"""
+
+    response = await http_request_with_retries_async(session, url, timeout, retries, conditional_headers)
+
+    if not http_download_status_ok(response.status, conditional_headers):
+        response.release()
         raise RuntimeError(
             {
                 "message": "HTTP GET request failed with non-200 status",
-                "url": response.url,
+                "url": str(response.url),
                 "http_method": "GET",
-                "http_status_code": response.status_code,
+                "http_status_code": response.status,
                 "http_reason": response.reason,
                 "http_headers": dict(response.headers),
             }
         )
 
     return response
+
+
+async def http_request_with_retries_async(
+    session: aiohttp.ClientSession,
+    url: str,
+    timeout: int,
+    retries: int,
+    conditional_headers: Optional[dict[str, str]],
+) -> aiohttp.ClientResponse:
+    """Makes a GET request, retrying on connection errors in the same way as the requests session
+
+    As with requests, the timeout applies to connecting and to each read of the response (including
+    reads of the body once this has returned), not to the request as a whole, so a large dataset
+    from a slow server isn't failed just for taking a while to transfer."""
+
+    attempt = 0
+
+    while True:
+        try:
+            return await session.get(
+                url,
+                headers=conditional_headers,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout),
+                allow_redirects=True,
+            )
+        except aiohttp.ClientConnectionError:
+            if attempt >= retries:
+                raise
+            attempt += 1
+            await asyncio.sleep(0.1 * (2**attempt))
@@ -1,25 +1,103 @@
 import datetime
-import glob
 import hashlib
-import io
-import re
+import os
 import zipfile
+from typing import BinaryIO
 
 
-def get_hash(content: str) -> str:
-    hasher = hashlib.sha1()
-    hasher = hashlib.sha1()
-    hasher.update(content.encode("utf-8"))
-    return hasher.hexdigest()
+class DatasetHasher:
+    """Calculates the hash, the hash excluding the generated timestamp and the MD5 in a single pass
 
+    Data is fed in as bytes with update(), in chunks of any size, as a dataset is streamed to
+    disk. Each chunk goes once into the plain hash, and the pieces between any
+    generated-datetime="..." attributes go into the second hash, giving the same result as
+    removing the attributes with the regex generated-datetime="[^"]+" and hashing the rest.
 
-def get_hash_excluding_generated_timestamp(content: str) -> str:
-    hasher = hashlib.sha1()
-    content_to_hash = re.sub(r'generated-datetime="[^"]+"', "", content)
+    An attribute (or the start of one) at the end of a chunk is held back until the next chunk
+    arrives, so attributes which straddle chunk boundaries are still removed. To keep memory
+    bounded, an attribute value is given up on if it runs to more than MAX_ATTRIBUTE_LENGTH bytes
+    without a closing quote; a real timestamp is around 25 bytes.
 
-    hasher = hashlib.sha1()
-    hasher.update(content_to_hash.encode("utf-8"))
-    return hasher.hexdigest()
+    The MD5 is only used as the Content-MD5 of the XML blob when it is uploaded to Azure."""
+
+    ATTRIBUTE_START = b'generated-datetime="'
+    MAX_ATTRIBUTE_LENGTH = 4096
+
+    def __init__(self):
+        self.hasher = hashlib.sha1()
+        self.hasher_excluding_generated_timestamp = hashlib.sha1()
+        self.md5_hasher = hashlib.md5()
+        self.held_back = b""
+
+    def update(self, data: bytes):
+        self.hasher.update(data)
+        self.md5_hasher.update(data)
+
+        if self.held_back:
+            data = self.held_back + data
+
+        view = memoryview(data)
+        position = 0
+
+        while (attribute_start := data.find(self.ATTRIBUTE_START, position)) != -1:
+            self.hasher_excluding_generated_timestamp.update(view[position:attribute_start])
+
+            attribute_end = self.find_attribute_end(data, attribute_start)
+
+            if attribute_end is None:
+                self.held_back = data[attribute_start:]
+                return
+
+            position = attribute_end
+
+        hold_back_from = len(data) - self.length_of_partial_attribute_start(data, position)
+
+        self.hasher_excluding_generated_timestamp.update(view[position:hold_back_from])
+        self.held_back = data[hold_back_from:]
+
+    def find_attribute_end(self, data: bytes, attribute_start: int) -> int | None:
+        """Returns the index just after the attribute starting at attribute_start
+
+        Returns None if the closing quote may be in data yet to arrive. If the attribute can't be
+        removed (its value is empty or too long) the index returned is the one just after its start,
+        so it is hashed as normal content."""
+
+        value_start = attribute_start + len(self.ATTRIBUTE_START)
+        closing_quote = data.find(b'"', value_start)
+
+        if closing_quote == -1:
+            if len(data) - attribute_start <= self.MAX_ATTRIBUTE_LENGTH:
+                return None
+            return self.skip_attribute_start(attribute_start)
+
+        if closing_quote == value_start:
+            return self.skip_attribute_start(attribute_start)
+
+        return closing_quote + 1
+
+    def skip_attribute_start(self, attribute_start: int) -> int:
+        self.hasher_excluding_generated_timestamp.update(self.ATTRIBUTE_START[:1])
+        return attribute_start + 1
+
+    def length_of_partial_attribute_start(self, data: bytes, position: int) -> int:
+        """Returns the length of the longest end of data (from position) which could begin an attribute"""
+
+        for length in range(min(len(self.ATTRIBUTE_START) - 1, len(data) - position), 0, -1):
+            if data.endswith(self.ATTRIBUTE_START[:length]):
+                return length
+        return 0
+
+    def hexdigest(self) -> str:
+        return self.hasher.hexdigest()
+
+    def content_md5(self) -> bytes:
+        return self.md5_hasher.digest()
+
+    def hexdigest_excluding_generated_timestamp(self) -> str:
+        # anything held back at the end is an unterminated attribute, which the regex wouldn't match
+        hasher = self.hasher_excluding_generated_timestamp.copy()
+        hasher.update(self.held_back)
+        return hasher.hexdigest()
 
 
 def get_timestamp(isodate: str = "") -> datetime.datetime:
@@ -50,18 +128,47 @@ def set_timestamp_tz_utc(date: datetime.datetime) -> datetime.datetime:
     return date.replace(tzinfo=datetime.timezone.utc)
 
 
-def zip_data_as_single_file(filename: str, data: str) -> bytes:
+def zip_file_as_single_file(filename: str, source_file: BinaryIO, zip_file: BinaryIO):
+    """Writes a ZIP containing the contents of source_file to zip_file, streaming in chunks
+
+    The file is deflated, so that its compressed data can be copied as it is into the bulk ZIP files."""
+
+    source_file.seek(0, os.SEEK_END)
+    source_size = source_file.tell()
+    source_file.seek(0)
+
+    with zipfile.ZipFile(zip_file, "w", compression=zipfile.ZIP_DEFLATED) as xml_zipped:
+        with xml_zipped.open(filename, "w", force_zip64=source_size >= zipfile.ZIP64_LIMIT) as zip_member:
+            while chunk := source_file.read(1024 * 1024):
+                zip_member.write(chunk)
+
+
+def unzip_single_file(zip_filename: str, destination_filename: str):
+    """Extracts the file in a ZIP made by zip_file_as_single_file to destination_filename, streaming in chunks"""
+
+    with zipfile.ZipFile(zip_filename) as zipped:
+        members = zipped.infolist()
+
+        if len(members) != 1:
+            raise zipfile.BadZipFile("Expected a single file in {}, found {}".format(zip_filename, len(members)))
+
+        with zipped.open(members[0]) as zip_member, open(destination_filename, "wb") as destination_file:
+            while chunk := zip_member.read(1024 * 1024):
+                destination_file.write(chunk)
+
 
-    zip_buffer = io.BytesIO()
+def get_file_md5(source_file: BinaryIO) -> bytes:
+    """Returns the MD5 digest of the whole of source_file, reading it in chunks, and leaves it at the start"""
 
-    with zipfile.ZipFile(zip_buffer, "w") as xml_zipped:
-        xml_zipped.writestr(filename, data)
+    source_file.seek(0)
 
-    return zip_buffer.getvalue()
+    md5_hasher = hashlib.md5()
+    while chunk := source_file.read(1024 * 1024):
+        md5_hasher.update(chunk)
 
+    source_file.seek(0)
 
-def get_number_xml_files_in_dir(dir_name):
-    return len(glob.glob("**/*.xml", root_dir=dir_name, recursive=True))
+    return md5_hasher.digest()
 
 
 def filter_dict_by_structure(source: dict, structure_to_retain: dict) -> dict:
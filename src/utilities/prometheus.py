@@ -1,6 +1,6 @@
 from prometheus_client import Gauge, start_http_server
 
-from utilities.db import execute_scalar_db_query_with_conn, get_db_connection
+from utilities.db import db_connection, execute_scalar_db_query_with_conn
 
 
 def get_metrics_definitions(context: dict) -> list:
@@ -12,7 +12,7 @@ def get_metrics_definitions(context: dict) -> list:
         ("datasets_expired", "The number of datasets that expired in last run"),
         (
             "datasets_head_request_non_200",
-            "The number of HEAD requests that returned non-200 status in the last run",
+            "The number of conditional requests to check for changes that failed in the last run",
         ),
         (
             "datasets_downloads_non_200",
@@ -26,6 +26,10 @@ def get_metrics_definitions(context: dict) -> list:
             "number_crashes",
             "The number of crashes since app restart",
         ),
+        ("db_pool_size", "The number of connections in the DB connection pool"),
+        ("db_pool_available", "The number of idle connections in the DB connection pool"),
+        ("db_pool_requests_waiting", "The number of requests waiting for a connection from the DB connection pool"),
+        ("db_pool_max", "The maximum number of connections in the DB connection pool"),
     ]
 
     return metrics_defs
@@ -55,7 +59,7 @@ def update_metrics_from_db(context: dict) -> dict:
         ),
         (
             "datasets_head_request_non_200",
-            ("SELECT COUNT(id) FROM iati_datasets WHERE " "last_head_http_status != 200"),
+            ("SELECT COUNT(id) FROM iati_datasets WHERE " "last_head_http_status NOT IN (200, 304)"),
         ),
         (
             "datasets_downloads_non_200",
@@ -63,12 +67,22 @@ def update_metrics_from_db(context: dict) -> dict:
         ),
     ]
 
-    db_conn = get_db_connection(context)
+    with db_connection(context) as db_conn:
+        for metric_from_db in metrics_and_their_sql:
+            metric = execute_scalar_db_query_with_conn(db_conn, metric_from_db[1])
+            context["prom_metrics"][metric_from_db[0]].set(metric)
 
-    for metric_from_db in metrics_and_their_sql:
-        metric = execute_scalar_db_query_with_conn(db_conn, metric_from_db[1])
-        context["prom_metrics"][metric_from_db[0]].set(metric)
+    update_db_pool_metrics(context)
 
-    db_conn.close()
+    return context
+
+
+def update_db_pool_metrics(context: dict) -> dict:
+    pool_stats = context["db_pool"].get_stats()
+
+    context["prom_metrics"]["db_pool_size"].set(pool_stats.get("pool_size", 0))
+    context["prom_metrics"]["db_pool_available"].set(pool_stats.get("pool_available", 0))
+    context["prom_metrics"]["db_pool_requests_waiting"].set(pool_stats.get("requests_waiting", 0))
+    context["prom_metrics"]["db_pool_max"].set(pool_stats.get("pool_max", 0))
 
     return context
@@ -0,0 +1,203 @@
+import os
+import struct
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future
+from logging import Logger
+from typing import IO, Callable, Optional
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_LOCAL_FILE_HEADER_SIGNATURE = b"PK\x03\x04"
+_LOCAL_FILE_HEADER_SIZE = 30
+_DATA_DESCRIPTOR_FLAG = 0x08
+
+
+class ZipWriter:
+    """Writes a ZIP archive member by member, compressing files or copying already-compressed members
+
+    A member can be added from a file, which is deflated, or copied from another ZIP archive, in which
+    case its compressed bytes are copied verbatim, along with its CRC and sizes, without being
+    decompressed and compressed again.
+
+    If an executor (e.g., a ProcessPoolExecutor) is given, files are deflated by it, in parallel, while
+    the members are still written to the archive in the order they were added. Up to max_pending
+    members are queued waiting to be written, which bounds the compressed data held in memory.
+
+    The archive can be written to an unseekable stream (e.g., one uploading it as it is written), in
+    which case zipfile writes the sizes of the files it compresses itself after their data.
+
+    It is built on zipfile.ZipFile, which writes the central directory when the archive is closed.
+    Copied and parallel-deflated members are written directly to the archive's file, and then added
+    to the ZipFile's list of members, and the position of the central directory (start_dir) is moved
+    past them."""
+
+    def __init__(
+        self,
+        fileobj: IO[bytes],
+        logger: Logger,
+        executor: Optional[Executor] = None,
+        max_pending: int = 64,
+    ):
+        self.zip_file = zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED)
+        self.logger = logger
+        self.executor = executor
+        self.max_pending = max_pending if executor is not None else 0
+        self.pending: deque[Callable[[], None]] = deque()
+
+    def __enter__(self) -> "ZipWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.zip_file.close()
+
+    def add_directory(self, arcname: str):
+        self.add_pending(lambda: self.zip_file.mkdir(arcname))
+
+    def add_file(self, arcname: str, source_pathname: str):
+        if self.executor is None:
+            self.add_pending(lambda: self.zip_file.write(source_pathname, arcname))
+            return
+
+        deflated = self.executor.submit(deflate_file, source_pathname)
+        self.add_pending(lambda: self.write_deflated_file(arcname, source_pathname, deflated))
+
+    def add_compressed_member(
+        self, arcname: str, source_zip_pathname: str, source_info: zipfile.ZipInfo, fallback_pathname: str
+    ):
+        """Adds a member copied from another ZIP archive, without recompressing it
+
+        If the member can't be copied, the file fallback_pathname (its uncompressed content) is added instead."""
+
+        self.add_pending(
+            lambda: self.write_compressed_member(arcname, source_zip_pathname, source_info, fallback_pathname)
+        )
+
+    def add_pending(self, write_member: Callable[[], None]):
+        self.pending.append(write_member)
+
+        while len(self.pending) > self.max_pending:
+            self.pending.popleft()()
+
+    def write_deflated_file(self, arcname: str, source_pathname: str, deflated: Future):
+        crc, file_size, data = deflated.result()
+
+        zinfo = zipfile.ZipInfo.from_file(source_pathname, arcname)
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.CRC = crc
+        zinfo.file_size = file_size
+        zinfo.compress_size = len(data)
+
+        self.write_member(zinfo, lambda output: output.write(data))
+
+    def write_compressed_member(
+        self, arcname: str, source_zip_pathname: str, source_info: zipfile.ZipInfo, fallback_pathname: str
+    ):
+        zinfo = zipfile.ZipInfo(arcname, date_time=source_info.date_time)
+        zinfo.compress_type = source_info.compress_type
+        zinfo.flag_bits = source_info.flag_bits & ~_DATA_DESCRIPTOR_FLAG
+        zinfo.create_system = source_info.create_system
+        zinfo.external_attr = source_info.external_attr
+        zinfo.CRC = source_info.CRC
+        zinfo.file_size = source_info.file_size
+        zinfo.compress_size = source_info.compress_size
+
+        try:
+            with open(source_zip_pathname, "rb") as source_fileobj:
+                data_offset = get_member_data_offset(source_fileobj, source_info)
+
+                # checked before anything is written, as a member can't be removed from an unseekable stream
+                if os.fstat(source_fileobj.fileno()).st_size < data_offset + source_info.compress_size:
+                    raise zipfile.BadZipFile("ZIP file is truncated")
+
+                source_fileobj.seek(data_offset)
+                self.write_member(zinfo, lambda output: copy_bytes(source_fileobj, output, source_info.compress_size))
+        except (OSError, zipfile.BadZipFile) as e:
+            self.logger.warning(
+                "Unable to copy {} from {}, so compressing it. Details: {}".format(arcname, source_zip_pathname, e)
+            )
+            self.zip_file.write(fallback_pathname, arcname)
+
+    def write_member(self, zinfo: zipfile.ZipInfo, write_data: Callable[[IO[bytes]], object]):
+        """Writes a member whose compressed data is written by write_data, after its local header"""
+
+        output = self.zip_file.fp
+
+        if output is None:
+            raise ValueError("Attempt to write to ZIP archive that was already closed")
+
+        if output.seekable():
+            output.seek(self.zip_file.start_dir)
+        zinfo.header_offset = self.zip_file.start_dir
+
+        try:
+            output.write(zinfo.FileHeader())
+            write_data(output)
+        except BaseException as e:
+            if not output.seekable():
+                raise RuntimeError("Failed part way through writing {} to ZIP stream".format(zinfo.filename)) from e
+
+            # removes the partly written member, so the archive can still be completed
+            output.seek(zinfo.header_offset)
+            output.truncate()
+            raise
+
+        self.zip_file.filelist.append(zinfo)
+        self.zip_file.NameToInfo[zinfo.filename] = zinfo
+        self.zip_file.start_dir = output.tell()
+
+    def close(self):
+        while self.pending:
+            self.pending.popleft()()
+
+        self.zip_file.close()
+
+
+def deflate_file(pathname: str) -> tuple[int, int, bytes]:
+    """Deflates a file as zipfile does a ZIP_DEFLATED member, returning its CRC, size and compressed data
+
+    Run in the worker processes of a ZipWriter's executor."""
+
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    crc = 0
+    file_size = 0
+    compressed_chunks = []
+
+    with open(pathname, "rb") as source_file:
+        while chunk := source_file.read(COPY_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            compressed_chunks.append(compressor.compress(chunk))
+
+    compressed_chunks.append(compressor.flush())
+
+    return crc, file_size, b"".join(compressed_chunks)
+
+
+def get_member_data_offset(zip_fileobj: IO[bytes], zinfo: zipfile.ZipInfo) -> int:
+    """Returns the offset of a member's compressed data, which follows its local header"""
+
+    zip_fileobj.seek(zinfo.header_offset)
+    local_header = zip_fileobj.read(_LOCAL_FILE_HEADER_SIZE)
+
+    if len(local_header) != _LOCAL_FILE_HEADER_SIZE or local_header[:4] != _LOCAL_FILE_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile("Bad local file header for member {}".format(zinfo.filename))
+
+    filename_length, extra_length = struct.unpack("<HH", local_header[26:30])
+
+    return zinfo.header_offset + _LOCAL_FILE_HEADER_SIZE + filename_length + extra_length
+
+
+def copy_bytes(source: IO[bytes], destination: IO[bytes], length: int):
+    remaining = length
+
+    while remaining > 0:
+        chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile("Unexpected end of ZIP file when copying member data")
+        destination.write(chunk)
+        remaining -= len(chunk)
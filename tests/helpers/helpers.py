@@ -7,7 +7,7 @@ import pytest
 from dotenv import dotenv_values
 
 from utilities.azure import create_azure_blob_containers, delete_azure_blob_containers
-from utilities.db import apply_db_migrations, get_db_connection
+from utilities.db import apply_db_migrations, create_db_connection_pool, get_db_connection
 from utilities.prometheus import get_metrics_definitions
 
 
@@ -21,6 +21,7 @@ def truncate_db_table(context: dict):
     connection = get_db_connection(context)
     cursor = connection.cursor()
     cursor.execute("""TRUNCATE table iati_datasets""")
+    cursor.execute("""TRUNCATE table registry_sync_state""")
     cursor.close()
     connection.commit()
 
@@ -32,6 +33,8 @@ def get_and_clear_up_context():
             "logger" : logger,
             "single_run": True,
             "run_for_n_datasets": None,
+            "reconcile_blobs": False,
+            "replay_registration_snapshot": None,
             "prom_metrics": {}
         }
 
@@ -40,12 +43,19 @@ def get_and_clear_up_context():
 
     create_azure_blob_containers(context)
     apply_db_migrations(context)
+    context["db_pool"] = create_db_connection_pool(context)
     yield context
+    context["db_pool"].close()
     truncate_db_table(context)
     delete_azure_blob_containers(context)
     # this is a sanity check to ensure we don't remove important files on a misconfiguration
     if context["ZIP_WORKING_DIR"].startswith("/tmp"):
-        zip_dirs = [context["ZIP_WORKING_DIR"], f"{context['ZIP_WORKING_DIR']}-1", f"{context['ZIP_WORKING_DIR']}-2"]
+        zip_dirs = [
+            context["ZIP_WORKING_DIR"],
+            f"{context['ZIP_WORKING_DIR']}-1",
+            f"{context['ZIP_WORKING_DIR']}-2",
+            f"{context['ZIP_WORKING_DIR']}-dataset-zips",
+        ]
         for zip_dir in zip_dirs:
             if os.path.exists(zip_dir):
                 shutil.rmtree(zip_dir)
@@ -0,0 +1,65 @@
+import uuid
+
+from azure.storage.blob import BlobServiceClient
+
+from bulk_data_service.checker import checker_run
+from bulk_data_service.dataset_reconciliation import reconcile_blobs_with_datasets
+from helpers.helpers import get_and_clear_up_context  # noqa: F401
+from utilities.azure import get_azure_blob_name, get_azure_container_name
+from utilities.db import get_datasets_in_bds
+
+
+def test_uploaded_blobs_have_hash_and_md5(get_and_clear_up_context):  # noqa: F811
+
+    context = get_and_clear_up_context
+
+    context["DATA_REGISTRY_BASE_URL"] = "http://localhost:3000/registration/datasets-01"
+    datasets_in_bds = {}
+    checker_run(context, datasets_in_bds)
+
+    dataset = datasets_in_bds[uuid.UUID("c8a40aa5-9f31-4bcf-a36f-51c1fc2cc159")]
+
+    blob_service_client = BlobServiceClient.from_connection_string(context["AZURE_STORAGE_CONNECTION_STRING"])
+
+    for iati_blob_type in ["xml", "zip"]:
+        blob_client = blob_service_client.get_blob_client(
+            get_azure_container_name(context, iati_blob_type), get_azure_blob_name(dataset, iati_blob_type)
+        )
+        properties = blob_client.get_blob_properties()
+
+        assert properties.metadata["hash"] == dataset["hash"]
+        assert properties.content_settings.content_md5 is not None
+
+    blob_service_client.close()
+
+
+def test_reconciliation_redownloads_dataset_with_missing_blob(get_and_clear_up_context):  # noqa: F811
+
+    context = get_and_clear_up_context
+
+    context["DATA_REGISTRY_BASE_URL"] = "http://localhost:3000/registration/datasets-01"
+    datasets_in_bds = {}
+    checker_run(context, datasets_in_bds)
+
+    dataset_id = uuid.UUID("c8a40aa5-9f31-4bcf-a36f-51c1fc2cc159")
+    dataset = datasets_in_bds[dataset_id]
+    original_hash = dataset["hash"]
+
+    blob_service_client = BlobServiceClient.from_connection_string(context["AZURE_STORAGE_CONNECTION_STRING"])
+    zip_blob = blob_service_client.get_blob_client(
+        get_azure_container_name(context, "zip"), get_azure_blob_name(dataset, "zip")
+    )
+    zip_blob.delete_blob()
+
+    datasets_in_bds = get_datasets_in_bds(context)
+    reconcile_blobs_with_datasets(context, datasets_in_bds)
+
+    assert datasets_in_bds[dataset_id]["hash"] is None
+    assert get_datasets_in_bds(context)[dataset_id]["hash"] is None
+
+    checker_run(context, datasets_in_bds)
+
+    assert datasets_in_bds[dataset_id]["hash"] == original_hash
+    assert zip_blob.exists()
+
+    blob_service_client.close()
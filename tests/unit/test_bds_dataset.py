@@ -0,0 +1,106 @@
+import json
+import uuid
+from collections.abc import Mapping
+
+import pytest
+
+from utilities.bds_dataset import BDSDataset
+from utilities.compressed_text import CompressedText
+
+
+def test_bds_dataset_tracks_changed_fields():
+    dataset_id = uuid.uuid4()
+    dataset = BDSDataset(
+        {"id": dataset_id, "hash": "a", "server_header_etag": None, "registration_service_dataset_metadata": "{}"},
+        in_db=True,
+    )
+
+    dataset["hash"] = "b"
+    dataset["registration_service_dataset_metadata"] = "{}"
+    dataset.update({"server_header_etag": "xyz"})
+
+    assert dataset.changed_fields == {"hash", "server_header_etag"}
+    assert dataset.get_changes() == {"id": dataset_id, "hash": "b", "server_header_etag": "xyz"}
+
+    dataset.mark_saved(dataset.get_changes())
+
+    assert dataset.changed_fields == set()
+
+
+def test_bds_dataset_field_changed_after_changes_taken_still_changed_when_saved():
+    dataset = BDSDataset({"id": uuid.uuid4(), "hash": "a", "server_header_etag": None}, in_db=True)
+
+    dataset["hash"] = "b"
+    dataset["server_header_etag"] = "xyz"
+    changes = dataset.get_changes()
+    dataset["hash"] = "c"
+
+    dataset.mark_saved(changes)
+
+    assert dataset.changed_fields == {"hash"}
+
+
+def test_bds_dataset_new_record_marked_in_db_only_when_saved():
+    dataset = BDSDataset({"id": uuid.uuid4(), "hash": None})
+
+    dataset.get_changes()
+
+    assert not dataset.in_db
+
+    dataset.mark_saved(dict(dataset))
+
+    assert dataset.in_db
+
+
+def test_bds_dataset_behaves_as_dict():
+    dataset = BDSDataset({"id": 1, "hash": "a"})
+
+    assert dataset == {"id": 1, "hash": "a"}
+    assert isinstance(dataset, Mapping)
+    assert "hash" in dataset and "etag" not in dataset and "server_header_etag" not in dataset
+    assert dict(dataset) == {"id": 1, "hash": "a"}
+    assert dataset.get("server_header_etag") is None
+
+
+def test_bds_dataset_only_has_dataset_fields():
+    dataset = BDSDataset({"id": 1})
+
+    with pytest.raises(KeyError):
+        dataset["etag"] = "xyz"
+
+    with pytest.raises(KeyError):
+        dataset["hash"]
+
+    assert not hasattr(dataset, "__dict__")
+
+
+def test_bds_dataset_interns_repeated_values():
+    publisher_names = ["".join(["test_", "foundation_a"]) for _ in range(2)]
+
+    datasets = [BDSDataset({"id": i, "publisher_name": publisher_names[i]}) for i in range(2)]
+
+    assert publisher_names[0] is not publisher_names[1]
+    assert datasets[0]["publisher_name"] is datasets[1]["publisher_name"]
+
+
+def test_bds_dataset_holds_registration_metadata_compressed():
+    metadata = json.dumps({"id": "c8a40aa5-9f31-4bcf-a36f-51c1fc2cc159", "notes": "Example notes. " * 100})
+
+    dataset = BDSDataset({"id": 1, "registration_service_dataset_metadata": metadata}, in_db=True)
+
+    assert isinstance(dataset["registration_service_dataset_metadata"], CompressedText)
+    assert len(dataset["registration_service_dataset_metadata"].data) < len(metadata) / 4
+    assert str(dataset["registration_service_dataset_metadata"]) == metadata
+    assert dataset["registration_service_dataset_metadata"] == metadata
+
+    dataset["registration_service_dataset_metadata"] = metadata
+
+    assert dataset.changed_fields == set()
+
+
+def test_compressed_text_hashes_as_equal_str():
+    text = json.dumps({"notes": "Example notes. " * 10})
+
+    assert hash(CompressedText(text)) == hash(text)
+    assert CompressedText(text) in {text}
+    assert text in {CompressedText(text)}
@@ -19,3 +19,37 @@ def test_config_blob_storage_base_url_has_no_trailing_slash_2():
     config = get_config()
 
     assert config["WEB_BASE_URL"] == 'http://127.0.0.1:10000/devstoreaccount1'
+
+
+def test_config_optional_variable_has_default_when_not_set(monkeypatch):
+
+    load_dotenv("tests/artifacts/config-files/env-file-1", override=True)
+    monkeypatch.delenv("DOWNLOADER_ENGINE", raising=False)
+
+    config = get_config()
+
+    assert config["DOWNLOADER_ENGINE"] == "threads"
+
+
+def test_config_optional_variable_left_empty_when_set_empty(monkeypatch):
+
+    load_dotenv("tests/artifacts/config-files/env-file-1", override=True)
+    monkeypatch.setenv("DATA_REGISTRY_SNAPSHOT_FILE", "")
+    monkeypatch.setenv("DATA_REGISTRY_PUBLISHER_METADATA_CACHE_FILE", "")
+
+    config = get_config()
+
+    assert config["DATA_REGISTRY_SNAPSHOT_FILE"] == ""
+    assert config["DATA_REGISTRY_PUBLISHER_METADATA_CACHE_FILE"] == ""
+
+
+def test_config_optional_file_variables_have_defaults_when_not_set(monkeypatch):
+
+    load_dotenv("tests/artifacts/config-files/env-file-1", override=True)
+    monkeypatch.delenv("DATA_REGISTRY_SNAPSHOT_FILE", raising=False)
+    monkeypatch.delenv("DATA_REGISTRY_PUBLISHER_METADATA_CACHE_FILE", raising=False)
+
+    config = get_config()
+
+    assert config["DATA_REGISTRY_SNAPSHOT_FILE"] == "/tmp/bulk-data-service-registry-snapshot.json.gz"
+    assert config["DATA_REGISTRY_PUBLISHER_METADATA_CACHE_FILE"] == "/tmp/bulk-data-service-publisher-metadata.json.gz"
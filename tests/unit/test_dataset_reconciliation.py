@@ -0,0 +1,38 @@
+from azure.storage.blob import BlobProperties
+
+from bulk_data_service.dataset_reconciliation import dataset_blobs_match
+
+
+def make_blob(name: str, metadata: dict | None) -> BlobProperties:
+    blob = BlobProperties(name=name)
+    blob.metadata = metadata
+    return blob
+
+
+def make_blobs(xml_metadata: dict | None, zip_metadata: dict | None) -> dict[str, dict[str, BlobProperties]]:
+    return {
+        "xml": {"pub/dataset.xml": make_blob("pub/dataset.xml", xml_metadata)},
+        "zip": {"pub/dataset.zip": make_blob("pub/dataset.zip", zip_metadata)},
+    }
+
+
+dataset = {"publisher_name": "pub", "name": "dataset", "hash": "abc"}
+
+
+def test_dataset_blobs_match():
+    assert dataset_blobs_match(dataset, make_blobs({"hash": "abc"}, {"hash": "abc"}))
+
+
+def test_dataset_blobs_match_without_hash_metadata():
+    assert dataset_blobs_match(dataset, make_blobs({}, None))
+
+
+def test_dataset_blobs_hash_mismatch():
+    assert not dataset_blobs_match(dataset, make_blobs({"hash": "abc"}, {"hash": "old"}))
+
+
+def test_dataset_blobs_missing():
+    blobs = make_blobs({"hash": "abc"}, {"hash": "abc"})
+    del blobs["zip"]["pub/dataset.zip"]
+
+    assert not dataset_blobs_match(dataset, blobs)
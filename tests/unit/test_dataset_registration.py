@@ -1,11 +1,20 @@
+import copy
+import io
 import json
 import uuid
+from urllib.parse import unquote
 from functools import partial
 from unittest import mock
 
+import ijson
 import pytest
 
-from dataset_registration.iati_registry_ckan import clean_datasets_metadata, convert_datasets_metadata
+from dataset_registration.iati_registry_ckan import (
+    RegistryDatasetConverter,
+    fetch_datasets_metadata,
+    fetch_datasets_metadata_from_iati_registry,
+    save_sync_state,
+)
 
 
 def get_level1_field_blanker(key):
@@ -37,9 +46,9 @@ def test_incomplete_necessary_data_from_ckan(field_blanker, attribute_value):
     field_blanker(ckan_datasets[0], attribute_value)
     logger = mock.Mock()
 
-    ckan_datasets = clean_datasets_metadata(logger, ckan_datasets)
+    converter = RegistryDatasetConverter(logger)
 
-    assert(len(ckan_datasets) == 0)
+    assert(converter.convert(ckan_datasets[0]) is None)
 
 
 @pytest.mark.parametrize("resources_value", [None, [], {"url": None}])
@@ -51,8 +60,168 @@ def test_missing_url_from_ckan(resources_value):
     ckan_datasets[0]["resources"] = resources_value
     logger = mock.Mock()
 
-    ckan_datasets = clean_datasets_metadata(logger, ckan_datasets)
-    bds_datasets = convert_datasets_metadata(ckan_datasets)
+    converter = RegistryDatasetConverter(logger)
+    bds_dataset = converter.convert(ckan_datasets[0])
 
-    assert(len(bds_datasets) == 1)
-    assert(bds_datasets[uuid.UUID("c8a40aa5-9f31-4bcf-a36f-51c1fc2cc159")]["source_url"] == "")
+    assert(bds_dataset is not None)
+    assert(bds_dataset["id"] == uuid.UUID("c8a40aa5-9f31-4bcf-a36f-51c1fc2cc159"))
+    assert(bds_dataset["source_url"] == "")
+
+
+def fake_http_get_json_items(fake_http_get_json, session, url, prefix):
+    return ijson.items(io.BytesIO(json.dumps(fake_http_get_json(session, url)).encode("utf-8")), prefix)
+
+
+def test_fetch_datasets_metadata_pages_concurrently_with_retries_and_deduplication(monkeypatch):
+
+    monkeypatch.setattr("dataset_registration.iati_registry_ckan.time.sleep", lambda seconds: None)
+    monkeypatch.setattr("dataset_registration.iati_registry_ckan.REGISTRY_PAGE_SIZE", 10)
+
+    failed_once = set()
+
+    def fake_http_get_json(session, url):
+        query = dict(param.split("=") for param in url.split("?")[1].split("&"))
+        if query["rows"] == "1":
+            return {"result": {"count": 25}}
+        start = int(query["start"])
+        if start == 10 and start not in failed_once:
+            failed_once.add(start)
+            raise RuntimeError("HTTP status code 502")
+        # each page overlaps the previous one by a dataset, as if the Registry had changed during the fetch
+        return {"result": {"results": [{"id": str(i)} for i in range(max(0, start - 1), min(25, start + 10))]}}
+
+    monkeypatch.setattr("dataset_registration.iati_registry_ckan.http_get_json", fake_http_get_json)
+    monkeypatch.setattr(
+        "dataset_registration.iati_registry_ckan.http_get_json_items",
+        partial(fake_http_get_json_items, fake_http_get_json),
+    )
+
+    context = {
+        "DATA_REGISTRY_BASE_URL": "http://registry/package_search",
+        "DATA_REGISTRY_FETCH_THREADS": "3",
+        "run_for_n_datasets": None,
+        "logger": mock.Mock(),
+    }
+
+    datasets_metadata = fetch_datasets_metadata_from_iati_registry(context, mock.Mock())
+
+    assert [dataset["id"] for dataset in datasets_metadata] == [str(i) for i in range(25)]
+    assert failed_once == {10}
+
+
+def test_fetch_datasets_metadata_sorted_and_fetched_again_if_count_changes(monkeypatch):
+
+    monkeypatch.setattr("dataset_registration.iati_registry_ckan.REGISTRY_PAGE_SIZE", 10)
+
+    registry = [str(i) for i in range(0, 50, 2)]
+    page_queries = []
+
+    def fake_http_get_json(session, url):
+        query = dict(param.split("=") for param in url.split("?")[1].split("&") if param != "")
+        if query["rows"] == "1":
+            return {"result": {"count": len(registry)}}
+        page_queries.append(query)
+        start = int(query["start"])
+        page = {"result": {"results": [{"id": id} for id in sorted(registry)[start : start + 10]]}}
+        # a dataset is registered after the first page has been fetched, shifting the later pages
+        if len(page_queries) == 1:
+            registry.append("1")
+        return page
+
+    monkeypatch.setattr("dataset_registration.iati_registry_ckan.http_get_json", fake_http_get_json)
+    monkeypatch.setattr(
+        "dataset_registration.iati_registry_ckan.http_get_json_items",
+        partial(fake_http_get_json_items, fake_http_get_json),
+    )
+
+    context = {
+        "DATA_REGISTRY_BASE_URL": "http://registry/package_search",
+        "DATA_REGISTRY_FETCH_THREADS": "1",
+        "run_for_n_datasets": None,
+        "logger": mock.Mock(),
+    }
+
+    datasets_metadata = fetch_datasets_metadata_from_iati_registry(context, mock.Mock())
+
+    assert sorted(dataset["id"] for dataset in datasets_metadata) == sorted(registry)
+    assert all(unquote(query["sort"]) == "id asc" for query in page_queries)
+    context["logger"].warning.assert_called_once()
+
+
+def test_fetch_datasets_metadata_incremental_sync(monkeypatch):
+
+    with open("tests/artifacts/ckan-registry-datasets-02-2-datasets.json", "r") as f:
+        ckan_datasets = json.load(f)["result"]["results"]
+
+    registry = {dataset["id"]: dataset for dataset in ckan_datasets}
+    requested_filters = []
+
+    def fake_http_get_json(session, url):
+        query = dict(param.split("=") for param in url.split("?")[1].split("&"))
+        datasets = list(registry.values())
+        if "fq" in query:
+            requested_filters.append(unquote(query["fq"]))
+            modified_since = unquote(query["fq"]).split("[")[1].split("Z")[0]
+            datasets = [dataset for dataset in datasets if dataset["metadata_modified"] >= modified_since]
+        if "fl" in query:
+            datasets = [{"id": dataset["id"]} for dataset in datasets]
+        if "start" not in query:
+            return {"result": {"count": len(datasets)}}
+        return {"result": {"results": datasets[int(query["start"]) :]}}
+
+    saved_sync_states = []
+
+    monkeypatch.setattr("dataset_registration.iati_registry_ckan.http_get_json", fake_http_get_json)
+    monkeypatch.setattr(
+        "dataset_registration.iati_registry_ckan.http_get_json_items",
+        partial(fake_http_get_json_items, fake_http_get_json),
+    )
+    monkeypatch.setattr(
+        "dataset_registration.iati_registry_ckan.get_publisher_metadata_as_str", lambda context, session, name: "{}"
+    )
+    monkeypatch.setattr("dataset_registration.iati_registry_ckan.get_registry_sync_state", lambda context, url: None)
+    monkeypatch.setattr(
+        "dataset_registration.iati_registry_ckan.save_registry_sync_state",
+        lambda context, *sync_state: saved_sync_states.append(sync_state),
+    )
+    monkeypatch.setattr("dataset_registration.iati_registry_ckan.REGISTERED_DATASETS", {})
+    monkeypatch.setattr(
+        "dataset_registration.iati_registry_ckan.REGISTRY_SYNC_STATE",
+        {"registry_url": None, "high_water_mark": None, "last_full_sync": None, "unsaved": False},
+    )
+
+    context = {
+        "DATA_REGISTRY_BASE_URL": "http://registry/package_search",
+        "DATA_REGISTRY_FETCH_THREADS": "2",
+        "DATA_REGISTRY_FULL_RESYNC_AFTER_HOURS": "24",
+        "run_for_n_datasets": None,
+        "logger": mock.Mock(),
+    }
+
+    first_sync = fetch_datasets_metadata(context, mock.Mock())
+
+    # the sync state is only saved once the checker has committed the datasets
+    assert saved_sync_states == []
+    save_sync_state(context)
+
+    assert set(first_sync) == {uuid.UUID(id) for id in registry}
+    assert requested_filters == []
+    assert saved_sync_states[-1][1] == "2024-05-07T15:38:58.740018"
+
+    # one dataset is modified, and the other is deleted
+    modified_dataset = copy.deepcopy(ckan_datasets[0])
+    modified_dataset["metadata_modified"] = "2024-05-08T10:00:00.000000"
+    modified_dataset["resources"][0]["url"] = "http://example.com/new-url.xml"
+    registry = {modified_dataset["id"]: modified_dataset}
+
+    second_sync = fetch_datasets_metadata(context, mock.Mock())
+    save_sync_state(context)
+    save_sync_state(context)
+
+    assert len(saved_sync_states) == 2
+
+    assert set(requested_filters) == {"metadata_modified:[2024-05-07T15:28:58.740018Z TO *]"}
+    assert set(second_sync) == {uuid.UUID(modified_dataset["id"])}
+    assert second_sync[uuid.UUID(modified_dataset["id"])]["source_url"] == "http://example.com/new-url.xml"
+    assert saved_sync_states[-1][1] == "2024-05-08T10:00:00.000000"
+    assert saved_sync_states[-1][2] == saved_sync_states[0][2]
@@ -0,0 +1,75 @@
+import asyncio
+import math
+import uuid
+
+import pytest
+
+from bulk_data_service.download_scheduler import HostScheduler, get_source_host
+
+
+def make_datasets(source_urls: list[str]) -> dict[uuid.UUID, dict]:
+    return {uuid.uuid4(): {"source_url": url} for url in source_urls}
+
+
+@pytest.mark.parametrize("url,expected", [
+    ("http://example.org/data/file.xml", "example.org"),
+    ("https://EXAMPLE.org:8443/file.xml", "example.org"),
+    ("", ""),
+    ("not a url", ""),
+])
+def test_get_source_host(url, expected):
+    assert get_source_host(url) == expected
+
+
+def test_scheduler_interleaves_hosts():
+    datasets = make_datasets(["http://a.org/1", "http://a.org/2", "http://a.org/3", "http://b.org/1"])
+    scheduler = HostScheduler(datasets, max_per_host=10, min_interval=0)
+
+    hosts = [get_source_host(datasets[scheduler.next_dataset()]["source_url"]) for _ in range(3)]
+
+    assert hosts == ["a.org", "b.org", "a.org"]
+
+
+def test_scheduler_respects_max_per_host():
+    datasets = make_datasets(["http://a.org/1", "http://a.org/2", "http://b.org/1"])
+    scheduler = HostScheduler(datasets, max_per_host=1, min_interval=0)
+
+    first = scheduler.next_dataset()
+    second = scheduler.next_dataset()
+
+    with scheduler.condition:
+        assert scheduler.take_next_ready_dataset() == (None, math.inf)
+
+    scheduler.dataset_finished(first)
+
+    third = scheduler.next_dataset()
+
+    assert {first, second, third} == set(datasets.keys())
+    assert scheduler.next_dataset() is None
+
+
+def test_scheduler_respects_min_interval():
+    datasets = make_datasets(["http://a.org/1", "http://a.org/2"])
+    scheduler = HostScheduler(datasets, max_per_host=10, min_interval=60)
+
+    scheduler.next_dataset()
+
+    with scheduler.condition:
+        dataset_id, wait = scheduler.take_next_ready_dataset()
+
+    assert dataset_id is None
+    assert 0 < wait <= 60
+
+
+def test_scheduler_async_hands_out_all_datasets():
+    datasets = make_datasets(["http://a.org/1", "http://a.org/2", "http://b.org/1", "http://c.org/1"])
+    scheduler = HostScheduler(datasets, max_per_host=1, min_interval=0.01)
+
+    async def take_all():
+        taken = []
+        while (dataset_id := await scheduler.next_dataset_async()) is not None:
+            taken.append(dataset_id)
+            scheduler.dataset_finished(dataset_id)
+        return taken
+
+    assert sorted(asyncio.run(take_all())) == sorted(datasets.keys())
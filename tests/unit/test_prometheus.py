@@ -0,0 +1,20 @@
+from unittest import mock
+
+from utilities.prometheus import update_db_pool_metrics
+
+
+def test_update_db_pool_metrics():
+    db_pool = mock.Mock()
+    db_pool.get_stats.return_value = {"pool_min": 1, "pool_max": 27, "pool_size": 5, "pool_available": 2}
+
+    prom_metrics = {
+        metric: mock.Mock()
+        for metric in ["db_pool_size", "db_pool_available", "db_pool_requests_waiting", "db_pool_max"]
+    }
+
+    update_db_pool_metrics({"db_pool": db_pool, "prom_metrics": prom_metrics})
+
+    prom_metrics["db_pool_size"].set.assert_called_once_with(5)
+    prom_metrics["db_pool_available"].set.assert_called_once_with(2)
+    prom_metrics["db_pool_requests_waiting"].set.assert_called_once_with(0)
+    prom_metrics["db_pool_max"].set.assert_called_once_with(27)
@@ -0,0 +1,44 @@
+import datetime
+from unittest import mock
+
+from dataset_registration.publisher_metadata_cache import PublisherMetadataCache
+
+TTL = datetime.timedelta(hours=24)
+
+
+def get_publisher(cache, cache_file, fetch_metadata, publisher_name="3fi"):
+    return cache.get(mock.Mock(), publisher_name, TTL, cache_file, fetch_metadata)
+
+
+def test_publisher_metadata_fetched_once_within_ttl():
+    cache = PublisherMetadataCache()
+    fetch_metadata = mock.Mock(return_value={"3fi": '{"name": "3fi"}'})
+
+    assert get_publisher(cache, "", fetch_metadata) == '{"name": "3fi"}'
+    assert get_publisher(cache, "", fetch_metadata, "unknown_publisher") == "{}"
+    assert fetch_metadata.call_count == 1
+
+
+def test_stale_publisher_metadata_kept_when_refresh_fails():
+    cache = PublisherMetadataCache()
+    get_publisher(cache, "", mock.Mock(return_value={"3fi": '{"name": "3fi"}'}))
+
+    cache.last_refresh -= TTL * 2
+    cache.last_refresh_attempt -= TTL * 2
+    fetch_metadata = mock.Mock(side_effect=RuntimeError("HTTP status code 500"))
+
+    assert get_publisher(cache, "", fetch_metadata) == '{"name": "3fi"}'
+    assert get_publisher(cache, "", fetch_metadata) == '{"name": "3fi"}'
+    # a failed refresh isn't retried on every request for metadata
+    assert fetch_metadata.call_count == 1
+
+
+def test_publisher_metadata_loaded_from_cache_file_after_restart(tmp_path):
+    cache_file = str(tmp_path / "publisher-metadata.json.gz")
+
+    get_publisher(PublisherMetadataCache(), cache_file, mock.Mock(return_value={"3fi": '{"name": "3fi"}'}))
+
+    fetch_metadata = mock.Mock()
+
+    assert get_publisher(PublisherMetadataCache(), cache_file, fetch_metadata) == '{"name": "3fi"}'
+    fetch_metadata.assert_not_called()
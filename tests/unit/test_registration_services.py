@@ -0,0 +1,104 @@
+import uuid
+from unittest import mock
+
+import pytest
+import requests
+
+from dataset_registration.registration_services import get_registered_datasets
+
+
+def get_registered_dataset():
+    dataset_id = uuid.UUID("c8a40aa5-9f31-4bcf-a36f-51c1fc2cc159")
+    return {
+        dataset_id: {
+            "id": dataset_id,
+            "name": "test_foundation_a-dataset-001",
+            "publisher_id": uuid.UUID("4a5a0b4c-f8c8-4a24-8a7d-ac3e2c4e0e8d"),
+            "publisher_name": "test_foundation_a",
+            "source_url": "http://localhost:3000/data/test_foundation_a-dataset-001.xml",
+            "type": "activity",
+            "registration_service_dataset_metadata": "{}",
+            "registration_service_publisher_metadata": "{}",
+            "registration_service_name": "ckan-registry",
+        }
+    }
+
+
+def get_context(tmp_path, run_for_n_datasets=None, replay_registration_snapshot=None):
+    return {
+        "DATA_REGISTRATION": "ckan-registry",
+        "DATA_REGISTRY_SNAPSHOT_FILE": str(tmp_path / "snapshot.json.gz"),
+        "run_for_n_datasets": run_for_n_datasets,
+        "replay_registration_snapshot": replay_registration_snapshot,
+        "logger": mock.Mock(),
+    }
+
+
+def set_fetch_datasets_metadata(monkeypatch, fetch_datasets_metadata):
+    monkeypatch.setattr(
+        "dataset_registration.registration_services.get_func_to_fetch_list_registered_datasets",
+        lambda context: fetch_datasets_metadata,
+    )
+
+
+def fail_to_fetch_datasets_metadata(context, session):
+    raise RuntimeError("HTTP status code 500")
+
+
+def test_registration_snapshot_used_when_registration_service_fails(tmp_path, monkeypatch):
+    context = get_context(tmp_path)
+
+    set_fetch_datasets_metadata(monkeypatch, lambda context, session: get_registered_dataset())
+    assert get_registered_datasets(context) == get_registered_dataset()
+
+    set_fetch_datasets_metadata(monkeypatch, fail_to_fetch_datasets_metadata)
+    assert get_registered_datasets(context) == get_registered_dataset()
+
+
+def test_registration_snapshot_used_when_registration_service_unreachable(tmp_path, monkeypatch):
+    context = get_context(tmp_path)
+
+    set_fetch_datasets_metadata(monkeypatch, lambda context, session: get_registered_dataset())
+    get_registered_datasets(context)
+
+    set_fetch_datasets_metadata(monkeypatch, mock.Mock(side_effect=requests.ConnectionError("Connection refused")))
+    assert get_registered_datasets(context) == get_registered_dataset()
+
+
+def test_registration_service_connection_error_raised_as_runtime_error_when_no_snapshot(tmp_path, monkeypatch):
+    context = get_context(tmp_path)
+
+    set_fetch_datasets_metadata(monkeypatch, mock.Mock(side_effect=requests.Timeout("Read timed out")))
+
+    with pytest.raises(RuntimeError):
+        get_registered_datasets(context)
+
+
+def test_registration_service_failure_raised_when_no_snapshot(tmp_path, monkeypatch):
+    context = get_context(tmp_path)
+
+    set_fetch_datasets_metadata(monkeypatch, fail_to_fetch_datasets_metadata)
+
+    with pytest.raises(RuntimeError):
+        get_registered_datasets(context)
+
+
+def test_registration_snapshot_not_saved_for_partial_run(tmp_path, monkeypatch):
+    context = get_context(tmp_path, run_for_n_datasets=1)
+
+    set_fetch_datasets_metadata(monkeypatch, lambda context, session: get_registered_dataset())
+    get_registered_datasets(context)
+
+    assert not (tmp_path / "snapshot.json.gz").exists()
+
+
+def test_registration_snapshot_replayed_without_registration_service(tmp_path, monkeypatch):
+    set_fetch_datasets_metadata(monkeypatch, lambda context, session: get_registered_dataset())
+    get_registered_datasets(get_context(tmp_path))
+
+    (tmp_path / "snapshot.json.gz").rename(tmp_path / "recorded.json.gz")
+
+    set_fetch_datasets_metadata(monkeypatch, mock.Mock(side_effect=AssertionError("registration service used")))
+    context = get_context(tmp_path, replay_registration_snapshot=str(tmp_path / "recorded.json.gz"))
+
+    assert get_registered_datasets(context) == get_registered_dataset()
@@ -0,0 +1,168 @@
+import io
+import os
+import threading
+import zipfile
+from unittest import mock
+
+import pytest
+from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.storage.blob import BlobBlock
+
+from utilities.azure import AzureBlockBlobWriter, azure_download_blob, azure_upload_file_in_blocks, get_block_ids
+from utilities.zip_writer import ZipWriter
+
+
+class FakeBlockBlobClient:
+    """Keeps staged blocks in memory, and fails to stage the blocks in fail_once the first time"""
+
+    blob_name = "iati-data.zip"
+
+    def __init__(self, fail_once: set[int]):
+        self.fail_once = fail_once
+        self.staged: dict[str, bytes] = {}
+        self.stage_calls: list[str] = []
+        self.committed = b""
+        self.lock = threading.Lock()
+
+    def get_block_list(self, block_list_type):
+        if len(self.staged) == 0:
+            raise ResourceNotFoundError("blob not found")
+        return [], [BlobBlock(block_id=block_id) for block_id in self.staged]
+
+    def stage_block(self, block_id, data, length):
+        with self.lock:
+            self.stage_calls.append(block_id)
+            block_index = int(block_id.split("-")[1])
+            if block_index in self.fail_once:
+                self.fail_once.remove(block_index)
+                raise AzureError("transient failure")
+            self.staged[block_id] = data.read(length)
+
+    def commit_block_list(self, block_list, content_settings):
+        self.committed = b"".join(self.staged[block.id] for block in block_list)
+
+
+def test_get_block_ids(tmp_path):
+    local_file = tmp_path / "iati-data.zip"
+    local_file.write_bytes(b"x" * 25)
+
+    block_ids = get_block_ids(str(local_file), 25, 10)
+
+    assert len(block_ids) == 3
+    assert len(set(block_ids)) == 3
+    assert len({len(block_id) for block_id in block_ids}) == 1
+    assert block_ids == get_block_ids(str(local_file), 25, 10)
+
+
+def test_upload_file_in_blocks_resumes_after_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr("utilities.azure.time.sleep", lambda seconds: None)
+
+    content = bytes(range(256)) * 10
+    local_file = tmp_path / "iati-data.zip"
+    local_file.write_bytes(content)
+
+    blob_client = FakeBlockBlobClient(fail_once={3})
+
+    azure_upload_file_in_blocks({"logger": mock.Mock()}, blob_client, str(local_file), None, 500, 2)
+
+    assert blob_client.committed == content
+    # 6 blocks staged in the first attempt, of which block 3 failed, then only block 3 in the second
+    assert len(blob_client.stage_calls) == 7
+
+
+def test_upload_file_in_blocks_does_not_reuse_blocks_staged_with_other_block_size(tmp_path, monkeypatch):
+    content = bytes(range(256)) * 10
+    local_file = tmp_path / "iati-data.zip"
+    local_file.write_bytes(content)
+
+    # blocks of 500 bytes were staged by an earlier, interrupted upload
+    blob_client = FakeBlockBlobClient(fail_once=set())
+    azure_upload_file_in_blocks({"logger": mock.Mock()}, blob_client, str(local_file), None, 500, 2)
+    blob_client.committed = b""
+    blob_client.stage_calls = []
+
+    azure_upload_file_in_blocks({"logger": mock.Mock()}, blob_client, str(local_file), None, 400, 2)
+
+    assert blob_client.committed == content
+    assert len(blob_client.stage_calls) == 7
+
+
+def test_block_blob_writer_streams_zip(tmp_path, monkeypatch):
+    monkeypatch.setattr("utilities.azure.time.sleep", lambda seconds: None)
+
+    xml = b"<iati-activities>" + bytes(range(256)) * 20 + b"</iati-activities>"
+    (tmp_path / "dataset.xml").write_bytes(xml)
+    with zipfile.ZipFile(tmp_path / "dataset.zip", "w", compression=zipfile.ZIP_DEFLATED) as dataset_zip:
+        dataset_zip.writestr("dataset.xml", xml)
+    dataset_zip_info = zipfile.ZipFile(tmp_path / "dataset.zip").getinfo("dataset.xml")
+
+    blob_client = FakeBlockBlobClient(fail_once={2})
+    context = {"logger": mock.Mock()}
+
+    with AzureBlockBlobWriter(context, blob_client, 500, 2) as block_writer:
+        zip_stream = io.BufferedWriter(block_writer, buffer_size=100)
+        with ZipWriter(zip_stream, context["logger"]) as zip_writer:
+            zip_writer.add_directory("iati-data")
+            zip_writer.add_file("iati-data/compressed.xml", str(tmp_path / "dataset.xml"))
+            zip_writer.add_compressed_member(
+                "iati-data/copied.xml", str(tmp_path / "dataset.zip"), dataset_zip_info, str(tmp_path / "dataset.xml")
+            )
+        zip_stream.flush()
+
+        assert blob_client.committed == b""
+
+        block_writer.commit(None)
+
+    assert len(blob_client.staged) > 2
+
+    with zipfile.ZipFile(io.BytesIO(blob_client.committed)) as uploaded_zip:
+        assert uploaded_zip.testzip() is None
+        assert uploaded_zip.namelist() == ["iati-data/", "iati-data/compressed.xml", "iati-data/copied.xml"]
+        assert uploaded_zip.read("iati-data/compressed.xml") == xml
+        assert uploaded_zip.read("iati-data/copied.xml") == xml
+
+
+class FakeDownloadBlobClient:
+    """Writes content to the stream given to readinto in chunks, then raises error (if not None)"""
+
+    def __init__(self, content: bytes, error: Exception | None = None):
+        self.content = content
+        self.error = error
+
+    def download_blob(self):
+        return self
+
+    def readinto(self, stream):
+        for offset in range(0, len(self.content), 100):
+            stream.write(self.content[offset : offset + 100])
+        if self.error is not None:
+            raise self.error
+        return len(self.content)
+
+    def close(self):
+        pass
+
+
+def test_download_blob_streams_to_file(tmp_path):
+    az_blob_service = mock.Mock()
+    az_blob_service.get_blob_client.return_value = FakeDownloadBlobClient(b"<iati-activities/>" * 50)
+
+    azure_download_blob(az_blob_service, "iati-xml", "publisher/dataset.xml", str(tmp_path / "dataset.xml"))
+
+    assert (tmp_path / "dataset.xml").read_bytes() == b"<iati-activities/>" * 50
+    assert os.listdir(tmp_path) == ["dataset.xml"]
+
+
+def test_download_blob_leaves_no_partial_file_on_failure(tmp_path):
+    (tmp_path / "dataset.xml").write_bytes(b"<iati-activities>previous</iati-activities>")
+
+    az_blob_service = mock.Mock()
+    az_blob_service.get_blob_client.return_value = FakeDownloadBlobClient(
+        b"<iati-activities/>" * 50, AzureError("connection reset")
+    )
+
+    with pytest.raises(AzureError):
+        azure_download_blob(az_blob_service, "iati-xml", "publisher/dataset.xml", str(tmp_path / "dataset.xml"))
+
+    assert (tmp_path / "dataset.xml").read_bytes() == b"<iati-activities>previous</iati-activities>"
+    assert os.listdir(tmp_path) == ["dataset.xml"]
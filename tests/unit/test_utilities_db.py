@@ -0,0 +1,162 @@
+import uuid
+from unittest import mock
+
+import psycopg
+import pytest
+
+from utilities.bds_dataset import BDSDataset
+from utilities.db import DatasetWriteBuffer, write_dataset_changes
+
+
+def make_write_buffer(
+    monkeypatch, max_size: int, max_seconds: float
+) -> tuple[DatasetWriteBuffer, list[list[tuple[bool, dict]]]]:
+    writes: list[list[tuple[bool, dict]]] = []
+    db_writer = DatasetWriteBuffer({"logger": mock.Mock(), "db_pool": mock.MagicMock()}, max_size, max_seconds)
+    monkeypatch.setattr("utilities.db.write_dataset_changes", lambda connection, changes: writes.append(changes))
+    return db_writer, writes
+
+
+def test_write_buffer_writes_when_full(monkeypatch):
+    db_writer, writes = make_write_buffer(monkeypatch, max_size=2, max_seconds=3600)
+
+    db_writer.add({"id": uuid.uuid4()})
+    assert writes == []
+
+    db_writer.add({"id": uuid.uuid4()})
+    assert len(writes) == 1 and len(writes[0]) == 2
+
+
+def test_write_buffer_writes_after_max_seconds(monkeypatch):
+    db_writer, writes = make_write_buffer(monkeypatch, max_size=100, max_seconds=0)
+
+    db_writer.add({"id": uuid.uuid4()})
+
+    assert len(writes) == 1
+
+
+def test_write_buffer_keeps_latest_copy_of_each_dataset(monkeypatch):
+    db_writer, writes = make_write_buffer(monkeypatch, max_size=100, max_seconds=3600)
+
+    dataset = {"id": uuid.uuid4(), "hash": "first"}
+    db_writer.add(dataset)
+    dataset["hash"] = "second"
+    db_writer.add(dataset)
+    dataset["hash"] = "changed after add"
+
+    db_writer.flush()
+
+    assert writes == [[(True, {"id": dataset["id"], "hash": "second"})]]
+
+
+def test_write_buffer_merges_changed_fields_of_dataset_in_db(monkeypatch):
+    db_writer, writes = make_write_buffer(monkeypatch, max_size=100, max_seconds=3600)
+
+    dataset = BDSDataset(
+        {"id": uuid.uuid4(), "hash": "a", "last_update_check": 1, "registration_service_dataset_metadata": "{}"},
+        in_db=True,
+    )
+    dataset["hash"] = "b"
+    db_writer.add(dataset)
+    dataset["last_update_check"] = 2
+    db_writer.add(dataset)
+
+    db_writer.flush()
+
+    assert writes == [[(False, {"id": dataset["id"], "hash": "b", "last_update_check": 2})]]
+
+
+def test_write_buffer_full_write_of_new_dataset_includes_later_changes(monkeypatch):
+    db_writer, writes = make_write_buffer(monkeypatch, max_size=100, max_seconds=3600)
+
+    dataset = BDSDataset({"id": uuid.uuid4(), "hash": None, "last_update_check": 1})
+    db_writer.add(dataset)
+    dataset["hash"] = "b"
+    db_writer.add(dataset)
+
+    db_writer.flush()
+
+    assert writes == [[(True, {"id": dataset["id"], "hash": "b", "last_update_check": 1})]]
+
+
+def test_write_buffer_puts_back_changes_when_write_fails(monkeypatch):
+    writes: list[list[tuple[bool, dict]]] = []
+
+    def fail_to_write_dataset_changes(connection, dataset_changes):
+        raise psycopg.OperationalError("connection lost")
+
+    context = {"logger": mock.Mock(), "db_pool": mock.MagicMock()}
+    db_writer = DatasetWriteBuffer(context, max_size=2, max_seconds=3600)
+
+    monkeypatch.setattr("utilities.db.write_dataset_changes", fail_to_write_dataset_changes)
+
+    first, second = {"id": uuid.uuid4(), "hash": "a"}, {"id": uuid.uuid4(), "hash": "b"}
+    db_writer.add(first)
+    # the failure is logged, not raised against the dataset which happened to fill the buffer
+    db_writer.add(second)
+    context["logger"].error.assert_called_once()
+
+    first["hash"] = "c"
+    db_writer.add(first)
+
+    with pytest.raises(psycopg.OperationalError):
+        db_writer.flush()
+
+    monkeypatch.setattr("utilities.db.write_dataset_changes", lambda connection, changes: writes.append(changes))
+    db_writer.flush()
+
+    assert sorted(writes[0], key=lambda change: change[1]["hash"]) == [
+        (True, {"id": second["id"], "hash": "b"}),
+        (True, {"id": first["id"], "hash": "c"}),
+    ]
+
+
+def test_write_buffer_marks_dataset_saved_only_when_write_succeeds(monkeypatch):
+    context = {"logger": mock.Mock(), "db_pool": mock.MagicMock()}
+    db_writer = DatasetWriteBuffer(context, max_size=100, max_seconds=3600)
+
+    monkeypatch.setattr("utilities.db.write_dataset_changes", mock.Mock(side_effect=psycopg.OperationalError()))
+
+    dataset = BDSDataset({"id": uuid.uuid4(), "hash": "a"})
+    db_writer.add(dataset)
+
+    with pytest.raises(psycopg.OperationalError):
+        db_writer.flush()
+
+    # a new dataset whose INSERT failed is still written in full next time
+    assert not dataset.in_db
+    assert db_writer.take_pending() == [(dataset, True, {"id": dataset["id"], "hash": "a"})]
+
+    db_writer, writes = make_write_buffer(monkeypatch, max_size=100, max_seconds=3600)
+    db_writer.add(dataset)
+    db_writer.flush()
+
+    assert writes == [[(True, {"id": dataset["id"], "hash": "a"})]]
+    assert dataset.in_db and dataset.changed_fields == set()
+
+
+def test_write_dataset_changes_only_updates_changed_fields():
+    connection = mock.Mock()
+    dataset_id = uuid.uuid4()
+
+    write_dataset_changes(connection, [
+        (False, {"id": dataset_id, "last_update_check": 2, "hash": "b"}),
+        (False, {"id": uuid.uuid4()}),
+    ])
+
+    connection.cursor().executemany.assert_called_once_with(
+        "UPDATE iati_datasets SET hash = %(hash)s, last_update_check = %(last_update_check)s WHERE id = %(id)s",
+        [{"id": dataset_id, "last_update_check": 2, "hash": "b"}],
+    )
+    connection.commit.assert_called_once()
+
+
+def test_write_buffer_flush_empties_buffer(monkeypatch):
+    db_writer, writes = make_write_buffer(monkeypatch, max_size=100, max_seconds=3600)
+
+    db_writer.add({"id": uuid.uuid4()})
+    db_writer.flush()
+    db_writer.flush()
+
+    # nothing is left to write the second time
+    assert len(writes) == 1
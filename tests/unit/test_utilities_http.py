@@ -1,8 +1,21 @@
+import asyncio
 import datetime
+import gzip
+import io
+import json
+from unittest import mock
 
 import pytest
+import requests
+from urllib3.response import HTTPResponse
 
-from utilities.http import parse_last_modified_header
+from utilities.http import (
+    format_http_date,
+    get_conditional_request_headers,
+    http_get_json_items,
+    http_request_with_retries_async,
+    parse_last_modified_header,
+)
 
 
 @pytest.mark.parametrize("input,expected", [
@@ -13,3 +26,53 @@ from utilities.http import parse_last_modified_header
 ])
 def test_parse_http_last_modified_header(input, expected):
     assert parse_last_modified_header(input) == expected
+
+
+@pytest.mark.parametrize("etag,last_modified,expected", [
+    (None, None, {}),
+    ('"abc123"', None, {"If-None-Match": '"abc123"'}),
+    (None, datetime.datetime(2024, 9, 6, 13, 8, 28, 0, datetime.timezone.utc),
+        {"If-Modified-Since": "Fri, 06 Sep 2024 13:08:28 GMT"}),
+    ('"abc123"', datetime.datetime(2024, 9, 6, 14, 8, 28, 0, datetime.timezone(datetime.timedelta(hours=1))),
+        {"If-None-Match": '"abc123"', "If-Modified-Since": "Fri, 06 Sep 2024 13:08:28 GMT"}),
+])
+def test_get_conditional_request_headers(etag, last_modified, expected):
+    assert get_conditional_request_headers(etag, last_modified) == expected
+
+
+def test_format_http_date_round_trips_with_parse():
+    header = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert format_http_date(parse_last_modified_header(header)) == header
+
+
+@pytest.mark.parametrize("content_encoding", [None, "gzip"])
+def test_http_get_json_items_streams_items_at_prefix(content_encoding):
+    document = {"result": {"count": 2, "results": [{"id": "a", "size": 1.5}, {"id": "b", "size": 2}]}}
+    body = json.dumps(document).encode("utf-8")
+    headers = {}
+    if content_encoding is not None:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = content_encoding
+
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = HTTPResponse(body=io.BytesIO(body), headers=headers, preload_content=False)
+
+    session = mock.Mock()
+    session.get.return_value = response
+
+    items = http_get_json_items(session, "http://registry/package_search", "result.results.item")
+
+    assert list(items) == document["result"]["results"]
+    assert session.get.call_args.kwargs["stream"] is True
+
+
+def test_http_request_with_retries_async_times_out_each_read_not_whole_request():
+    session = mock.Mock()
+    session.get = mock.AsyncMock()
+
+    asyncio.run(http_request_with_retries_async(session, "http://localhost/dataset.xml", 25, 2, None))
+
+    timeout = session.get.call_args.kwargs["timeout"]
+    assert timeout.total is None
+    assert timeout.sock_connect == 25 and timeout.sock_read == 25
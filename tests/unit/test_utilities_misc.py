@@ -1,9 +1,30 @@
+import hashlib
+import io
+import re
+import zipfile
+
 import pytest
 
-from utilities.misc import filter_dict_by_structure, get_hash, get_hash_excluding_generated_timestamp
+from utilities.misc import (
+    DatasetHasher,
+    filter_dict_by_structure,
+    get_file_md5,
+    unzip_single_file,
+    zip_file_as_single_file,
+)
+
+
+def get_dataset_hasher(content: bytes) -> DatasetHasher:
+    hasher = DatasetHasher()
+    hasher.update(content)
+    return hasher
+
+
+def regex_hash_excluding_generated_timestamp(content: bytes) -> str:
+    return hashlib.sha1(re.sub(rb'generated-datetime="[^"]+"', b"", content)).hexdigest()
 
 
-def test_get_hash():
+def test_dataset_hasher_hash():
 
     # this is the actual content of one of the smallest IATI Activity XML files.
     # Do not change the number of empty lines.
@@ -24,12 +45,12 @@ def test_get_hash():
 </iati-activities>
 """
 
-    hash = get_hash(yiplActivitiesXmlFile)
+    hash = get_dataset_hasher(yiplActivitiesXmlFile.encode("utf-8")).hexdigest()
 
     assert(hash == "3486d4cee556d2584020bed2c86305465b8b3880")
 
 
-def test_get_hash_excluding_generated_timestamp():
+def test_dataset_hasher_hash_excluding_generated_timestamp():
 
     # this is the actual content of one of the smallest IATI Activity XML files.
     # Do not change the number of empty lines.
@@ -50,11 +71,89 @@ def test_get_hash_excluding_generated_timestamp():
 </iati-activities>
 """
 
-    hash = get_hash_excluding_generated_timestamp(yiplActivitiesXmlFile)
+    hash = get_dataset_hasher(yiplActivitiesXmlFile.encode("utf-8")).hexdigest_excluding_generated_timestamp()
 
     assert(hash == "759eaa39276381f3fc146232cefd2111a2abc199")
 
 
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 100000])
+def test_dataset_hasher_matches_whole_content_hashes(chunk_size):
+
+    xml = """<?xml version="1.0"?>
+<iati-activities version="2.03" generated-datetime="2024-05-03T08:47:49+00:00">
+<iati-activity last-updated-datetime="2024-05-01T00:00:00Z"><title>Café</title></iati-activity>
+</iati-activities>
+"""
+    xml_bytes = xml.encode("utf-8")
+
+    hasher = DatasetHasher()
+    for i in range(0, len(xml_bytes), chunk_size):
+        hasher.update(xml_bytes[i:i + chunk_size])
+
+    assert hasher.hexdigest() == hashlib.sha1(xml_bytes).hexdigest()
+    assert hasher.hexdigest_excluding_generated_timestamp() == regex_hash_excluding_generated_timestamp(xml_bytes)
+
+
+@pytest.mark.parametrize("xml_bytes", [
+    b'<iati-activities generated-datetime="2024-05-03T08:47:49+00:00"></iati-activities>',
+    b'<iati-activities generated-datetime="2024-05-03" x="1"><a generated-datetime="2024"/></iati-activities>',
+    b'<iati-activities generated-datetime=""></iati-activities>',
+    b'<iati-activities generated-generated-datetime="2024"></iati-activities>',
+    b'<iati-activities></iati-activities> generated-datetime="unterminated',
+    b'<iati-activities></iati-activities> generated-date',
+])
+def test_dataset_hasher_attribute_split_at_every_offset(xml_bytes):
+
+    for split in range(len(xml_bytes) + 1):
+        hasher = DatasetHasher()
+        hasher.update(xml_bytes[:split])
+        hasher.update(xml_bytes[split:])
+
+        assert hasher.hexdigest() == hashlib.sha1(xml_bytes).hexdigest()
+        assert hasher.hexdigest_excluding_generated_timestamp() == regex_hash_excluding_generated_timestamp(xml_bytes)
+
+
+def test_dataset_hasher_content_md5():
+
+    hasher = DatasetHasher()
+    hasher.update(b"<iati-activities>")
+    hasher.update(b"</iati-activities>")
+
+    assert hasher.content_md5() == hashlib.md5(b"<iati-activities></iati-activities>").digest()
+
+
+def test_get_file_md5():
+
+    source = io.BytesIO(b"<iati-activities></iati-activities>")
+    source.seek(10)
+
+    assert get_file_md5(source) == hashlib.md5(b"<iati-activities></iati-activities>").digest()
+    assert source.tell() == 0
+
+
+def test_zip_file_as_single_file():
+
+    source = io.BytesIO(b"<iati-activities></iati-activities>")
+    zip_output = io.BytesIO()
+
+    zip_file_as_single_file("dataset.xml", source, zip_output)
+
+    with zipfile.ZipFile(zip_output) as zipped:
+        assert zipped.namelist() == ["dataset.xml"]
+        assert zipped.getinfo("dataset.xml").compress_type == zipfile.ZIP_DEFLATED
+        assert zipped.read("dataset.xml") == b"<iati-activities></iati-activities>"
+
+
+def test_unzip_single_file(tmp_path):
+
+    with open(tmp_path / "dataset.zip", "wb") as zip_output:
+        zip_file_as_single_file("dataset.xml", io.BytesIO(b"<iati-activities></iati-activities>"), zip_output)
+
+    unzip_single_file(str(tmp_path / "dataset.zip"), str(tmp_path / "dataset.xml"))
+
+    assert (tmp_path / "dataset.xml").read_bytes() == b"<iati-activities></iati-activities>"
+
+
 @pytest.mark.parametrize("input,structure,expected", [
     ({"a": 10}, {"a" : None}, {"a": 10}),
     ({"a": None}, {"a" : None}, {"a": None}),
@@ -0,0 +1,94 @@
+import io
+import logging
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from utilities.zip_writer import ZipWriter, get_member_data_offset
+
+XML = b"<iati-activities>" + b"<iati-activity/>" * 1000 + b"</iati-activities>"
+
+
+def make_zip(pathname, files: dict[str, bytes]):
+    with zipfile.ZipFile(pathname, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in files.items():
+            zip_file.writestr(name, data)
+
+
+def test_add_compressed_member_copies_member_without_recompressing(tmp_path):
+    make_zip(tmp_path / "source.zip", {"old/dataset.xml": XML})
+    source_info = zipfile.ZipFile(tmp_path / "source.zip").getinfo("old/dataset.xml")
+
+    (tmp_path / "dataset.xml").write_bytes(XML)
+    (tmp_path / "other.xml").write_bytes(b"<iati-organisations/>")
+
+    output_fileobj = io.BytesIO()
+    with ZipWriter(output_fileobj, logging.getLogger("test")) as zip_writer:
+        zip_writer.add_directory("iati-data")
+        zip_writer.add_compressed_member(
+            "iati-data/dataset.xml", str(tmp_path / "source.zip"), source_info, str(tmp_path / "dataset.xml")
+        )
+        zip_writer.add_file("iati-data/other.xml", str(tmp_path / "other.xml"))
+
+    output_zip = zipfile.ZipFile(output_fileobj)
+
+    assert output_zip.testzip() is None
+    assert output_zip.namelist() == ["iati-data/", "iati-data/dataset.xml", "iati-data/other.xml"]
+    assert output_zip.read("iati-data/dataset.xml") == XML
+    assert output_zip.read("iati-data/other.xml") == b"<iati-organisations/>"
+
+    output_info = output_zip.getinfo("iati-data/dataset.xml")
+    assert output_info.compress_size == source_info.compress_size
+    assert output_info.CRC == source_info.CRC
+
+    with open(tmp_path / "source.zip", "rb") as source_fileobj:
+        source_fileobj.seek(get_member_data_offset(source_fileobj, source_info))
+        output_fileobj.seek(get_member_data_offset(output_fileobj, output_info))
+        assert output_fileobj.read(output_info.compress_size) == source_fileobj.read(source_info.compress_size)
+
+
+def test_add_compressed_member_compresses_file_if_copy_fails(tmp_path):
+    make_zip(tmp_path / "source.zip", {"dataset.xml": XML})
+    source_info = zipfile.ZipFile(tmp_path / "source.zip").getinfo("dataset.xml")
+
+    source_zip = (tmp_path / "source.zip").read_bytes()
+    (tmp_path / "truncated.zip").write_bytes(source_zip[: source_info.header_offset + 50])
+    (tmp_path / "dataset.xml").write_bytes(XML)
+
+    output_fileobj = io.BytesIO()
+    with ZipWriter(output_fileobj, logging.getLogger("test")) as zip_writer:
+        zip_writer.add_compressed_member(
+            "dataset.xml", str(tmp_path / "truncated.zip"), source_info, str(tmp_path / "dataset.xml")
+        )
+        zip_writer.add_compressed_member(
+            "copied.xml", str(tmp_path / "source.zip"), source_info, str(tmp_path / "dataset.xml")
+        )
+
+    output_zip = zipfile.ZipFile(output_fileobj)
+
+    assert output_zip.testzip() is None
+    assert output_zip.namelist() == ["dataset.xml", "copied.xml"]
+    assert output_zip.read("dataset.xml") == XML
+    assert output_zip.read("copied.xml") == XML
+
+
+def test_add_file_with_executor_writes_members_in_order(tmp_path):
+    files = {"dataset-{}.xml".format(number): XML * number for number in range(1, 11)}
+
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+
+    output_fileobj = io.BytesIO()
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as executor:
+        with ZipWriter(output_fileobj, logging.getLogger("test"), executor, max_pending=3) as zip_writer:
+            zip_writer.add_directory("iati-data")
+            for name in files:
+                zip_writer.add_file("iati-data/" + name, str(tmp_path / name))
+
+    output_zip = zipfile.ZipFile(output_fileobj)
+
+    assert output_zip.testzip() is None
+    assert output_zip.namelist() == ["iati-data/"] + ["iati-data/" + name for name in files]
+    for name, data in files.items():
+        assert output_zip.getinfo("iati-data/" + name).compress_type == zipfile.ZIP_DEFLATED
+        assert output_zip.read("iati-data/" + name) == data
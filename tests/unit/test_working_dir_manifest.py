@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from bulk_data_service.working_dir_manifest import (
+    get_working_dir_manifest_pathname,
+    load_working_dir_manifest,
+    save_working_dir_manifest,
+)
+from bulk_data_service.zipper import clean_working_dir
+from bulk_data_service.zippers import get_local_pathname_dataset_xml, get_local_pathname_dataset_zip
+
+XML = b"<iati-activities/>"
+XML_HASH = hashlib.sha1(XML).hexdigest()
+
+
+def make_dataset(name: str) -> dict:
+    return {"id": uuid.uuid4(), "name": name, "publisher_name": "test_publisher", "hash": XML_HASH}
+
+
+def write_file(pathname: str, data: bytes):
+    os.makedirs(os.path.dirname(pathname), exist_ok=True)
+    with open(pathname, "wb") as output_file:
+        output_file.write(data)
+
+
+def test_working_dir_manifest_round_trip(tmp_path):
+    context = {"logger": logging.getLogger("test"), "ZIP_WORKING_DIR": str(tmp_path / "zip-working-dir")}
+
+    datasets = {dataset["id"]: dataset for dataset in [make_dataset("first"), make_dataset("second")]}
+    for dataset in datasets.values():
+        write_file(get_local_pathname_dataset_xml(context, dataset), XML)
+
+    save_working_dir_manifest(context, datasets)
+
+    assert load_working_dir_manifest(context) == datasets
+
+
+def test_working_dir_manifest_leaves_out_datasets_whose_xml_has_changed(tmp_path):
+    context = {"logger": logging.getLogger("test"), "ZIP_WORKING_DIR": str(tmp_path / "zip-working-dir")}
+
+    unchanged = make_dataset("unchanged")
+    resized = make_dataset("resized")
+    corrupted = make_dataset("corrupted")
+    deleted = make_dataset("deleted")
+    not_downloaded = make_dataset("not_downloaded")
+    datasets = {dataset["id"]: dataset for dataset in [unchanged, resized, corrupted, deleted, not_downloaded]}
+
+    for dataset in [unchanged, resized, corrupted, deleted]:
+        write_file(get_local_pathname_dataset_xml(context, dataset), XML)
+
+    save_working_dir_manifest(context, datasets)
+
+    # the corrupted file is the same size, so is only detected by its hash
+    write_file(get_local_pathname_dataset_xml(context, resized), b"<iati-activities></iati-activities>")
+    write_file(get_local_pathname_dataset_xml(context, corrupted), b"<iati-activities\x00>")
+    os.remove(get_local_pathname_dataset_xml(context, deleted))
+
+    assert load_working_dir_manifest(context) == {unchanged["id"]: unchanged}
+
+
+def test_working_dir_manifest_ignored_if_missing_or_corrupt(tmp_path):
+    context = {"logger": logging.getLogger("test"), "ZIP_WORKING_DIR": str(tmp_path / "zip-working-dir")}
+
+    assert load_working_dir_manifest(context) == {}
+
+    write_file(get_working_dir_manifest_pathname(context), gzip.compress(b"[{not json"))
+
+    assert load_working_dir_manifest(context) == {}
+
+    for manifest in [[{"id": "not a uuid"}], [{"name": "no id"}], {"not": "a list"}, [None]]:
+        write_file(get_working_dir_manifest_pathname(context), gzip.compress(json.dumps(manifest).encode("utf-8")))
+
+        assert load_working_dir_manifest(context) == {}
+
+
+def test_clean_working_dir_removes_files_not_in_manifest(tmp_path):
+    context = {"logger": logging.getLogger("test"), "ZIP_WORKING_DIR": str(tmp_path / "zip-working-dir")}
+
+    tracked = make_dataset("tracked")
+    untracked = make_dataset("untracked")
+
+    for dataset in [tracked, untracked]:
+        write_file(get_local_pathname_dataset_xml(context, dataset), XML)
+        write_file(get_local_pathname_dataset_zip(context, dataset), b"PK")
+
+    clean_working_dir(context, {tracked["id"]: tracked})
+
+    assert os.path.exists(get_local_pathname_dataset_xml(context, tracked))
+    assert os.path.exists(get_local_pathname_dataset_zip(context, tracked))
+    assert not os.path.exists(get_local_pathname_dataset_xml(context, untracked))
+    assert not os.path.exists(get_local_pathname_dataset_zip(context, untracked))
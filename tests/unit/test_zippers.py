@@ -0,0 +1,151 @@
+import io
+import logging
+import os
+import uuid
+import zipfile
+
+from bulk_data_service.zippers import (
+    CodeforIATILegacyZipper,
+    IATIBulkDataServiceZipper,
+    get_local_pathname_dataset_xml,
+    get_local_pathname_dataset_zip,
+)
+from utilities.misc import zip_file_as_single_file
+
+
+def make_dataset(name: str, hash: str) -> dict:
+    return {"id": uuid.uuid4(), "name": name, "publisher_name": "test_publisher", "hash": hash}
+
+
+def write_dataset_xml(context: dict, dataset: dict, xml: bytes):
+    pathname = get_local_pathname_dataset_xml(context, dataset)
+    os.makedirs(os.path.dirname(pathname), exist_ok=True)
+    with open(pathname, "wb") as xml_file:
+        xml_file.write(xml)
+
+
+def test_zip_reuses_unchanged_datasets_from_previous_zip(tmp_path):
+    context = {"logger": logging.getLogger("test"), "ZIP_WORKING_DIR": str(tmp_path / "zip-working-dir")}
+    zip_working_dir = context["ZIP_WORKING_DIR"] + "-1"
+    os.makedirs(zip_working_dir)
+
+    unchanged = make_dataset("unchanged", "hash1")
+    updated = make_dataset("updated", "hash2")
+    datasets = {unchanged["id"]: unchanged, updated["id"]: updated}
+
+    write_dataset_xml(context, unchanged, b"<iati-activities>unchanged</iati-activities>")
+    write_dataset_xml(context, updated, b"<iati-activities>original</iati-activities>")
+
+    zipper = IATIBulkDataServiceZipper(context, zip_working_dir, datasets, datasets, set(datasets))
+    zipper.zip()
+
+    # an unchanged dataset is copied from the previous ZIP, even though its file has been replaced
+    write_dataset_xml(context, unchanged, b"<iati-activities>not read!</iati-activities>")
+    write_dataset_xml(context, updated, b"<iati-activities>updated</iati-activities>")
+
+    zipper = IATIBulkDataServiceZipper(context, zip_working_dir, datasets, datasets, {updated["id"]})
+    zipper.keep_previous_zip()
+    zipper.zip()
+
+    assert not os.path.exists(zipper.get_previous_zip_pathname())
+
+    with zipfile.ZipFile(zipper.get_zip_local_pathname()) as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == [
+            "iati-data/",
+            "iati-data/datasets/",
+            "iati-data/datasets/test_publisher/",
+            "iati-data/datasets/test_publisher/unchanged.xml",
+            "iati-data/datasets/test_publisher/updated.xml",
+        ]
+        assert zip_file.read("iati-data/datasets/test_publisher/unchanged.xml") == (
+            b"<iati-activities>unchanged</iati-activities>"
+        )
+        assert zip_file.read("iati-data/datasets/test_publisher/updated.xml") == (
+            b"<iati-activities>updated</iati-activities>"
+        )
+
+
+def test_zip_compresses_all_files_without_previous_zip(tmp_path):
+    context = {"logger": logging.getLogger("test"), "ZIP_WORKING_DIR": str(tmp_path / "zip-working-dir")}
+    zip_working_dir = context["ZIP_WORKING_DIR"] + "-1"
+    os.makedirs(zip_working_dir)
+
+    dataset = make_dataset("dataset", "hash1")
+    write_dataset_xml(context, dataset, b"<iati-activities/>")
+
+    zipper = IATIBulkDataServiceZipper(context, zip_working_dir, {dataset["id"]: dataset}, {}, set())
+    zipper.keep_previous_zip()
+    zipper.zip()
+
+    with zipfile.ZipFile(zipper.get_zip_local_pathname()) as zip_file:
+        assert zip_file.read("iati-data/datasets/test_publisher/dataset.xml") == b"<iati-activities/>"
+
+
+def test_zip_copies_new_datasets_from_dataset_zips(tmp_path):
+    context = {"logger": logging.getLogger("test"), "ZIP_WORKING_DIR": str(tmp_path / "zip-working-dir")}
+    zip_working_dir = context["ZIP_WORKING_DIR"] + "-1"
+    os.makedirs(zip_working_dir)
+
+    xml = b"<iati-activities>" + b"<iati-activity/>" * 1000 + b"</iati-activities>"
+    with_zip = make_dataset("with_zip", "hash1")
+    without_zip = make_dataset("without_zip", "hash2")
+    datasets = {with_zip["id"]: with_zip, without_zip["id"]: without_zip}
+
+    write_dataset_xml(context, with_zip, xml)
+    write_dataset_xml(context, without_zip, xml)
+
+    dataset_zip_pathname = get_local_pathname_dataset_zip(context, with_zip)
+    os.makedirs(os.path.dirname(dataset_zip_pathname))
+    with open(dataset_zip_pathname, "wb") as dataset_zip_fileobj:
+        zip_file_as_single_file("with_zip.xml", io.BytesIO(xml), dataset_zip_fileobj)
+
+    zipper = IATIBulkDataServiceZipper(context, zip_working_dir, datasets, datasets, set(datasets))
+    zipper.zip()
+
+    with zipfile.ZipFile(zipper.get_zip_local_pathname()) as zip_file, zipfile.ZipFile(
+        dataset_zip_pathname
+    ) as dataset_zip:
+        assert zip_file.testzip() is None
+        assert zip_file.read("iati-data/datasets/test_publisher/with_zip.xml") == xml
+        assert zip_file.read("iati-data/datasets/test_publisher/without_zip.xml") == xml
+        assert (
+            zip_file.getinfo("iati-data/datasets/test_publisher/with_zip.xml").compress_size
+            == dataset_zip.getinfo("with_zip.xml").compress_size
+        )
+
+
+def test_codeforiati_zip_layout(tmp_path):
+    context = {"logger": logging.getLogger("test"), "ZIP_WORKING_DIR": str(tmp_path / "zip-working-dir")}
+    zip_working_dir = context["ZIP_WORKING_DIR"] + "-2"
+    os.makedirs(zip_working_dir)
+
+    downloaded = make_dataset("downloaded", "hash1")
+    not_downloaded = make_dataset("not_downloaded", None)
+    for dataset in [downloaded, not_downloaded]:
+        dataset["registration_service_dataset_metadata"] = '{"id": "dataset-id", "name": "dataset-name"}'
+        dataset["registration_service_publisher_metadata"] = '{"id": "publisher-id", "name": "test_publisher"}'
+
+    write_dataset_xml(context, downloaded, b"<iati-activities/>")
+
+    zipper = CodeforIATILegacyZipper(
+        context,
+        zip_working_dir,
+        {downloaded["id"]: downloaded},
+        {downloaded["id"]: downloaded, not_downloaded["id"]: not_downloaded},
+        {downloaded["id"]},
+    )
+    zipper.prepare()
+    zipper.zip()
+
+    # the dataset XML is zipped from the shared ZIP working dir, not copied into the zipper's own
+    assert not os.path.exists(os.path.join(zip_working_dir, "iati-data-main/data/test_publisher/downloaded.xml"))
+
+    with zipfile.ZipFile(zipper.get_zip_local_pathname()) as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.read("iati-data-main/data/test_publisher/downloaded.xml") == b"<iati-activities/>"
+        assert zip_file.read("iati-data-main/data/test_publisher/not_downloaded.xml") == b""
+        assert "iati-data-main/metadata.json" in zip_file.namelist()
+        assert "iati-data-main/metadata/test_publisher.json" in zip_file.namelist()
+        assert "iati-data-main/metadata/test_publisher/downloaded.json" in zip_file.namelist()
+        assert not any(name.startswith("iati-data/") for name in zip_file.namelist())